@@ -64,6 +64,8 @@ class Action:
         '''
         Abstract method which has to be overloaded by each Action so that it collects and returns the expected metric, 
         according to the Action' configuration.
+        The Actions completed in the background (e.g. the emails sent by a delivery thread) can return a concurrent.futures.Future:
+        the Action is then considered failed (and retried by the Action dispatcher) if an exception is set on the Future.
         '''
         pass
     
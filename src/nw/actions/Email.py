@@ -14,10 +14,9 @@
 #    under the License.
 
 from nw.actions.Action import Action
+from nw.core.EmailDelivery import getEmailDelivery
+from nw.core.Utils import period2seconds
 
-import smtplib
-from email.MIMEMultipart import MIMEMultipart
-from email.MIMEText import MIMEText
 import os
 from logging import getLogger
 
@@ -44,7 +43,8 @@ class Email(Action):
                         'services_monitored',
                         'email_content_success',
                         'email_content_failed',
-                        'email_signature'
+                        'email_signature',
+                        'email_digest_window' # (string) period (e.g. "60s", "5m") during which the emails to the same recipients are grouped in one digest email (default is 0, each email is sent on its own)
                          ]
     
     def __init__(self, task_options):
@@ -54,27 +54,24 @@ class Email(Action):
         if not self._config.get('smtp_srv_url'):
             getLogger(__name__).info('Option "smtp_srv_url" is not provided to action Email, use default SMTP server (localhost)')
         self.smtp_srv_url = self._config.get('smtp_srv_url') or 'localhost'
+        # SMTP server settings, the emails sent to the same SMTP server share its connection (see nw.core.EmailDelivery)
+        self.smtp_settings = {
+                              'url': self.smtp_srv_url,
+                              'port': self._config.get('smtp_srv_port'),
+                              'login': self._config.get('smtp_srv_login'),
+                              'password': self._config.get('smtp_srv_password'),
+                              'tls': self._config.get('smtp_srv_tls'),
+                              'tls_keyfile': self._config.get('smtp_srv_tls_keyfile'),
+                              'tls_certfile': self._config.get('smtp_srv_tls_certfile')
+                              }
+        # If email_digest_window is not provided, send each email on its own
+        self.digest_window = period2seconds(self._config.get('email_digest_window')) if self._config.get('email_digest_window') else 0
 
 
     def process(self, state, conditions, thresholds, values):
         # TODO: improve the Email action (add template, options,...)     
-        # Build email header
-        # Add 'From' header
-        msg = MIMEMultipart()
-        msg['From'] = self._config.get('email_from_addr')
-        # Add 'To' header
-        if type(self._config.get('email_to_addrs')) is list:
-            msg['To'] = ','.join(self._config.get('email_to_addrs'))
-        elif type(self._config.get('email_to_addrs')) is str:
-            msg['To'] = self._config.get('email_to_addrs')
-        # Add 'Cc' header (if needed)
-        if self._config.get('email_cc_addrs'):
-            if type(self._config.get('email_cc_addrs')) is list:
-                msg['Cc'] = ','.join(self._config.get('email_cc_addrs'))
-            elif type(self._config.get('email_cc_addrs')) is str:
-                msg['Cc'] = self._config.get('email_cc_addrs')
-        # Add 'Subject' header
-        msg['Subject'] = self._config.get('email_subject') or ''
+        # Build email subject
+        subject = self._config.get('email_subject') or ''
         
         # Build email message (concatenate email header and email body)
         message = "Hello, \n\n"
@@ -89,41 +86,17 @@ class Email(Action):
 
         message += self._config.get("email_signature")
 
-        msg.attach(MIMEText(message, 'plain'))
-
-        # Send the email
-        try:           
-            # Connect to the SMTP server
-            self.smtp = smtplib.SMTP(self.smtp_srv_url, 
-                                    self._config.get('smtp_srv_port'))
-            
-            # Use TLS connection if required
-            if self._config.get('smtp_srv_tls'):
-                getLogger(__name__).debug('Use SSL')
-                self.smtp.starttls(self._config.get('smtp_srv_tls_keyfile'), self._config.get('smtp_srv_tls_certfile'))
-                
-            # Use credentials if required
-            if self._config.get('smtp_srv_login') and self._config.get('smtp_srv_password'):
-                getLogger(__name__).debug('Login to the SMTP server with credentials ' + self._config.get('smtp_srv_login') + ':' + self._config.get('smtp_srv_password'))
-                self.smtp.login(self._config.get('smtp_srv_login'), self._config.get('smtp_srv_password'))
-                
-            # Send the email
-            # TODO send mail to Cc too
-            self.smtp.sendmail(self._config.get('email_from_addr'), self._config.get('email_to_addrs'), msg.as_string())
-            getLogger(__name__).info('Email sent')
-            
-            # Close the connection with the SMTP
-            self.smtp.quit()
-            
-        except smtplib.SMTPConnectError:
-            getLogger(__name__).error('Not able to connect to SMTP server. Please check action Email configuration', exc_info=True)
-            raise
-        except smtplib.SMTPAuthenticationError:
-            getLogger(__name__).error('Not able to connect to SMTP server because of an authentication issue. Please check SMTP credentials in action Email configuration', exc_info=True)
-            raise
-        except:
-            getLogger(__name__).error('Unable to send email', exc_info=True)
-            raise
+        # Queue the email, it is sent in the background by the email delivery thread of the SMTP server (so that the task is not blocked
+        # while the email is sent). The returned Future fails if the email could not be sent, so that the Action dispatcher retries the Action.
+        future = getEmailDelivery().send(self.smtp_settings, 
+                                         self._config.get('email_from_addr'), 
+                                         self._config.get('email_to_addrs'), 
+                                         self._config.get('email_cc_addrs'), 
+                                         subject, 
+                                         message, 
+                                         self.digest_window)
+        getLogger(__name__).debug('Email "' + subject + '" queued')
+        return future
     
     
     # This function is called by __init__ of the abstract Action class, it verify during the object initialization if the Action' configuration is valid.
@@ -136,6 +109,13 @@ class Email(Action):
         if self._config.get('smtp_srv_tls_certfile') and not os.path.exists(self._config.get('smtp_srv_tls_certfile')):
             getLogger(__name__).error('Option "smtp_srv_tls_certfile" is provided to action Email, but the file is not accessible. Please check Email configuration.')
             return False
+        # If email_digest_window is provided, check that it is a valid period
+        if self._config.get('email_digest_window'):
+            try:
+                period2seconds(self._config.get('email_digest_window'))
+            except Exception:
+                getLogger(__name__).error('Option "email_digest_window" provided to action Email is not a valid period (e.g. "60s", "5m"). Please check Email configuration.')
+                return False
         return True
 
     def _constructResultMessage(self, conditions, thresholds, values):
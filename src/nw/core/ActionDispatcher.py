@@ -0,0 +1,358 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import heapq
+import Queue
+import collections
+import json
+import time
+from concurrent.futures import Future
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import period2seconds, stableHash
+from nw.core.Metrics import getMetrics
+
+
+'''
+This module implements the dispatcher of the Actions, so that the tasks do not wait for their Actions to be processed:
+    - the tasks queue their Actions and return at once,
+    - the Actions are processed by a pool of worker threads. The Actions of a task are always processed by the same worker, in the
+        order they have been queued (so that the actions_success of a task are not processed before its actions_failed),
+    - an Action which raises an error is retried later (exponential backoff), up to max_attempts times. The Actions completed in the
+        background (e.g. Email) return a Future from their process method: they are retried if an exception is set on the Future.
+        While an Action of a task waits for its retry, the next Actions of the task are held, and processed (in order) once the
+        retried Action succeeded or has been given up. Note: an Action completed in the background may fail after the next
+        Actions of its task have been processed (they are not held, as the workers do not wait for the Futures),
+    - the Actions which can not be processed (all the attempts failed, queue full or dispatcher stopped) are written to the dead
+        letter file (if configured), so that the alerts are not lost silently,
+    - the dispatcher counts the queued / processed / retried / dead Actions and measures their latency (see getStats).
+The dispatcher is configured in the 'action_dispatcher' section of the Night Watch main config file. With 0 workers, the Actions
+are processed by the tasks themselves (no queue, no retry: the failed Actions are written to the dead letter file at once).
+'''
+
+_default_workers = 4 # Default number of worker threads
+_default_queue_size = 1000 # Default maximum number of Actions waiting to be processed (split between the workers)
+_default_max_attempts = 5 # Default number of attempts to process an Action
+_default_retry_delay = 5 # Default time (in seconds) before the first retry of an Action (doubled for each next retry)
+_max_retry_delay = 600 # Maximum time (in seconds) between two attempts
+
+
+class ActionDispatcher:
+    def __init__(self, workers = _default_workers, queue_size = _default_queue_size, max_attempts = _default_max_attempts, retry_delay = _default_retry_delay, dead_letter_file = None):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.dead_letter_file = dead_letter_file
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._stats = {'queued': 0, 'processed': 0, 'retried': 0, 'dead': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+        # Actions waiting for a retry: heap of (time of the next attempt, sequence, _ActionJob)
+        self._retries = []
+        self._retries_sequence = 0
+        self._retries_condition = threading.Condition(self._lock)
+        # Tasks with Actions waiting for a retry: task name -> [number of Actions waiting for a retry, list of the next Actions held]
+        self._retrying = {}
+        self._dead_letter_lock = threading.Lock()
+        self._queues = []
+        # Held Actions released by each worker's task, processed by the worker before the Actions of its queue
+        self._ready = []
+        self._threads = []
+        for i in range(workers):
+            self._queues.append(Queue.Queue(max(queue_size // workers, 1)))
+            self._ready.append(collections.deque())
+            thread = threading.Thread(target = self._runWorker, args = (i,), name = 'ActionDispatcher-' + str(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        if workers:
+            self._retry_thread = threading.Thread(target = self._runRetries, name = 'ActionDispatcher-retries')
+            self._retry_thread.daemon = True
+            self._retry_thread.start()
+            getLogger(__name__).info('Action dispatcher started with ' + str(workers) + ' workers')
+
+    def dispatch(self, task_name, action, log_message, state, conditions, thresholds, values):
+        '''
+        Queue the Action of the task task_name to be processed with the given arguments, and return at once (or process it at once
+        if the dispatcher has no worker).
+        '''
+        job = _ActionJob(task_name, action, log_message, state, conditions, thresholds, values)
+        if not self.workers:
+            job.attempts += 1
+            self._processJob(job)
+            return
+        with self._lock:
+            self._stats['queued'] += 1
+        self._put(job)
+
+    def getStats(self):
+        '''
+        Return the statistics of the dispatcher: number of Actions waiting to be processed (queue_depth, including the Actions held
+        behind a retry of their task) and waiting for a retry (retry_depth), numbers of Actions queued, processed, retried and dead
+        since start, and average / maximum latency (in seconds) between the queuing of the Actions and the end of their processing.
+        '''
+        with self._lock:
+            stats = {
+                     'queue_depth': sum(q.qsize() for q in self._queues) + sum(len(ready) for ready in self._ready) + \
+                                    sum(len(held) for count, held in self._retrying.itervalues()),
+                     'retry_depth': len(self._retries),
+                     'queued': self._stats['queued'],
+                     'processed': self._stats['processed'],
+                     'retried': self._stats['retried'],
+                     'dead': self._stats['dead'],
+                     'latency_avg': self._stats['latency_total'] / self._stats['processed'] if self._stats['processed'] else 0.0,
+                     'latency_max': self._stats['latency_max']
+                     }
+        return stats
+
+    def stop(self, timeout = None):
+        '''
+        Process the queued Actions and stop the workers, waiting at most timeout seconds. The Actions waiting for a retry are
+        written to the dead letter file (and the Actions held behind them are processed).
+        '''
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            retries = [job for due, sequence, job in self._retries]
+            self._retries = []
+            self._retries_condition.notify()
+            held = [job for count, jobs in self._retrying.itervalues() for job in jobs]
+            self._retrying = {}
+        for job in retries:
+            self._deadLetter(job, 'Night Watch stopped before the next attempt')
+        self._release(held)
+        deadline = time.time() + timeout if timeout is not None else None
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0) if deadline is not None else None)
+
+    def _put(self, job):
+        # Queue the job on the worker of its task
+        try:
+            self._queues[self._getWorker(job)].put_nowait(job)
+        except Queue.Full:
+            getLogger(__name__).error('Action queue is full, action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + ' is not processed')
+            self._deadLetter(job, 'Action queue is full')
+
+    def _getWorker(self, job):
+        return stableHash(job.task_name) % self.workers
+
+    def _runWorker(self, i):
+        q = self._queues[i]
+        while True:
+            with self._lock:
+                job = self._ready[i].popleft() if self._ready[i] else None
+            if job is None:
+                job = q.get()
+                if job is None:
+                    # Stop requested: process the released Actions not processed yet
+                    with self._lock:
+                        jobs = list(self._ready[i])
+                        self._ready[i].clear()
+                    for job in jobs:
+                        job.attempts += 1
+                        self._processJob(job)
+                    return
+                if job is _wake_up:
+                    continue
+            with self._lock:
+                # The first attempt of an Action is held while another Action of its task waits for a retry
+                held = job.attempts == 0 and self._retrying.has_key(job.task_name)
+                if held:
+                    self._retrying[job.task_name][1].append(job)
+            if held:
+                getLogger(__name__).info('Action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + ' is held until the retry of a previous action of the task')
+                continue
+            job.attempts += 1
+            self._processJob(job)
+
+    def _release(self, jobs):
+        # Give the held jobs back to the workers of their tasks, which process them (in order) before the jobs of their queues
+        workers = set()
+        with self._lock:
+            for job in jobs:
+                self._ready[self._getWorker(job)].append(job)
+                workers.add(self._getWorker(job))
+        for i in workers:
+            # Wake the worker up if it is waiting for a job from its queue
+            try:
+                self._queues[i].put_nowait(_wake_up)
+            except Queue.Full:
+                pass # The worker is busy, it will see the released jobs before taking the next job of its queue
+
+    def _retryDone(self, job):
+        # The job, which was waiting for a retry, succeeded or has been given up: release the next jobs of its task if it was the last
+        # job of the task waiting for a retry
+        with self._lock:
+            retrying = self._retrying.get(job.task_name)
+            if retrying is None:
+                return
+            retrying[0] -= 1
+            if retrying[0] > 0:
+                return
+            del self._retrying[job.task_name]
+        self._release(retrying[1])
+
+    def _processJob(self, job):
+        # Process the Action of the job, and handle its result once known (at once, or when the Future returned by the Action is done)
+        result = self._process(job)
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._completed(job, self._getFutureError(job, future)))
+        else:
+            self._completed(job, result)
+
+    def _completed(self, job, error):
+        # Handle the result of an attempt to process the Action of the job: error is None if the Action succeeded, the error message otherwise
+        if error is None:
+            latency = time.time() - job.queued
+            with self._lock:
+                self._stats['processed'] += 1
+                self._stats['latency_total'] += latency
+                self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+            if job.attempts > 1:
+                self._retryDone(job)
+        elif not self.workers or job.attempts >= self.max_attempts:
+            getLogger(__name__).error('Action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + ' failed ' + str(job.attempts) + ' times, give up')
+            self._deadLetter(job, error)
+            if job.attempts > 1:
+                self._retryDone(job)
+        else:
+            delay = min(self.retry_delay * 2 ** (job.attempts - 1), _max_retry_delay)
+            getLogger(__name__).warning('Action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + ' will be retried in ' + str(delay) + ' seconds')
+            with self._lock:
+                if self._stopped:
+                    stopped = True
+                else:
+                    stopped = False
+                    self._stats['retried'] += 1
+                    self._retries_sequence += 1
+                    heapq.heappush(self._retries, (time.time() + delay, self._retries_sequence, job))
+                    self._retries_condition.notify()
+                    if job.attempts == 1:
+                        # First failure of the job: hold the next jobs of its task until its retry is done
+                        self._retrying.setdefault(job.task_name, [0, []])[0] += 1
+            if stopped:
+                self._deadLetter(job, 'Night Watch stopped before the next attempt')
+
+    def _runRetries(self):
+        # Queue again the Actions whose retry delay is over
+        while True:
+            with self._lock:
+                while not self._stopped and (not self._retries or self._retries[0][0] > time.time()):
+                    self._retries_condition.wait(self._retries[0][0] - time.time() if self._retries else None)
+                if self._stopped:
+                    return
+                due, sequence, job = heapq.heappop(self._retries)
+            self._put(job)
+
+    def _process(self, job):
+        # Process the Action of the job. Returns None if the Action succeeded, the error message if it failed, or the Future returned
+        # by the Action if it is completed in the background
+        try:
+            getLogger(__name__).info('Process the action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + \
+                                     (' (attempt ' + str(job.attempts) + '/' + str(self.max_attempts) + ')' if job.attempts > 1 else ''))
+            result = job.action.process(job.state, job.conditions, job.thresholds, job.values)
+            return result if isinstance(result, Future) else None
+        except Exception, e:
+            getLogger(__name__).error('Action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + ' raised an error while processing', exc_info=True)
+            return str(e)
+
+    def _getFutureError(self, job, future):
+        # Returns None if the Action completed in the background succeeded, the error message otherwise
+        if future.cancelled():
+            error = 'Action cancelled'
+        elif future.exception() is not None:
+            error = str(future.exception())
+        else:
+            return None
+        getLogger(__name__).error('Action "' + job.getActionName() + '" for task "' + job.task_name + '" ' + job.log_message + ' failed: ' + error)
+        return error
+
+    def _deadLetter(self, job, error):
+        with self._lock:
+            self._stats['dead'] += 1
+        if not self.dead_letter_file:
+            return
+        record = {
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'task': job.task_name,
+                  'action': job.getActionName(),
+                  'event': job.log_message,
+                  'state': job.state,
+                  'conditions': job.conditions,
+                  'thresholds': job.thresholds,
+                  'values': job.values,
+                  'attempts': job.attempts,
+                  'error': error
+                  }
+        try:
+            with self._dead_letter_lock:
+                with open(self.dead_letter_file, 'a') as f:
+                    f.write(json.dumps(record, default = str) + '\n')
+        except Exception:
+            getLogger(__name__).error('Could not write action "' + job.getActionName() + '" for task "' + job.task_name + '" to dead letter file ' + self.dead_letter_file, exc_info=True)
+
+
+# Queued to wake a worker up when held jobs of its tasks are released
+_wake_up = ()
+
+
+class _ActionJob:
+    def __init__(self, task_name, action, log_message, state, conditions, thresholds, values):
+        self.task_name = task_name
+        self.action = action
+        self.log_message = log_message
+        self.state = state
+        self.conditions = conditions
+        self.thresholds = thresholds
+        self.values = values
+        self.attempts = 0
+        self.queued = time.time()
+
+    def getActionName(self):
+        return self.action.__class__.__name__
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def getActionDispatcher():
+    '''
+    Return the Action dispatcher shared by the process (created at first call from the 'action_dispatcher' section of the
+    Night Watch main config file).
+    '''
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            config = getNwConfiguration().action_dispatcher
+            _dispatcher = ActionDispatcher(workers = config.get('workers') if config.get('workers') is not None else _default_workers,
+                                           queue_size = config.get('queue_size') or _default_queue_size,
+                                           max_attempts = config.get('max_attempts') or _default_max_attempts,
+                                           retry_delay = period2seconds(config.get('retry_delay')) if config.get('retry_delay') else _default_retry_delay,
+                                           dead_letter_file = config.get('dead_letter_file'))
+            getMetrics().addCollector('action_dispatcher', _dispatcher.getStats)
+        return _dispatcher
+
+def stopActionDispatcher(timeout = None):
+    '''
+    Stop the Action dispatcher (if it has been started), see ActionDispatcher.stop.
+    '''
+    with _dispatcher_lock:
+        dispatcher = _dispatcher
+    if dispatcher is not None:
+        dispatcher.stop(timeout)
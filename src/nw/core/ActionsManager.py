@@ -18,7 +18,7 @@ from importlib import import_module
 import os
 
 from nw.core.NwConfiguration import getNwConfiguration
-from nw.core.Utils import loadYamlFile
+from nw.core.ConfigCache import loadConfigFile
 
 
 '''
@@ -58,6 +58,20 @@ def getActionConfig(action_name):
         return None
 
 
+def getActionConfigPath(action_name):
+    '''
+    Return the path of the Action's config file (the file may not exist).
+    '''
+    return os.path.join(getNwConfiguration().actions_location, action_name + '.yml')
+
+def reloadActionConfigs():
+    '''
+    Forget the Actions' config files already loaded, so that they are read again by the next Actions' instances (used when the
+    Night Watch configuration is reloaded).
+    '''
+    _actionConfig.clear()
+
+
 def _loadAction(action_name):
     # If the action module is not already loaded, load it
     if not _loadedActions.has_key(action_name):
@@ -71,10 +85,10 @@ def _loadActionConfig(action_name):
     # If the Action's config is not already loaded, check if a config exist for this Action and load it
     if not _actionConfig.has_key(action_name):
         # build the path of the Action to load by concatenating the actions_location config section from main config file with the {name of the action to load}.yml
-        path_config_file = os.path.join(getNwConfiguration().actions_location, action_name + '.yml')
+        path_config_file = getActionConfigPath(action_name)
         getLogger(__name__).debug('Try to load config file for action "' + action_name + '" from location ' + path_config_file)
         if os.path.exists(path_config_file):
-            _actionConfig[action_name] = loadYamlFile(path_config_file)
+            _actionConfig[action_name] = loadConfigFile(path_config_file)
             getLogger(__name__).info('Config file for action "' + action_name + '" successfully loaded from location ' + path_config_file)
         else:
             # No config file available for this Action, store None so that the ActionsManager does not try to load again the config file for this Action
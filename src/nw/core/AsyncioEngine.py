@@ -0,0 +1,179 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from datetime import datetime, timedelta
+from traceback import format_tb
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import sys
+
+import trollius as asyncio
+from trollius import From, Return
+from pytz import utc
+from apscheduler.executors.base import BaseExecutor, run_job
+from apscheduler.events import JobExecutionEvent, EVENT_JOB_MISSED, EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+
+
+'''
+This module implements the asyncio execution engine of the Scheduler (selected with "engine: asyncio" in the scheduler section
+of night-watch.yml):
+    - all the jobs are run from one event loop, running in its own thread,
+    - the Providers offering a coroutine 'processAsync' method (e.g. Ping) are run directly on the event loop (they do not hold any
+        thread while waiting for the network or for their commands),
+    - the other Providers ('process' method only) and the Actions are run in a pool of threads of the event loop.
+Note: this module requires the trollius package (asyncio for Python 2.7).
+'''
+
+_default_workers = 10 # Default number of threads used to run the blocking Providers and the Actions
+
+
+class EventLoopThread:
+    '''
+    Run an asyncio event loop in a dedicated thread.
+    '''
+    def __init__(self, workers = None):
+        self.loop = asyncio.new_event_loop()
+        # Blocking calls sent to the event loop (loop.run_in_executor) are run in this pool of threads
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers = workers or _default_workers))
+        # The Providers may run commands from the event loop (asyncio.create_subprocess_exec): the end of the commands is detected
+        # from the SIGCHLD signal, whose handler must be installed from the main thread (the event loop is created from it)
+        asyncio.get_child_watcher().attach_loop(self.loop)
+        self._thread = threading.Thread(target = self._run, name = 'EventLoop')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        getLogger(__name__).info('Event loop started')
+
+    def stop(self):
+        # Calls scheduled before this one (e.g. the scheduler shutdown) are processed before stopping the loop
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(10)
+        getLogger(__name__).info('Event loop stopped')
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+class CoroutineExecutor(BaseExecutor):
+    '''
+    APScheduler executor running the coroutine jobs on the scheduler's event loop, and the other jobs in the event loop's pool of threads.
+    As with APScheduler's executors, a job is considered as running (max_instances) until its coroutine is done.
+    '''
+    def start(self, scheduler, alias):
+        BaseExecutor.start(self, scheduler, alias)
+        self._eventloop = scheduler._eventloop
+
+    def _do_submit_job(self, job, run_times):
+        def callback(f):
+            try:
+                events = f.result()
+            except:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        if asyncio.iscoroutinefunction(job.func):
+            f = asyncio.async(_runCoroutineJob(job, job._jobstore_alias, run_times, self._logger.name), loop = self._eventloop)
+        else:
+            f = self._eventloop.run_in_executor(None, run_job, job, job._jobstore_alias, run_times, self._logger.name)
+        f.add_done_callback(callback)
+
+
+@asyncio.coroutine
+def _runCoroutineJob(job, jobstore_alias, run_times, logger_name):
+    # Coroutine version of apscheduler.executors.base.run_job
+    events = []
+    logger = getLogger(logger_name)
+    for run_time in run_times:
+        # See if the job missed its run time window, and handle possible misfires accordingly
+        if job.misfire_grace_time is not None:
+            difference = datetime.now(utc) - run_time
+            grace_time = timedelta(seconds = job.misfire_grace_time)
+            if difference > grace_time:
+                events.append(JobExecutionEvent(EVENT_JOB_MISSED, job.id, jobstore_alias, run_time))
+                logger.warning('Run time of job "%s" was missed by %s', job, difference)
+                continue
+
+        logger.info('Running job "%s" (scheduled at %s)', job, run_time)
+        try:
+            retval = yield From(job.func(*job.args, **job.kwargs))
+        except Exception:
+            exc, tb = sys.exc_info()[1:]
+            events.append(JobExecutionEvent(EVENT_JOB_ERROR, job.id, jobstore_alias, run_time, exception = exc,
+                                            traceback = ''.join(format_tb(tb))))
+            logger.exception('Job "%s" raised an exception', job)
+        else:
+            events.append(JobExecutionEvent(EVENT_JOB_EXECUTED, job.id, jobstore_alias, run_time, retval = retval))
+            logger.info('Job "%s" executed successfully', job)
+
+    raise Return(events)
+
+
+def getTaskCoroutine(task, loop):
+    '''
+    Return the coroutine function running the task on the event loop (equivalent of task.run for the asyncio engine).
+    '''
+    @asyncio.coroutine
+    def runTask():
+        task.last_run_start = time.time()
+        results = yield From(_collectProviderResults(task, loop))
+        # Conditions checking is fast, but it may process the Actions, which are blocking: run it in the pool of threads
+        yield From(loop.run_in_executor(None, task._processResults, results))
+        task._recordRun(results)
+    return runTask
+
+
+@asyncio.coroutine
+def _collectProviderResults(task, loop):
+    # Coroutine version of Task._collectProviderResults: returns the list of (success, value) tuples collected from the task's providers
+    semaphore = asyncio.Semaphore(task.max_parallel_providers or 1, loop = loop)
+    futures = [asyncio.async(_processProvider(task, i, semaphore, loop), loop = loop) for i in range(task.numberOfProviders)]
+    if not futures:
+        raise Return([])
+    # Wait for all the providers, but not longer than the task's providers_timeout (if defined)
+    done, not_done = yield From(asyncio.wait(futures, timeout = task.providers_timeout, loop = loop))
+    results = []
+    for i in range(task.numberOfProviders):
+        if futures[i] in done:
+            results.append(futures[i].result())
+        else:
+            futures[i].cancel()
+            getLogger('nw.core.Task').error('Provider "' + task.provider_names[i] + '" did not return its value within ' + str(task.providers_timeout) + ' seconds for task "' + task.name + '". Not able to process this task.')
+            results.append((False, None))
+    raise Return(results)
+
+
+@asyncio.coroutine
+def _processProvider(task, i, semaphore, loop):
+    # Collect the metric's value from the provider i of the task. Returns a tuple (success, value)
+    with (yield From(semaphore)):
+        if not getattr(task.providers[i], 'processAsync', None):
+            # Blocking provider, run Task._processProvider in the pool of threads
+            result = yield From(loop.run_in_executor(None, task._processProvider, i))
+            raise Return(result)
+        start = time.time()
+        try:
+            value = yield From(task.providers[i].processAsync())
+        except Exception:
+            getLogger('nw.core.Task').error('Provider "' + task.provider_names[i] + '" raised an error while collecting value for task "' + task.name + '". Not able to process this task.', exc_info=True)
+            task._recordProvider(i, start, False)
+            raise Return((False, None))
+        task._recordProvider(i, start, True)
+    getLogger('nw.core.Task').debug('Task "' + task.name + '": used task provider "' + task.provider_names[i] + '" to retrieve the value and got ' + str(value))
+    raise Return((True, value))
@@ -0,0 +1,148 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import cPickle
+import hashlib
+import os
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import loadYamlFile
+
+
+'''
+This module implements the cache of the parsed config files (tasks, Providers and Actions config files), saved in a file so that
+the config files which have not changed since the last start of Night Watch do not have to be parsed again:
+    - each config file is stored in the cache with its modification time, size and md5 hash, and its parsed content (pickled),
+    - a config file is read from the cache if its modification time and size have not changed, or if its content has the same
+        hash (e.g. the file has been touched or copied again),
+    - the cache is written when save is called (after the config files have been loaded), only if it has changed. The config files
+        which have not been read since the start of the load (see startLoad) and do not exist anymore are removed from the cache.
+Only the YAML parsing is cached: the options of the tasks, Providers and Actions are still validated at each start, as they are
+validated while the Task, Provider and Action objects are created (when the config is reloaded, only the added and changed tasks are
+created again, see TaskManager).
+The cache file is set in the 'cache_file' field of the config section of the Night Watch main config file (if it is not set, the
+config files are always parsed).
+'''
+
+
+class ConfigCache:
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        # Config file path -> (modification time, size, md5 hash, pickled content)
+        self._entries = {}
+        self._used = set() # Config files read since the start of the current load of the config
+        self._changed = False
+        self._lock = threading.Lock()
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    self._entries = cPickle.load(f)
+                getLogger(__name__).info('Config cache loaded from ' + cache_file + ' (' + str(len(self._entries)) + ' files)')
+            except Exception:
+                getLogger(__name__).warning('Could not load config cache from ' + cache_file + ', the config files are parsed', exc_info=True)
+                self._entries = {}
+
+    def startLoad(self):
+        '''
+        Start a load (or reload) of the config files: save then only keeps the config files read from now on, or which still exist.
+        '''
+        with self._lock:
+            self._used = set()
+
+    def load(self, path):
+        '''
+        Return the parsed content of the config file path, from the cache if the file has not changed since it has been cached.
+        '''
+        stat = os.stat(path)
+        with self._lock:
+            self._used.add(path)
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return cPickle.loads(entry[3])
+        with open(path, 'rb') as f:
+            content_hash = hashlib.md5(f.read()).hexdigest()
+        if entry is not None and entry[2] == content_hash:
+            # Content has not changed (only the modification time), update the modification time of the entry
+            content = entry[3]
+        else:
+            getLogger(__name__).debug('Config file ' + path + ' is not in config cache (or has changed), parse it')
+            content = cPickle.dumps(loadYamlFile(path), cPickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[path] = (stat.st_mtime, stat.st_size, content_hash, content)
+            self._changed = True
+        return cPickle.loads(content)
+
+    def save(self):
+        '''
+        Write the cache to its file (if it has changed), without the config files which have been removed (not read since the start
+        of the load, and not found).
+        '''
+        with self._lock:
+            removed = [path for path in self._entries if path not in self._used and not os.path.exists(path)]
+            for path in removed:
+                del self._entries[path]
+            if not self._changed and not removed:
+                return
+            try:
+                # Write the cache in a temporary file first, so that the cache file is never partially written
+                with open(self.cache_file + '.tmp', 'wb') as f:
+                    cPickle.dump(self._entries, f, cPickle.HIGHEST_PROTOCOL)
+                os.rename(self.cache_file + '.tmp', self.cache_file)
+                self._changed = False
+                getLogger(__name__).debug('Config cache written to ' + self.cache_file + ' (' + str(len(self._entries)) + ' files)')
+            except Exception:
+                getLogger(__name__).warning('Could not write config cache to ' + self.cache_file, exc_info=True)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def getConfigCache():
+    '''
+    Return the config cache (opened at first call from the 'cache_file' field of the config section of the Night Watch main config
+    file), or None if no cache file is configured.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None and getNwConfiguration().cache_file:
+            _cache = ConfigCache(getNwConfiguration().cache_file)
+        return _cache
+
+def loadConfigFile(path):
+    '''
+    Return the parsed content of the config file path, using the config cache if it is configured.
+    '''
+    cache = getConfigCache()
+    if cache is None:
+        return loadYamlFile(path)
+    return cache.load(path)
+
+def startConfigLoad():
+    '''
+    Notify the config cache (if it is configured) that the config files are about to be loaded (or reloaded).
+    '''
+    cache = getConfigCache()
+    if cache is not None:
+        cache.startLoad()
+
+def saveConfigCache():
+    '''
+    Write the config cache to its file (if it is configured).
+    '''
+    cache = getConfigCache()
+    if cache is not None:
+        cache.save()
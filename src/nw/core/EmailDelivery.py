@@ -0,0 +1,270 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from concurrent.futures import Future
+import threading
+import smtplib
+import Queue
+import time
+from email.MIMEMultipart import MIMEMultipart
+from email.MIMEText import MIMEText
+
+
+'''
+This module implements the delivery of the emails sent by the Email Actions, in the background:
+    - the Email Actions queue their emails and return at once, so that the tasks are not blocked by the SMTP server,
+    - one thread per SMTP server (url, port, credentials and TLS settings) sends the queued emails on a persistent connection,
+        opened at the first email, opened again if the server closes it, and closed after _idle_timeout seconds without email,
+    - if a digest window is set for an email, the emails to the same recipients are grouped: the first email opens the window,
+        and all the emails queued for these recipients until the end of the window are sent in one digest email,
+    - each queued email has a Future, resolved once the email is sent, or failed if it could not be sent (the Action dispatcher
+        retries the Email Action later, or writes it to its dead letter file, see nw.core.ActionDispatcher).
+Note: if a digest email can not be sent, the Futures of all the emails of the digest fail. Each Email Action is then retried on its
+own by the Action dispatcher: the retried emails are queued again, so they open (or join) a new digest window and are delayed by
+up to one more digest window before being sent.
+'''
+
+_idle_timeout = 60 # Time (in seconds) after which an unused SMTP connection is closed
+_max_attempts = 2 # Number of attempts to send an email: the second attempt is done at once on a new connection (the previous one may have been closed by the server)
+_queue_size = 1000 # Maximum number of emails waiting to be sent to each SMTP server
+
+
+class EmailDelivery:
+    def __init__(self):
+        # SMTP server settings -> _SmtpSender
+        self._senders = {}
+        self._lock = threading.Lock()
+
+    def send(self, smtp_settings, from_addr, to_addrs, cc_addrs, subject, body, digest_window = 0):
+        '''
+        Queue an email to be sent using the SMTP server smtp_settings (dict with keys url, port, login, password, tls, tls_keyfile
+        and tls_certfile), and return at once.
+        If digest_window (in seconds) is not 0, the email is grouped with the other emails queued for the same recipients during
+        digest_window seconds.
+        Returns a Future, whose result is set once the email is sent, or whose exception is set if the email could not be sent.
+        '''
+        key = tuple(sorted(smtp_settings.items()))
+        with self._lock:
+            sender = self._senders.get(key)
+            if sender is None:
+                sender = _SmtpSender(smtp_settings)
+                self._senders[key] = sender
+        email = _Email(from_addr, to_addrs, cc_addrs, subject, body)
+        sender.put(email, digest_window)
+        return email.future
+
+    def stop(self, timeout = None):
+        '''
+        Send the queued emails (including the pending digests) and stop the delivery threads, waiting at most timeout seconds.
+        '''
+        with self._lock:
+            senders = self._senders.values()
+            self._senders = {}
+        deadline = time.time() + timeout if timeout is not None else None
+        for sender in senders:
+            sender.stop()
+        for sender in senders:
+            sender.join(max(deadline - time.time(), 0) if deadline is not None else None)
+
+
+class _Email:
+    def __init__(self, from_addr, to_addrs, cc_addrs, subject, body):
+        self.from_addr = from_addr
+        self.to_addrs = to_addrs
+        self.cc_addrs = cc_addrs
+        self.subject = subject
+        self.body = body
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+
+    def getRecipientsKey(self):
+        # The emails with the same key can be grouped in a digest
+        return (self.from_addr, _addrsToString(self.to_addrs), _addrsToString(self.cc_addrs))
+
+    def toMessage(self):
+        msg = MIMEMultipart()
+        msg['From'] = self.from_addr
+        msg['To'] = _addrsToString(self.to_addrs)
+        if self.cc_addrs:
+            msg['Cc'] = _addrsToString(self.cc_addrs)
+        msg['Subject'] = self.subject
+        msg.attach(MIMEText(self.body, 'plain'))
+        return msg.as_string()
+
+
+def _addrsToString(addrs):
+    if type(addrs) is list:
+        return ','.join(addrs)
+    return addrs or ''
+
+
+class _Digest:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.emails = []
+
+    def toEmail(self):
+        first = self.emails[0]
+        if len(self.emails) == 1:
+            return first
+        subject = '[' + str(len(self.emails)) + ' alerts] ' + first.subject
+        body = ''
+        for email in self.emails:
+            body += '----- ' + email.subject + ' -----\n\n' + email.body + '\n\n'
+        return _Email(first.from_addr, first.to_addrs, first.cc_addrs, subject, body)
+
+    def setResult(self, error):
+        # Resolve the Futures of the emails of the digest with the result of the delivery of the digest email
+        for email in self.emails:
+            _setResult(email.future, error)
+
+
+def _setResult(future, error):
+    # Resolve the Future of an email: error is None if the email has been sent, the Exception raised while sending it otherwise
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class _SmtpSender:
+    def __init__(self, smtp_settings):
+        self._settings = smtp_settings
+        self._queue = Queue.Queue(_queue_size)
+        self._smtp = None
+        self._last_used = None
+        # Digests being grouped (only used by the sender thread): recipients key -> _Digest
+        self._digests = {}
+        self._thread = threading.Thread(target = self._run, name = 'EmailDelivery-' + str(smtp_settings.get('url')))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, email, digest_window):
+        try:
+            self._queue.put_nowait((email, digest_window))
+        except Queue.Full:
+            getLogger(__name__).error('Email queue of SMTP server ' + str(self._settings.get('url')) + ' is full, email "' + email.subject + '" is not sent')
+            _setResult(email.future, Exception('Email queue of SMTP server ' + str(self._settings.get('url')) + ' is full'))
+
+    def stop(self):
+        self._queue.put(None)
+
+    def join(self, timeout):
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout = self._getWaitTime())
+            except Queue.Empty:
+                item = ()
+            if item is None:
+                # Stop requested: send the pending digests and close the connection
+                for digest in self._digests.values():
+                    digest.setResult(self._deliver(digest.toEmail()))
+                self._digests = {}
+                self._close()
+                return
+            if item:
+                email, digest_window = item
+                if digest_window:
+                    key = email.getRecipientsKey()
+                    if not self._digests.has_key(key):
+                        self._digests[key] = _Digest(time.time() + digest_window)
+                    self._digests[key].emails.append(email)
+                else:
+                    _setResult(email.future, self._deliver(email))
+            now = time.time()
+            for key in [key for key, digest in self._digests.iteritems() if digest.deadline <= now]:
+                digest = self._digests.pop(key)
+                digest.setResult(self._deliver(digest.toEmail()))
+            if self._smtp is not None and now - self._last_used >= _idle_timeout:
+                getLogger(__name__).debug('Close idle connection to SMTP server ' + str(self._settings.get('url')))
+                self._close()
+
+    def _getWaitTime(self):
+        # Time to wait for a new email: until the end of the first digest window, or until the connection becomes idle
+        deadlines = [digest.deadline for digest in self._digests.itervalues()]
+        if self._smtp is not None:
+            deadlines.append(self._last_used + _idle_timeout)
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.time(), 0.01)
+
+    def _deliver(self, email):
+        # Send the email. Returns None if it has been sent, the Exception raised while sending it otherwise (the Email Action is then
+        # retried later by the Action dispatcher, so that the sender thread does not wait for the SMTP server to be back)
+        message = email.toMessage()
+        last_error = None
+        for attempt in range(_max_attempts):
+            try:
+                if self._smtp is None:
+                    self._connect()
+                # TODO send mail to Cc too
+                self._smtp.sendmail(email.from_addr, email.to_addrs, message)
+                self._last_used = time.time()
+                getLogger(__name__).info('Email sent')
+                return None
+            except smtplib.SMTPAuthenticationError, e:
+                getLogger(__name__).error('Not able to connect to SMTP server because of an authentication issue. Please check SMTP credentials in action Email configuration', exc_info=True)
+                self._close()
+                return e
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError), e:
+                # The email is refused by the SMTP server, sending it again on a new connection would not help
+                getLogger(__name__).error('Email "' + email.subject + '" refused by SMTP server', exc_info=True)
+                self._last_used = time.time()
+                return e
+            except Exception, e:
+                # The connection may have been closed by the SMTP server, open a new one for the next attempt
+                getLogger(__name__).warning('Unable to send email "' + email.subject + '" (attempt ' + str(attempt + 1) + '/' + str(_max_attempts) + ')', exc_info=True)
+                last_error = e
+                self._close()
+        getLogger(__name__).error('Unable to send email "' + email.subject + '" after ' + str(_max_attempts) + ' attempts')
+        return last_error
+
+    def _connect(self):
+        # Connect to the SMTP server
+        smtp = smtplib.SMTP(self._settings.get('url'), self._settings.get('port'))
+        try:
+            # Use TLS connection if required
+            if self._settings.get('tls'):
+                getLogger(__name__).debug('Use SSL')
+                smtp.starttls(self._settings.get('tls_keyfile'), self._settings.get('tls_certfile'))
+            # Use credentials if required
+            if self._settings.get('login') and self._settings.get('password'):
+                getLogger(__name__).debug('Login to the SMTP server with login ' + self._settings.get('login'))
+                smtp.login(self._settings.get('login'), self._settings.get('password'))
+        except:
+            smtp.close()
+            raise
+        getLogger(__name__).debug('Connected to SMTP server ' + str(self._settings.get('url')))
+        self._smtp = smtp
+        self._last_used = time.time()
+
+    def _close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+
+_delivery = EmailDelivery()
+
+def getEmailDelivery():
+    return _delivery
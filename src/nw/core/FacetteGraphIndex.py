@@ -0,0 +1,220 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import fnmatch
+import json
+import time
+import os
+import re
+
+
+'''
+This module implements the index of the graphs of a Facette server, allowing to find the graph and the serie containing a metric
+of a source without looping on all the graphs of the server:
+    - the index maps each (source, metric) to the graphs (graph id, serie name) containing it,
+    - it is built once for each Facette server, and shared by all the Facette Providers (and utils/FindGraph.py) using this server,
+    - it is refreshed incrementally: only the graphs created or modified since the previous refresh are fetched (if the Facette server
+        does not return the graphs modification times, only the created and deleted graphs are detected),
+    - it can be saved to a file, so that it does not have to be built again at next start.
+'''
+
+_min_refresh_interval = 60 # Minimum time (in seconds) between two refreshes of the index triggered by a metric not found
+
+
+class FacetteGraphIndex:
+    def __init__(self, fc, index_file = None):
+        self.fc = fc
+        self.index_file = index_file
+        # Graphs of the Facette server: graph id -> {'name': graph name, 'modified': modification time, 'series': list of [source, metric, serie name]}
+        self._graphs = {}
+        self._order = [] # Graphs ids, in the order returned by the Facette server
+        self._series = {} # (source, metric) -> list of (graph id, serie name)
+        self._last_refresh = None
+        # The refreshes request the Facette server without holding _lock (so that the metrics already indexed can be found meanwhile),
+        # then swap the new index in. _refresh_lock lets only one thread refresh the index at a time
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.RLock()
+        if index_file:
+            self._load()
+
+    def find(self, source_name, metrics_names_list, graph_name_filter = None):
+        '''
+        Return the id of the first graph containing all the metrics of metrics_names_list for the source source_name, and the dictionary
+        mapping the metrics names to the series names in this graph.
+        If graph_name_filter is provided, only the graphs matching this name are used (exact name, or 'glob:pattern' or 'regexp:pattern').
+        The index is refreshed if it has never been, or if the metrics are not found (at most once every 60 seconds). An Exception is
+        raised if no graph contains the metrics.
+        '''
+        with self._lock:
+            last_refresh = self._last_refresh
+        if last_refresh is None:
+            last_refresh = self._refreshUnlessRefreshedSince(None)
+        result = self._find(source_name, metrics_names_list, graph_name_filter)
+        if result is None and self.isOutdated():
+            getLogger(__name__).info('Metrics "' + str(metrics_names_list) + '" for source "' + source_name + '" not found in graphs index, refresh it')
+            self._refreshUnlessRefreshedSince(last_refresh)
+            result = self._find(source_name, metrics_names_list, graph_name_filter)
+        if result is None:
+            raise Exception('No graph found for metrics "' + str(metrics_names_list) + '" and source "' + source_name + '"' + \
+                            (' in graphs named "' + graph_name_filter + '"' if graph_name_filter else ''))
+        return result
+
+    def isOutdated(self):
+        '''
+        Return True if the index has never been refreshed, or has not been refreshed for 60 seconds. The refreshes triggered by a graph
+        or a metric not found are limited to one every 60 seconds, so that the Providers using a deleted graph do not list all the
+        graphs of the Facette server at each run.
+        '''
+        with self._lock:
+            return self._last_refresh is None or time.time() - self._last_refresh >= _min_refresh_interval
+
+    def refreshIfOutdated(self):
+        '''
+        Refresh the index if it is outdated (see isOutdated). Returns True if the index has been refreshed.
+        '''
+        with self._refresh_lock:
+            if not self.isOutdated():
+                return False
+            self.refresh()
+            return True
+
+    def refresh(self):
+        '''
+        Update the index from the Facette server: list the graphs, and only fetch the graphs which are not indexed yet or which
+        have been modified since they have been indexed.
+        '''
+        with self._refresh_lock:
+            start = time.time()
+            with self._lock:
+                indexed_graphs = self._graphs
+            graph_list = self.fc.library.graphs.list(filter = None)
+            if not graph_list:
+                raise Exception('No graphs found. Please check if Facette server is running and has graphs defined.')
+            graphs = {}
+            fetched = 0
+            for g in graph_list:
+                # The modification time is stored as a string, so that it can be saved in the index file
+                modified = getattr(g, 'modified', None)
+                if modified is not None:
+                    modified = str(modified)
+                indexed = indexed_graphs.get(g.id)
+                if indexed is not None and indexed['modified'] == modified:
+                    graphs[g.id] = indexed
+                    continue
+                graph = self.fc.library.graphs.get(g.id)
+                fetched += 1
+                series = []
+                for group in graph.groups:
+                    for serie in group.series:
+                        series.append([serie.source, serie.metric, serie.name])
+                graphs[g.id] = {'name': g.name, 'modified': modified, 'series': series}
+            order = [g.id for g in graph_list]
+            series = _buildSeries(graphs, order)
+            with self._lock:
+                self._graphs, self._order, self._series = graphs, order, series
+                self._last_refresh = time.time()
+            getLogger(__name__).info('Facette graphs index refreshed in ' + '%.3f' % (time.time() - start) + ' seconds: ' + str(len(graphs)) + \
+                                     ' graphs indexed, ' + str(fetched) + ' graphs fetched from Facette server')
+            if self.index_file:
+                self._save(graphs, order)
+
+    def _refreshUnlessRefreshedSince(self, last_refresh):
+        # Refresh the index, unless another thread has refreshed it since last_refresh (while this thread was waiting for it).
+        # Returns the time of the latest refresh
+        with self._refresh_lock:
+            with self._lock:
+                refreshed = self._last_refresh != last_refresh
+            if not refreshed:
+                self.refresh()
+            with self._lock:
+                return self._last_refresh
+
+    def _find(self, source_name, metrics_names_list, graph_name_filter):
+        with self._lock:
+            graphs, order, series = self._graphs, self._order, self._series
+        candidates = None
+        for metric in metrics_names_list:
+            metric_graphs = set(graph_id for graph_id, serie_name in series.get((source_name, metric), []))
+            candidates = metric_graphs if candidates is None else candidates & metric_graphs
+        if not candidates:
+            return None
+        # Use the first graph (in Facette server order) containing all the metrics
+        for graph_id in order:
+            if graph_id in candidates and self._matchName(graphs[graph_id]['name'], graph_name_filter):
+                series_names = {}
+                for source, metric, serie_name in graphs[graph_id]['series']:
+                    if source == source_name and metric in metrics_names_list:
+                        series_names[metric] = serie_name
+                getLogger(__name__).debug('Requested metrics "' + str(metrics_names_list) + '" for source "' + source_name + '" found in graph with id ' + graph_id + \
+                                          ', related series names are ' + str(series_names))
+                return graph_id, series_names
+        return None
+
+    def _matchName(self, name, graph_name_filter):
+        if not graph_name_filter:
+            return True
+        if graph_name_filter.startswith('regexp:'):
+            return re.search(graph_name_filter[len('regexp:'):], name) is not None
+        if graph_name_filter.startswith('glob:'):
+            return fnmatch.fnmatch(name, graph_name_filter[len('glob:'):])
+        return name == graph_name_filter
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+            self._graphs = data['graphs']
+            self._order = data['order']
+            self._series = _buildSeries(self._graphs, self._order)
+            getLogger(__name__).info('Facette graphs index loaded from ' + self.index_file + ' (' + str(len(self._graphs)) + ' graphs)')
+        except Exception:
+            getLogger(__name__).warning('Could not load Facette graphs index from ' + self.index_file + ', the index will be built from Facette server', exc_info=True)
+            self._graphs = {}
+            self._order = []
+
+    def _save(self, graphs, order):
+        try:
+            # Write the index in a temporary file first, so that the index file is never partially written
+            with open(self.index_file + '.tmp', 'w') as f:
+                json.dump({'graphs': graphs, 'order': order}, f)
+            os.rename(self.index_file + '.tmp', self.index_file)
+        except Exception:
+            getLogger(__name__).warning('Could not save Facette graphs index to ' + self.index_file, exc_info=True)
+
+
+def _buildSeries(graphs, order):
+    # Return the map (source, metric) -> list of (graph id, serie name) of the graphs
+    series = {}
+    for graph_id in order:
+        for source, metric, serie_name in graphs[graph_id]['series']:
+            series.setdefault((source, metric), []).append((graph_id, serie_name))
+    return series
+
+
+_indexes = {} # Facette server url -> FacetteGraphIndex
+_indexes_lock = threading.Lock()
+
+def getFacetteGraphIndex(facette_srv_url, fc, index_file = None):
+    '''
+    Return the graphs index of the Facette server (created at first call, using the Facette client fc).
+    '''
+    with _indexes_lock:
+        if not _indexes.has_key(facette_srv_url):
+            _indexes[facette_srv_url] = FacetteGraphIndex(fc, index_file)
+        return _indexes[facette_srv_url]
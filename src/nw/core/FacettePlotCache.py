@@ -0,0 +1,116 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import time
+
+from nw.core.Metrics import getMetrics
+
+
+'''
+This module implements the cache of the plots fetched from the Facette servers, shared by all the Facette Providers, so that the
+Providers reading series of the same graph and plot range cost one request to the Facette server per interval:
+    - the plots are cached for a time bucket of ttl seconds (the bucket is part of the cache key, so all the Providers reading a plot
+        during the same bucket get the same plot, and the plot is fetched again in the next bucket),
+    - if several Providers request a plot which is not in the cache at the same time, only one of them fetches it from the Facette
+        server and the others wait for its result (at most a timeout, then they fail instead of waiting for a fetch which hangs),
+    - the numbers of hits (plot read from the cache or from a fetch in progress) and misses (plot fetched) are counted.
+'''
+
+
+class FacettePlotCache:
+    def __init__(self):
+        # (server url, graph id, plot range, ttl, time bucket) -> _CachedPlot
+        self._plots = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, facette_srv_url, fc, graph_id, plot_range, ttl, timeout = None):
+        '''
+        Return the plot of the graph graph_id for plot_range, from the cache if it has been fetched in the current time bucket of
+        ttl seconds, from the Facette server (using the Facette client fc) otherwise.
+        If the plot is being fetched by another Provider, wait for it at most timeout seconds (if defined), then raise an Exception.
+        '''
+        now = time.time()
+        key = (facette_srv_url, graph_id, plot_range, ttl, int(now // ttl))
+        with self._lock:
+            self._purge(now)
+            cached = self._plots.get(key)
+            if cached is None:
+                cached = _CachedPlot(now + ttl)
+                self._plots[key] = cached
+                self.misses += 1
+                fetch = True
+            else:
+                self.hits += 1
+                fetch = False
+        if fetch:
+            # Fetch the plot without holding the lock, the other Providers requesting the same plot wait for the result
+            try:
+                cached.setPlot(fc.library.graphs.plots.get(graph_id, plot_range))
+            except Exception, e:
+                cached.setError(e)
+            if cached.error is not None or not cached.plot:
+                # Do not keep errors and missing plots in the cache, the next Providers will fetch the plot again
+                with self._lock:
+                    if self._plots.get(key) is cached:
+                        del self._plots[key]
+        else:
+            getLogger(__name__).debug('Plot of graph with id ' + str(graph_id) + ' for range ' + plot_range + ' read from cache')
+        return cached.getPlot(timeout)
+
+    def getStats(self):
+        '''
+        Return the statistics of the cache: number of hits, misses and plots in the cache.
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._plots)}
+
+    def _purge(self, now):
+        # Remove the expired plots (must be called with self._lock acquired)
+        for key in [key for key, cached in self._plots.iteritems() if cached.expires <= now and cached.done.is_set()]:
+            del self._plots[key]
+
+
+class _CachedPlot:
+    def __init__(self, expires):
+        self.expires = expires
+        self.plot = None
+        self.error = None
+        self.done = threading.Event() # Set once the plot has been fetched
+
+    def setPlot(self, plot):
+        self.plot = plot
+        self.done.set()
+
+    def setError(self, error):
+        self.error = error
+        self.done.set()
+
+    def getPlot(self, timeout = None):
+        if not self.done.wait(timeout):
+            raise Exception('The plot is still being fetched from Facette server after ' + str(timeout) + ' seconds')
+        if self.error is not None:
+            raise self.error
+        return self.plot
+
+
+_cache = FacettePlotCache()
+getMetrics().addCollector('facette_plot_cache', _cache.getStats)
+
+def getFacettePlotCache():
+    return _cache
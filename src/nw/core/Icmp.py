@@ -0,0 +1,235 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import socket
+import struct
+import time
+import os
+
+
+'''
+This module implements an ICMP echo (ping) engine running inside the Night Watch process, so that the Ping Provider does not
+have to fork a ping command for each check:
+    - the echo requests of all the pings are sent on one ICMP socket, shared by all the Providers,
+    - one thread receives the echo replies from this socket and dispatches them to the pings waiting for them.
+The engine uses a raw ICMP socket if the process is allowed to (root or CAP_NET_RAW), otherwise an unprivileged ICMP datagram socket
+(Linux only, the group of the process must be in the range set in sysctl net.ipv4.ping_group_range).
+If none of these sockets can be opened, getIcmpEngine returns None and the ping command has to be used instead.
+Note: only IPv4 is supported.
+'''
+
+_ICMP_ECHO_REQUEST = 8
+_ICMP_ECHO_REPLY = 0
+_payload_size = 56 # Size of the echo request data (same as the ping command), starting with the sending timestamp
+_interval = 1.0 # Time (in seconds) between two echo requests to the same address (same as the ping command)
+_default_timeout = 10 # Time (in seconds) to wait for the replies after the last echo request if no timeout is provided
+
+
+def _checksum(data):
+    # Internet checksum (RFC 1071) of the ICMP packet
+    if len(data) % 2:
+        data += '\0'
+    s = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    return ~s & 0xffff
+
+
+class IcmpEngine:
+    '''
+    Send ICMP echo requests to any number of addresses on one socket and collect the round trip times of the replies.
+    The engine is shared by all the threads of the process (use getIcmpEngine to get it).
+    '''
+    def __init__(self):
+        try:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.getprotobyname('icmp'))
+            self.socket_type = 'raw'
+        except socket.error:
+            # Not allowed to open a raw socket, try an unprivileged ICMP datagram socket (the kernel sets the echo identifier)
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.getprotobyname('icmp'))
+            self.socket_type = 'datagram'
+        self._socket.settimeout(1)
+        self._identifier = os.getpid() & 0xffff
+        self._sequence = 0
+        # Echo requests waiting for their reply: (ip address, sequence number) -> _PendingPing
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target = self._receive, name = 'IcmpEngine')
+        self._thread.daemon = True
+        self._thread.start()
+        getLogger(__name__).info('ICMP engine started using a ' + self.socket_type + ' socket')
+
+    def ping(self, addr, count = 1, timeout = None):
+        '''
+        Send count echo requests to addr (one every second) and wait for the replies, at most timeout seconds after the last request.
+        Returns the list of the round trip times (in ms) of the received replies.
+        An Exception is raised if addr can not be resolved or if the requests can not be sent.
+        '''
+        rtts = self.pingMany([(addr, count, timeout)])[0]
+        if isinstance(rtts, Exception):
+            raise rtts
+        return rtts
+
+    def pingMany(self, targets):
+        '''
+        Ping several addresses at once: targets is a list of (addr, count, timeout) tuples. The echo requests to the different
+        addresses are interleaved (one request to each address every second), so pinging N addresses takes the same time as
+        pinging one.
+        Returns a list with, for each target, the list of the round trip times (in ms) of the received replies, or the Exception
+        raised while resolving its address or sending its requests.
+        '''
+        results = [None] * len(targets)
+        pendings = {} # index of the target -> (ip address, _PendingPing)
+        # Notified by the receiving thread each time a target has received all its replies
+        replies = threading.Condition()
+        def onReplies():
+            with replies:
+                replies.notify_all()
+        for i, (addr, count, timeout) in enumerate(targets):
+            try:
+                pendings[i] = (socket.gethostbyname(addr), self.newPing(count, onReplies))
+            except Exception, e:
+                results[i] = e
+        try:
+            rounds = max([targets[i][1] for i in pendings] or [0])
+            for r in range(rounds):
+                if r > 0:
+                    time.sleep(_interval)
+                for i, (ip, pending) in pendings.items():
+                    if r < pending.count and results[i] is None:
+                        try:
+                            self.sendEchoRequest(ip, pending)
+                        except Exception, e:
+                            results[i] = e
+            # Wait for the replies of all the targets at once: each target is waited for at most its timeout after its last request,
+            # and the wait ends as soon as all the targets have received their replies or reached their deadline
+            deadlines = {}
+            for i, (ip, pending) in pendings.iteritems():
+                if results[i] is None: # Otherwise the requests could not be sent
+                    timeout = targets[i][2] if targets[i][2] is not None else _default_timeout
+                    deadlines[i] = max(pending.sent.values()) + timeout
+            with replies:
+                while True:
+                    now = time.time()
+                    waiting = [deadline for i, deadline in deadlines.iteritems() if deadline > now and not pendings[i][1].isDone()]
+                    if not waiting:
+                        break
+                    replies.wait(min(waiting) - now)
+            for i in deadlines:
+                results[i] = list(pendings[i][1].rtts)
+        finally:
+            for ip, pending in pendings.itervalues():
+                self.releasePing(pending)
+        return results
+
+    def newPing(self, count, callback = None):
+        '''
+        Return a new ping expecting count replies, for the callers sending the echo requests themselves (see sendEchoRequest).
+        callback (if any) is called by the receiving thread when all the replies have been received.
+        '''
+        return _PendingPing(count, callback)
+
+    def sendEchoRequest(self, ip, pending):
+        '''
+        Send one echo request of the ping pending (see newPing) to the ip address. Its round trip time is added to pending.rtts
+        when its reply is received.
+        '''
+        with self._lock:
+            self._sequence = (self._sequence + 1) & 0xffff
+            sequence = self._sequence
+            pending.keys.append((ip, sequence))
+            pending.sent[sequence] = time.time()
+            self._pending[(ip, sequence)] = pending
+        payload = struct.pack('!d', pending.sent[sequence]).ljust(_payload_size, '\0')
+        header = struct.pack('!BBHHH', _ICMP_ECHO_REQUEST, 0, 0, self._identifier, sequence)
+        header = struct.pack('!BBHHH', _ICMP_ECHO_REQUEST, 0, _checksum(header + payload), self._identifier, sequence)
+        self._socket.sendto(header + payload, (ip, 0))
+
+    def _receive(self):
+        while True:
+            try:
+                data, (ip, port) = self._socket.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except socket.error:
+                getLogger(__name__).error('Error while receiving ICMP packets', exc_info=True)
+                time.sleep(_interval)
+                continue
+            received = time.time()
+            if self.socket_type == 'raw':
+                # Raw sockets receive the IP header, and the replies to the echo requests sent by all the processes of the host
+                data = data[(ord(data[0]) & 0x0f) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, code, checksum, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+            if icmp_type != _ICMP_ECHO_REPLY or (self.socket_type == 'raw' and identifier != self._identifier):
+                continue
+            with self._lock:
+                pending = self._pending.pop((ip, sequence), None)
+            if pending is not None:
+                pending.addReply((received - pending.sent[sequence]) * 1000)
+
+    def releasePing(self, pending):
+        '''
+        Stop waiting for the replies of the ping pending (the replies received later are ignored).
+        '''
+        with self._lock:
+            for key in pending.keys:
+                self._pending.pop(key, None)
+
+
+class _PendingPing:
+    # Replies expected by a call to IcmpEngine.ping
+    def __init__(self, count, callback = None):
+        self.count = count
+        self.keys = []
+        self.sent = {} # sequence number -> sending time of the echo request
+        self.rtts = []
+        self._done = threading.Event()
+        self._callback = callback
+
+    def addReply(self, rtt):
+        self.rtts.append(rtt)
+        if len(self.rtts) >= self.count:
+            self._done.set()
+            if self._callback is not None:
+                self._callback()
+
+    def wait(self, timeout):
+        self._done.wait(timeout)
+
+    def isDone(self):
+        return self._done.is_set()
+
+
+_engine = None
+_engine_failed = False
+_engine_lock = threading.Lock()
+
+def getIcmpEngine():
+    '''
+    Return the ICMP engine shared by the process (created at first call), or None if the process is not allowed to open an ICMP socket.
+    '''
+    global _engine, _engine_failed
+    with _engine_lock:
+        if _engine is None and not _engine_failed:
+            try:
+                _engine = IcmpEngine()
+            except socket.error:
+                _engine_failed = True
+                getLogger(__name__).warning('ICMP engine is not available (not allowed to open an ICMP socket), the ping command is used instead', exc_info=True)
+        return _engine
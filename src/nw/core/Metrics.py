@@ -0,0 +1,344 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import threading
+import bisect
+import json
+import time
+import os
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import period2seconds
+
+
+'''
+This module implements the execution metrics of the tasks and of their Providers:
+    - for each task: number of runs, of runs with a failed Provider, of missed runs (runs skipped by the scheduler because the
+        previous run was still running or was late), histograms of the run durations and of the scheduler lag (time between the
+        planned time of a run and its actual start),
+    - for each Provider of each task: number of calls and of errors, histogram of the call durations,
+    - the statistics of the other components of Night Watch (e.g. Action dispatcher, Facette plots cache), registered as collectors.
+The histograms have fixed buckets, so recording a value costs a lookup in the buckets and an increment.
+The metrics can be exposed by a local HTTP server (Prometheus text format on /metrics, JSON on /metrics.json, health of Night Watch
+on /health: HTTP status 200 if healthy, 503 otherwise) and written periodically to a JSON file, as configured in the 'metrics'
+section of the Night Watch main config file.
+'''
+
+_default_json_interval = 60 # Default time (in seconds) between two writes of the metrics to the JSON file
+
+# Upper bounds (in seconds) of the buckets of the histograms (the last bucket is +Inf)
+_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(_buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(_buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def toDict(self):
+        return {'buckets': dict(zip([str(b) for b in _buckets] + ['+Inf'], self.counts)), 'sum': self.sum, 'count': self.count}
+
+
+class _TaskMetrics:
+    def __init__(self):
+        self.runs = 0
+        self.errors = 0
+        self.missed = 0
+        self.duration = Histogram()
+        self.lag = Histogram()
+
+
+class _ProviderMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.abandoned = 0
+        self.duration = Histogram()
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {} # task name -> _TaskMetrics
+        self._providers = {} # (task name, provider index, provider name) -> _ProviderMetrics
+        self._collectors = {} # name -> function returning a dict of numbers
+        self._health_check = None # Function returning a dict with the health of Night Watch ('status' is 'ok' if healthy)
+
+    def observeTaskRun(self, task_name, duration, failed):
+        '''
+        Record a run of the task which lasted duration seconds (failed is True if at least one of its Providers failed).
+        '''
+        with self._lock:
+            metrics = self._getTask(task_name)
+            metrics.runs += 1
+            if failed:
+                metrics.errors += 1
+            metrics.duration.observe(duration)
+
+    def observeTaskLag(self, task_name, lag):
+        '''
+        Record the time (in seconds) between the planned time of a run of the task and its actual start.
+        '''
+        with self._lock:
+            self._getTask(task_name).lag.observe(max(lag, 0))
+
+    def countMissedRuns(self, task_name, count = 1):
+        with self._lock:
+            self._getTask(task_name).missed += count
+
+    def observeProvider(self, task_name, i, provider_name, duration, success):
+        '''
+        Record a call to the Provider i (named provider_name) of the task which lasted duration seconds.
+        '''
+        with self._lock:
+            key = (task_name, i, provider_name)
+            metrics = self._providers.get(key)
+            if metrics is None:
+                metrics = self._providers[key] = _ProviderMetrics()
+            metrics.calls += 1
+            if not success:
+                metrics.errors += 1
+            metrics.duration.observe(duration)
+
+    def countAbandonedCall(self, task_name, i, provider_name):
+        '''
+        Count a call to the Provider i (named provider_name) of the task still running when the providers_timeout of the task elapsed.
+        '''
+        with self._lock:
+            key = (task_name, i, provider_name)
+            metrics = self._providers.get(key)
+            if metrics is None:
+                metrics = self._providers[key] = _ProviderMetrics()
+            metrics.abandoned += 1
+
+    def removeTask(self, task_name):
+        '''
+        Remove the metrics of a task (and of its Providers) which is not scheduled anymore.
+        '''
+        with self._lock:
+            self._tasks.pop(task_name, None)
+            for key in [key for key in self._providers if key[0] == task_name]:
+                del self._providers[key]
+
+    def addCollector(self, name, collector):
+        '''
+        Register a function returning a dict of statistics (numbers) to export with the metrics (as gauges named <name>_<key>).
+        '''
+        with self._lock:
+            self._collectors[name] = collector
+
+    def setHealthCheck(self, health_check):
+        '''
+        Set the function returning the health of Night Watch: a dict whose 'status' field is 'ok' if Night Watch is healthy.
+        '''
+        self._health_check = health_check
+
+    def getHealth(self):
+        if self._health_check is None:
+            return {'status': 'ok'}
+        try:
+            return self._health_check()
+        except Exception:
+            getLogger(__name__).warning('Could not check the health of Night Watch', exc_info=True)
+            return {'status': 'unknown'}
+
+    def toDict(self):
+        '''
+        Return all the metrics as a dict (serializable in JSON).
+        '''
+        with self._lock:
+            tasks = dict((name, {'runs': m.runs, 'errors': m.errors, 'missed': m.missed, 'duration': m.duration.toDict(), 'lag': m.lag.toDict()})
+                         for name, m in self._tasks.iteritems())
+            providers = [{'task': task_name, 'index': i, 'provider': provider_name, 'calls': m.calls, 'errors': m.errors, 'abandoned': m.abandoned, 'duration': m.duration.toDict()}
+                         for (task_name, i, provider_name), m in sorted(self._providers.iteritems())]
+            collectors = self._collectors.items()
+        return {'time': time.time(), 'health': self.getHealth(), 'tasks': tasks, 'providers': providers,
+                'components': dict((name, self._collect(name, collector)) for name, collector in collectors)}
+
+    def toPrometheus(self):
+        '''
+        Return all the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self._lock:
+            tasks = sorted(self._tasks.iteritems())
+            providers = sorted(self._providers.iteritems())
+            _addFamily(lines, 'nightwatch_task_runs_total', 'counter', 'Number of runs of the task', [({'task': name}, m.runs) for name, m in tasks])
+            _addFamily(lines, 'nightwatch_task_errors_total', 'counter', 'Number of runs of the task with at least one failed provider', [({'task': name}, m.errors) for name, m in tasks])
+            _addFamily(lines, 'nightwatch_task_missed_runs_total', 'counter', 'Number of runs of the task skipped by the scheduler', [({'task': name}, m.missed) for name, m in tasks])
+            _addHistogram(lines, 'nightwatch_task_run_duration_seconds', 'Duration of the runs of the task', [({'task': name}, m.duration) for name, m in tasks])
+            _addHistogram(lines, 'nightwatch_task_scheduler_lag_seconds', 'Time between the planned time of the runs of the task and their start', [({'task': name}, m.lag) for name, m in tasks])
+            provider_labels = [({'task': task_name, 'index': str(i), 'provider': provider_name}, m) for (task_name, i, provider_name), m in providers]
+            _addFamily(lines, 'nightwatch_provider_calls_total', 'counter', 'Number of calls to the provider', [(labels, m.calls) for labels, m in provider_labels])
+            _addFamily(lines, 'nightwatch_provider_errors_total', 'counter', 'Number of calls to the provider which failed', [(labels, m.errors) for labels, m in provider_labels])
+            _addFamily(lines, 'nightwatch_provider_abandoned_calls_total', 'counter', 'Number of calls to the provider still running when the providers_timeout of the task elapsed', [(labels, m.abandoned) for labels, m in provider_labels])
+            _addHistogram(lines, 'nightwatch_provider_duration_seconds', 'Duration of the calls to the provider', [(labels, m.duration) for labels, m in provider_labels])
+            collectors = sorted(self._collectors.items())
+        for name, collector in collectors:
+            for key, value in sorted(self._collect(name, collector).iteritems()):
+                if type(value) in (int, long, float, bool):
+                    _addFamily(lines, 'nightwatch_' + name + '_' + key, 'gauge', None, [({}, value)])
+        return '\n'.join(lines) + '\n'
+
+    def _getTask(self, task_name):
+        # Must be called with self._lock acquired
+        metrics = self._tasks.get(task_name)
+        if metrics is None:
+            metrics = self._tasks[task_name] = _TaskMetrics()
+        return metrics
+
+    def _collect(self, name, collector):
+        try:
+            return collector() or {}
+        except Exception:
+            getLogger(__name__).warning('Could not collect the statistics of "' + name + '"', exc_info=True)
+            return {}
+
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(key + '="' + unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for key, value in sorted(labels.iteritems())) + '}'
+
+def _addFamily(lines, name, metric_type, description, samples):
+    if description:
+        lines.append('# HELP ' + name + ' ' + description)
+    lines.append('# TYPE ' + name + ' ' + metric_type)
+    for labels, value in samples:
+        lines.append(name + _formatLabels(labels) + ' ' + repr(float(value)))
+
+def _addHistogram(lines, name, description, samples):
+    lines.append('# HELP ' + name + ' ' + description)
+    lines.append('# TYPE ' + name + ' histogram')
+    for labels, histogram in samples:
+        cumulated = 0
+        for bound, count in zip([repr(float(b)) for b in _buckets] + ['+Inf'], histogram.counts):
+            cumulated += count
+            lines.append(name + '_bucket' + _formatLabels(dict(labels, le = bound)) + ' ' + str(cumulated))
+        lines.append(name + '_sum' + _formatLabels(labels) + ' ' + repr(histogram.sum))
+        lines.append(name + '_count' + _formatLabels(labels) + ' ' + str(histogram.count))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 200
+        if self.path == '/metrics':
+            body, content_type = getMetrics().toPrometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(getMetrics().toDict(), default = str), 'application/json'
+        elif self.path == '/health':
+            health = getMetrics().getHealth()
+            body, content_type = json.dumps(health, default = str), 'application/json'
+            status = 200 if health.get('status') == 'ok' else 503
+        else:
+            body, content_type, status = 'Not found\n', 'text/plain', 404
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        getLogger(__name__).debug('Metrics request from ' + self.client_address[0] + ': ' + (format % args))
+
+
+class MetricsExporter:
+    '''
+    Expose the metrics on a local HTTP server (if listen is set, as "host:port") and write them to a JSON file every json_interval
+    seconds (if json_file is set).
+    '''
+    def __init__(self, listen = None, json_file = None, json_interval = _default_json_interval):
+        self._server = None
+        self._stopped = threading.Event()
+        self.json_file = json_file
+        self.json_interval = json_interval
+        if listen:
+            host, port = str(listen).rsplit(':', 1) if ':' in str(listen) else ('127.0.0.1', listen)
+            self._server = _ThreadingHTTPServer((host, int(port)), _MetricsRequestHandler)
+            thread = threading.Thread(target = self._server.serve_forever, name = 'MetricsServer')
+            thread.daemon = True
+            thread.start()
+            getLogger(__name__).info('Metrics exposed on http://' + host + ':' + str(port) + '/metrics')
+        if json_file:
+            thread = threading.Thread(target = self._runJsonDump, name = 'MetricsJsonDump')
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.json_file:
+            self._dumpJson()
+
+    def _runJsonDump(self):
+        while not self._stopped.wait(self.json_interval):
+            self._dumpJson()
+
+    def _dumpJson(self):
+        try:
+            # Write the metrics in a temporary file first, so that the file is never partially written
+            with open(self.json_file + '.tmp', 'w') as f:
+                json.dump(getMetrics().toDict(), f, default = str)
+            os.rename(self.json_file + '.tmp', self.json_file)
+        except Exception:
+            getLogger(__name__).warning('Could not write metrics to ' + self.json_file, exc_info=True)
+
+
+_metrics = Metrics()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def getMetrics():
+    return _metrics
+
+def startMetricsExporter():
+    '''
+    Start exposing the metrics as configured in the 'metrics' section of the Night Watch main config file (nothing is exposed if this
+    section is not defined, the metrics are still recorded).
+    '''
+    global _exporter
+    with _exporter_lock:
+        config = getNwConfiguration().metrics
+        if _exporter is None and (config.get('listen') or config.get('json_file')):
+            try:
+                _exporter = MetricsExporter(config.get('listen'), config.get('json_file'),
+                                            period2seconds(config.get('json_interval')) if config.get('json_interval') else _default_json_interval)
+            except Exception:
+                getLogger(__name__).error('Could not expose the metrics on ' + str(config.get('listen')), exc_info=True)
+
+def stopMetricsExporter():
+    '''
+    Stop exposing the metrics (the JSON file is written one last time).
+    '''
+    global _exporter
+    with _exporter_lock:
+        if _exporter is not None:
+            _exporter.stop()
+            _exporter = None
@@ -38,10 +38,49 @@ class NwConfiguration:
             if config.has_key('logging'):
                 self.logging = config['logging']
     
+            # stores scheduler section (optional) directly as Python dictionary
+            self.scheduler = {}
+            if config.has_key('scheduler') and type(config['scheduler']) is dict:
+                self.scheduler = config['scheduler']
+    
+            # stores action_dispatcher section (optional) directly as Python dictionary
+            self.action_dispatcher = {}
+            if config.has_key('action_dispatcher') and type(config['action_dispatcher']) is dict:
+                self.action_dispatcher = config['action_dispatcher']
+    
+            # stores task_state section (optional) directly as Python dictionary
+            self.task_state = {}
+            if config.has_key('task_state') and type(config['task_state']) is dict:
+                self.task_state = config['task_state']
+    
+            # stores history section (optional) directly as Python dictionary
+            self.history = {}
+            if config.has_key('history') and type(config['history']) is dict:
+                self.history = config['history']
+    
+            # stores metrics section (optional) directly as Python dictionary
+            self.metrics = {}
+            if config.has_key('metrics') and type(config['metrics']) is dict:
+                self.metrics = config['metrics']
+    
+            # stores sharding section (optional) directly as Python dictionary
+            self.sharding = {}
+            if config.has_key('sharding') and type(config['sharding']) is dict:
+                self.sharding = config['sharding']
+    
+            # stores process_workers section (optional) directly as Python dictionary
+            self.process_workers = {}
+            if config.has_key('process_workers') and type(config['process_workers']) is dict:
+                self.process_workers = config['process_workers']
+    
             # store config paths
             self.tasks_location = config['config']["tasks_location"]
             self.providers_location = config['config']["providers_location"]
             self.actions_location = config['config']["actions_location"]
+            # Time between two checks of the config files changes (optional, the config files are not watched if not defined)
+            self.watch_interval = config['config'].get("watch_interval")
+            # File where the parsed config files are cached (optional, the config files are always parsed if not defined)
+            self.cache_file = config['config'].get("cache_file")
         
             logger.info('Configuration parsed')
             logger.debug(str(self))
@@ -55,7 +94,16 @@ class NwConfiguration:
             'Config files locations:\n' + \
             'tasks location: {0}\n'.format(self.tasks_location) + \
             'providers location: {0}\n'.format(self.providers_location) + \
-            'actions location: {0}\n'.format(self.actions_location)
+            'actions location: {0}\n'.format(self.actions_location) + \
+            'config files watch interval: {0}\n'.format(self.watch_interval) + \
+            'config cache file: {0}\n'.format(self.cache_file) + \
+            'Scheduler configuration: {0}\n'.format(self.scheduler) + \
+            'Action dispatcher configuration: {0}\n'.format(self.action_dispatcher) + \
+            'Task state configuration: {0}\n'.format(self.task_state) + \
+            'History configuration: {0}\n'.format(self.history) + \
+            'Metrics configuration: {0}\n'.format(self.metrics) + \
+            'Sharding configuration: {0}\n'.format(self.sharding) + \
+            'Process workers configuration: {0}\n'.format(self.process_workers)
 
 conf = NwConfiguration()
 
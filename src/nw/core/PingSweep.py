@@ -0,0 +1,141 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import time
+
+from nw.core.Icmp import getIcmpEngine
+
+
+'''
+This module implements the ping sweep service, shared by all the Ping Providers configured with a "sweep_interval":
+    - the Providers register their target (address, count, timeout) to the service instead of pinging it at each run,
+    - one thread pings all the targets which are due in one pass (the echo requests to all the targets are interleaved on the
+        ICMP socket of the ICMP engine, see IcmpEngine.pingMany),
+    - the Providers read the latest results of their target from the service,
+    - the Providers unregister their target when they are released (task removed or changed by a reload of the configuration).
+A target registered by several Providers (e.g. the same host monitored by several tasks) is pinged once per interval, at the
+shortest interval requested by these Providers, until all these Providers have unregistered it.
+Note: the sweep service requires the ICMP engine (see nw.core.Icmp).
+'''
+
+_tick = 1.0 # Time (in seconds) between two checks of the targets due to be pinged
+
+
+class PingSweep:
+    def __init__(self, engine):
+        self._engine = engine
+        # Registered targets: (addr, count, timeout) -> _SweepTarget
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target = self._run, name = 'PingSweep')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def register(self, addr, count, timeout, interval):
+        '''
+        Register a target to be pinged every interval seconds (if the target is already registered, it is pinged at the shortest
+        of the intervals). Returns the key to use to read the target results with getResult.
+        '''
+        key = (addr, count, timeout)
+        with self._lock:
+            target = self._targets.get(key)
+            if target is None:
+                target = self._targets[key] = _SweepTarget()
+                getLogger(__name__).info('Ping sweep: register target ' + addr + ' (count: ' + str(count) + ', timeout: ' + str(timeout) + ') every ' + str(interval) + ' seconds')
+            target.intervals.append(interval)
+            target.interval = min(target.intervals)
+        return key
+
+    def unregister(self, key, interval):
+        '''
+        Unregister a target registered with interval (see register). The target is no longer pinged once all the Providers which
+        registered it have unregistered it.
+        '''
+        with self._lock:
+            target = self._targets.get(key)
+            if target is None or interval not in target.intervals:
+                return
+            target.intervals.remove(interval)
+            if target.intervals:
+                target.interval = min(target.intervals)
+            else:
+                del self._targets[key]
+                getLogger(__name__).info('Ping sweep: unregister target ' + key[0] + ' (count: ' + str(key[1]) + ', timeout: ' + str(key[2]) + ')')
+
+    def getResult(self, key, timeout = None):
+        '''
+        Return the latest result of the target: the list of the round trip times (in ms) of the received replies, or the Exception
+        raised while pinging it. If the target has not been pinged yet, wait for its first ping (at most timeout seconds, then
+        None is returned). None is also returned if the target is not registered.
+        '''
+        target = self._targets.get(key)
+        if target is None:
+            # Not registered (or unregistered meanwhile)
+            return None
+        target.first_result.wait(timeout)
+        return target.result
+
+    def _run(self):
+        while True:
+            now = time.time()
+            with self._lock:
+                due = [key for key, target in self._targets.iteritems() if target.last_ping is None or now - target.last_ping >= target.interval]
+                for key in due:
+                    self._targets[key].last_ping = now
+            if not due:
+                time.sleep(_tick)
+                continue
+            getLogger(__name__).debug('Ping sweep: ping ' + str(len(due)) + ' targets')
+            try:
+                results = self._engine.pingMany(due)
+            except Exception, e:
+                getLogger(__name__).error('Ping sweep failed', exc_info=True)
+                results = [e] * len(due)
+            with self._lock:
+                for key, result in zip(due, results):
+                    # The target may have been unregistered meanwhile
+                    if self._targets.has_key(key):
+                        self._targets[key].setResult(result)
+
+
+class _SweepTarget:
+    def __init__(self):
+        self.intervals = [] # Intervals requested by the Providers which registered the target
+        self.interval = None # Shortest of these intervals
+        self.last_ping = None # Time of the latest ping of the target
+        self.result = None # Latest result of the target (list of round trip times, or Exception)
+        self.first_result = threading.Event() # Set once the target has been pinged once
+
+    def setResult(self, result):
+        self.result = result
+        self.first_result.set()
+
+
+_sweep = None
+_sweep_lock = threading.Lock()
+
+def getPingSweep():
+    '''
+    Return the ping sweep service shared by the process (started at first call), or None if the ICMP engine is not available.
+    '''
+    global _sweep
+    with _sweep_lock:
+        if _sweep is None:
+            engine = getIcmpEngine()
+            if engine is not None:
+                _sweep = PingSweep(engine)
+        return _sweep
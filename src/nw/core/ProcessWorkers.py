@@ -0,0 +1,421 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+import multiprocessing
+import threading
+import itertools
+import traceback
+import cPickle
+import signal
+import errno
+import time
+import os
+
+from nw.core import ProvidersManager
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import stableHash
+
+
+'''
+This module implements the pool of worker processes running the CPU-heavy Providers (e.g. parsing of large responses), so that they
+do not compete for the GIL with the scheduler and the other tasks:
+    - the Providers listed in the 'providers' field of the 'process_workers' section of the Night Watch main config file are replaced
+        in the tasks by a RemoteProvider, which sends the calls to 'process' to a worker process and waits for the value,
+    - the Providers of a task always run in the same worker (chosen from a hash of the task name), where they are created at their
+        first call and kept, so that the Providers holding connections keep them from one run to another. Each RemoteProvider has
+        its own key in the worker (task name, provider index and a generation number), so that the task replacing a changed task
+        (see TaskManager.reload) gets new Providers, created with its options, and the release of the replaced task only releases
+        its own Providers,
+    - each worker runs the Providers in a pool of threads, so that a Provider waiting for the network does not block the others,
+    - the values are sent back to the tasks, which check their conditions and process their Actions as usual (the state of the tasks
+        stays in the Night Watch process),
+    - the workers are forked by a spawner process, itself forked when the pool is started (before the other threads of Night Watch):
+        forking a worker from the multithreaded Night Watch process could copy a lock held by another thread (e.g. the logging
+        locks), and deadlock the worker,
+    - each worker connects back to the Night Watch process (UNIX socket), which detects that a worker died when its connection is
+        closed: the calls it was processing fail, and the spawner forks a new worker (the Providers are created again in the new worker).
+The values returned by the Providers run in the workers must be picklable.
+'''
+
+_default_threads = 4 # Default number of threads running the Providers in each worker process
+_stop_timeout = 10 # Time (in seconds) to wait for each worker process to stop
+_check_interval = 1 # Time (in seconds) between two checks of the worker processes by the spawner
+
+
+class ProcessWorkers:
+    def __init__(self, workers, providers, threads = _default_threads):
+        self.providers = providers
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {} # request id -> (worker index, Future)
+        self._restarts = 0
+        self._stopped = False
+        # Connection of each worker (None while the worker is started), generation of each worker (incremented at each restart, so
+        # that a connection from a previous worker is ignored), and requests waiting for the connection of each worker
+        self._connections = [None] * workers
+        self._generations = [0] * workers
+        self._backlogs = [[] for index in range(workers)]
+        self._readers = [None] * workers
+        self._authkey = os.urandom(20)
+        self._listener = Listener(family = 'AF_UNIX', authkey = self._authkey)
+        # The spawner is forked first, while this process has no other thread
+        self._spawner, spawner_connection = multiprocessing.Pipe()
+        self._spawner_process = multiprocessing.Process(target = _runSpawner, args = (spawner_connection, self._listener.address, self._authkey, threads),
+                                                        name = 'ProcessWorkers-spawner')
+        self._spawner_process.daemon = True
+        self._spawner_process.start()
+        spawner_connection.close()
+        for index in range(workers):
+            self._startWorker(index)
+        self._thread = threading.Thread(target = self._acceptWorkers, name = 'ProcessWorkers')
+        self._thread.daemon = True
+        self._thread.start()
+        getLogger(__name__).info(str(workers) + ' worker processes started for providers ' + str(providers))
+
+    def runsProvider(self, provider_name):
+        '''
+        Return True if the Provider provider_name must be run in the worker processes.
+        '''
+        return provider_name in self.providers
+
+    def submit(self, key, provider_name, provider_options):
+        '''
+        Send a call to the 'process' method of the Provider identified by key (task name, provider index, generation, see
+        RemoteProvider) to the worker of its task. Returns a Future, whose result is the value returned by the Provider.
+        '''
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                raise Exception('The worker processes are stopped')
+            request_id = self._ids.next()
+            index = stableHash(key[0]) % len(self._connections)
+            self._pending[request_id] = (index, future)
+            self._send(index, ('process', request_id, key, provider_name, provider_options))
+        return future
+
+    def release(self, key):
+        '''
+        Release the Provider identified by key in the worker of its task (the task has been removed or replaced).
+        '''
+        with self._lock:
+            if not self._stopped:
+                self._send(stableHash(key[0]) % len(self._connections), ('release', key))
+
+    def reloadProviderConfigs(self):
+        '''
+        Make the workers read the Providers' config files again (see ProvidersManager.reloadProviderConfigs).
+        '''
+        with self._lock:
+            if not self._stopped:
+                for index in range(len(self._connections)):
+                    self._send(index, ('reload',))
+
+    def getStats(self):
+        '''
+        Return the statistics of the worker processes: number of workers alive, of calls waiting for their value, and of restarts.
+        '''
+        with self._lock:
+            return {'workers': sum(1 for connection in self._connections if connection is not None), 'pending': len(self._pending), 'restarts': self._restarts}
+
+    def stop(self):
+        '''
+        Stop the worker processes (the calls still pending fail).
+        '''
+        with self._lock:
+            self._stopped = True
+            for index in range(len(self._connections)):
+                self._send(index, None)
+            readers = [reader for reader in self._readers if reader is not None]
+        # The workers close their connection once their calls are processed
+        deadline = time.time() + _stop_timeout
+        for reader in readers:
+            reader.join(max(deadline - time.time(), 0))
+        # Stop the spawner, which terminates the workers still running
+        try:
+            self._spawner.send(None)
+        except Exception:
+            getLogger(__name__).warning('Could not stop the spawner of the worker processes', exc_info=True)
+        self._spawner_process.join(_stop_timeout)
+        if self._spawner_process.is_alive():
+            self._spawner_process.terminate()
+        # Unblock the thread waiting for the connections of the workers
+        try:
+            Client(self._listener.address, authkey = self._authkey).close()
+        except Exception:
+            pass
+        self._thread.join(_stop_timeout)
+        self._listener.close()
+        self._failPending(None, 'The worker processes have been stopped')
+        getLogger(__name__).info('Worker processes stopped')
+
+    def _startWorker(self, index):
+        # Must be called with self._lock acquired (or from __init__). The worker gets a new generation, so that the requests sent to the
+        # previous worker (which have failed) are not processed by the new one
+        self._generations[index] += 1
+        self._connections[index] = None
+        self._backlogs[index] = []
+        self._spawner.send(('start', index, self._generations[index]))
+
+    def _send(self, index, request):
+        # Must be called with self._lock acquired. The requests are kept until the worker is connected
+        connection = self._connections[index]
+        if connection is None:
+            if request is not None:
+                self._backlogs[index].append(request)
+            return
+        try:
+            connection.send(request)
+        except Exception:
+            # The worker died, its reader restarts it
+            getLogger(__name__).debug('Could not send request to worker process ' + str(index), exc_info=True)
+
+    def _acceptWorkers(self):
+        # Wait for the connections of the workers started by the spawner
+        while True:
+            try:
+                connection = self._listener.accept()
+            except Exception:
+                with self._lock:
+                    if self._stopped:
+                        return
+                getLogger(__name__).error('Could not accept the connection of a worker process', exc_info=True)
+                continue
+            with self._lock:
+                if self._stopped:
+                    connection.close()
+                    return
+            try:
+                index, generation, pid = connection.recv()
+            except Exception:
+                connection.close()
+                continue
+            with self._lock:
+                if generation != self._generations[index]:
+                    # Worker started before a restart, it stops when its connection is closed
+                    connection.close()
+                    continue
+                self._connections[index] = connection
+                reader = threading.Thread(target = self._readResults, args = (index, generation, connection), name = 'ProcessWorkers-' + str(index))
+                reader.daemon = True
+                self._readers[index] = reader
+                backlog, self._backlogs[index] = self._backlogs[index], []
+                for request in backlog:
+                    self._send(index, request)
+            reader.start()
+            getLogger(__name__).debug('Worker process ' + str(index) + ' (pid ' + str(pid) + ') connected')
+
+    def _readResults(self, index, generation, connection):
+        # Read the values sent by the worker index, until its connection is closed (worker stopped or dead)
+        while True:
+            try:
+                request_id, success, result = connection.recv()
+            except (EOFError, IOError):
+                break
+            with self._lock:
+                worker, future = self._pending.pop(request_id, (None, None))
+            if future is None:
+                # The call has failed meanwhile (worker restarted)
+                continue
+            if success:
+                future.set_result(cPickle.loads(result))
+            else:
+                future.set_exception(Exception('Provider raised an error in worker process ' + str(index) + ':\n' + result))
+        connection.close()
+        with self._lock:
+            if self._stopped or generation != self._generations[index]:
+                return
+            getLogger(__name__).error('Worker process ' + str(index) + ' died, restart it')
+            self._restarts += 1
+            try:
+                self._startWorker(index)
+            except Exception:
+                getLogger(__name__).error('Could not restart worker process ' + str(index) + ', the spawner of the worker processes is not available', exc_info=True)
+        self._failPending(index, 'The worker process died')
+
+    def _failPending(self, index, message):
+        # Fail the pending calls of the worker index (of all the workers if index is None)
+        with self._lock:
+            failed = [request_id for request_id, (worker, future) in self._pending.iteritems() if index is None or worker == index]
+            futures = [self._pending.pop(request_id)[1] for request_id in failed]
+        for future in futures:
+            future.set_exception(Exception(message))
+
+
+def _ignoreSignals():
+    # The signals are handled by the Night Watch process, which stops the spawner and the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _runSpawner(connection, address, authkey, threads):
+    # Main function of the spawner process: fork the workers requested by the Night Watch process. The spawner has only one thread,
+    # so the workers are forked from a process without any lock held by another thread
+    _ignoreSignals()
+    workers = {} # pid -> worker index
+    try:
+        while True:
+            # Reap the workers which have exited
+            while workers:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except OSError, e:
+                    if e.errno != errno.ECHILD:
+                        raise
+                    break
+                if not pid:
+                    break
+                workers.pop(pid, None)
+            if not connection.poll(_check_interval):
+                continue
+            try:
+                request = connection.recv()
+            except EOFError:
+                # The Night Watch process has exited
+                break
+            if request is None:
+                break
+            command, index, generation = request
+            pid = os.fork()
+            if pid == 0:
+                connection.close()
+                status = 0
+                try:
+                    _runWorker(address, authkey, index, generation, threads)
+                except BaseException:
+                    traceback.print_exc()
+                    status = 1
+                os._exit(status)
+            workers[pid] = index
+    finally:
+        # Give the workers the time to process their pending calls, then terminate the workers still running
+        deadline = time.time() + _stop_timeout
+        while workers and time.time() < deadline:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                workers.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+def _runWorker(address, authkey, index, generation, threads):
+    # Main function of the worker processes: create and run the Providers sent by the Night Watch process
+    _ignoreSignals()
+    connection = Client(address, authkey = authkey)
+    connection.send((index, generation, os.getpid()))
+    connection_lock = threading.Lock()
+    providers = {} # (task name, provider index, generation) -> Provider
+    providers_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers = threads)
+
+    def send(result):
+        with connection_lock:
+            connection.send(result)
+
+    def process(request_id, key, provider_name, provider_options):
+        try:
+            with providers_lock:
+                provider = providers.get(key)
+                if provider is None:
+                    provider = providers[key] = ProvidersManager.getProviderClass(provider_name)(provider_options)
+            # The value is pickled here, so that an unpicklable value is reported as an error of the Provider
+            send((request_id, True, cPickle.dumps(provider.process(), cPickle.HIGHEST_PROTOCOL)))
+        except Exception:
+            send((request_id, False, traceback.format_exc()))
+
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, IOError):
+            # The Night Watch process has exited
+            request = None
+        if request is None:
+            break
+        if request[0] == 'process':
+            executor.submit(process, *request[1:])
+        elif request[0] == 'release':
+            with providers_lock:
+                provider = providers.pop(request[1], None)
+            try:
+                if provider is not None:
+                    provider.release()
+            except Exception:
+                getLogger(__name__).error('Provider raised an error while being released in worker process', exc_info=True)
+        elif request[0] == 'reload':
+            ProvidersManager.reloadProviderConfigs()
+    # Wait for the values to be sent to the Night Watch process before exiting
+    executor.shutdown(wait = True)
+    connection.close()
+
+
+class RemoteProvider:
+    '''
+    Provider of a task run in a worker process: its 'process' method sends the call to the worker and waits for the value (at most
+    timeout seconds, the providers_timeout of the task, if it is set).
+    '''
+    def __init__(self, workers, task_name, i, provider_name, provider_options, timeout = None):
+        # Check that the Provider exists (its configuration is checked by the worker, at its first call)
+        ProvidersManager.getProviderClass(provider_name)
+        self.workers = workers
+        self.task_name = task_name
+        self.i = i
+        self.provider_name = provider_name
+        self.provider_options = provider_options
+        self.timeout = timeout
+        # Key of the Provider in the worker: a new generation for each RemoteProvider, so that it gets its own Provider
+        self.key = (task_name, i, _generations.next())
+
+    def process(self):
+        return self.workers.submit(self.key, self.provider_name, self.provider_options).result(self.timeout)
+
+    def release(self):
+        self.workers.release(self.key)
+
+
+# Generation numbers of the RemoteProviders
+_generations = itertools.count()
+
+
+_workers = None
+_workers_lock = threading.Lock()
+
+def getProcessWorkers():
+    '''
+    Return the pool of worker processes (started at first call from the 'process_workers' section of the Night Watch main config
+    file), or None if all the Providers run in the Night Watch process.
+    '''
+    global _workers
+    with _workers_lock:
+        config = getNwConfiguration().process_workers
+        if _workers is None and config.get('workers') and config.get('providers'):
+            _workers = ProcessWorkers(config.get('workers'), list(config.get('providers')), config.get('threads') or _default_threads)
+        return _workers
+
+def stopProcessWorkers():
+    '''
+    Stop the worker processes (if they have been started).
+    '''
+    with _workers_lock:
+        if _workers is not None:
+            _workers.stop()
@@ -18,7 +18,7 @@ from importlib import import_module
 import os
 
 from nw.core.NwConfiguration import getNwConfiguration
-from nw.core.Utils import loadYamlFile
+from nw.core.ConfigCache import loadConfigFile
 
 
 '''
@@ -58,6 +58,20 @@ def getProviderConfig(provider_name):
         return None
 
 
+def getProviderConfigPath(provider_name):
+    '''
+    Return the path of the Provider's config file (the file may not exist).
+    '''
+    return os.path.join(getNwConfiguration().providers_location, provider_name + '.yml')
+
+def reloadProviderConfigs():
+    '''
+    Forget the Providers' config files already loaded, so that they are read again by the next Providers' instances (used when the
+    Night Watch configuration is reloaded).
+    '''
+    _providerConfig.clear()
+
+
 def _loadProvider(provider_name):
     # If the provider module is not already loaded, load it
     if not _loadedProviders.has_key(provider_name):
@@ -71,10 +85,10 @@ def _loadProviderConfig(provider_name):
     # If the provider's config is not already loaded, check if a config exist for this provider and load it
     if not _providerConfig.has_key(provider_name):
         # if the folder which will contain the log file don't exists, create it
-        path_config_file = os.path.join(getNwConfiguration().providers_location, provider_name + '.yml')
+        path_config_file = getProviderConfigPath(provider_name)
         getLogger(__name__).debug('Try to load config file for provider "' + provider_name + '" from location ' + path_config_file)
         if os.path.exists(path_config_file):
-            _providerConfig[provider_name] = loadYamlFile(path_config_file)
+            _providerConfig[provider_name] = loadConfigFile(path_config_file)
             getLogger(__name__).info('Config file for provider "' + provider_name + '" successfully loaded from location ' + path_config_file)
         else:
             # No config file available for this Provider, store None so that the ProvidersManager does not try to load again the config file for this Provider
@@ -0,0 +1,144 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import struct
+import mmap
+import os
+
+
+'''
+This module implements the history of the values collected by a Provider of a task: a ring buffer keeping the latest samples
+(timestamp, value), with a fixed depth.
+The samples are packed in a buffer of fixed size (16 bytes per sample, plus a 16 bytes header), so the memory used by the histories
+of all the tasks is known in advance. The buffer is either in memory, or a memory-mapped file so that the history survives a restart
+of Night Watch.
+The values are stored as floats: None (provider error) and the values which are not numbers are stored as NaN and read back as None.
+'''
+
+_header = struct.Struct('<4sIII') # magic, depth, index of the next sample, number of samples
+_sample = struct.Struct('<dd') # timestamp, value
+_magic = 'NWH1'
+_nan = float('nan')
+
+
+class SampleHistory:
+    def __init__(self, depth, history_file = None):
+        if depth <= 0:
+            raise ValueError('The depth of a history must be a positive integer')
+        self.depth = depth
+        self.history_file = history_file
+        self._lock = threading.Lock()
+        self._size = _header.size + depth * _sample.size
+        if history_file is None:
+            self._mapped = False
+            self._buffer = bytearray(self._size)
+            self._index, self._count = 0, 0
+        else:
+            self._buffer = self._openFile(history_file, self._size)
+        _header.pack_into(self._buffer, 0, _magic, depth, self._index, self._count)
+
+    def append(self, value, timestamp):
+        '''
+        Add a sample to the history (the oldest sample is dropped if the history is full).
+        '''
+        with self._lock:
+            _sample.pack_into(self._buffer, _header.size + self._index * _sample.size, timestamp, _toFloat(value))
+            self._index = (self._index + 1) % self.depth
+            self._count = min(self._count + 1, self.depth)
+            _header.pack_into(self._buffer, 0, _magic, self.depth, self._index, self._count)
+
+    def getSamples(self, count = None):
+        '''
+        Return the list of the latest count samples (all the samples if count is None), as (timestamp, value) tuples from the oldest
+        to the newest.
+        '''
+        with self._lock:
+            count = self._count if count is None else min(count, self._count)
+            samples = []
+            for i in range(self._index - count, self._index):
+                timestamp, value = _sample.unpack_from(self._buffer, _header.size + (i % self.depth) * _sample.size)
+                samples.append((timestamp, None if value != value else value))
+            return samples
+
+    def getLast(self):
+        '''
+        Return the latest sample (timestamp, value), or None if the history is empty.
+        '''
+        samples = self.getSamples(1)
+        return samples[0] if samples else None
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        '''
+        Write the history to its file (if any) and release the file.
+        '''
+        with self._lock:
+            if self._mapped:
+                # Keep a copy of the samples in memory, so that the history can still be read
+                buf = self._buffer
+                self._buffer = bytearray(buf[:])
+                buf.flush()
+                buf.close()
+                self._mapped = False
+
+    def reopen(self):
+        '''
+        Map again the file of a closed history (e.g. if the task replacing the task of the history could not be created).
+        '''
+        with self._lock:
+            if self.history_file is not None and not self._mapped:
+                self._buffer = self._openFile(self.history_file, self._size)
+
+    def remove(self):
+        '''
+        Close the history and delete its file (if any), once its task has been removed.
+        '''
+        self.close()
+        if self.history_file is not None and os.path.exists(self.history_file):
+            try:
+                os.remove(self.history_file)
+            except OSError:
+                getLogger(__name__).warning('Could not remove history file ' + self.history_file, exc_info=True)
+
+    def _openFile(self, history_file, size):
+        # Map the history file, keeping its samples if it has been written with the same depth (otherwise the history is reset)
+        self._index, self._count = 0, 0
+        exists = os.path.exists(history_file) and os.path.getsize(history_file) == size
+        # The file is closed once mapped: the mapping keeps its own file descriptor, so each history holds only one
+        with open(history_file, 'r+b' if exists else 'w+b') as f:
+            if not exists:
+                f.truncate(size)
+            buf = mmap.mmap(f.fileno(), size)
+        self._mapped = True
+        if exists:
+            magic, depth, index, count = _header.unpack_from(buf, 0)
+            if magic == _magic and depth == self.depth and index < depth and count <= depth:
+                self._index, self._count = index, count
+            else:
+                getLogger(__name__).warning('History file ' + history_file + ' is not valid, the history is reset')
+        return buf
+
+
+def _toFloat(value):
+    if value is None:
+        return _nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _nan
@@ -14,58 +14,231 @@
 #    under the License.
 
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 import re
+import calendar
+from datetime import datetime, timedelta
 from logging import getLogger
 
+from nw.core.Utils import period2seconds, stableHash
+
+# List of execution engines supported by the Scheduler (set in field 'engine' of the scheduler section of night-watch.yml).
+# If no engine is configured, 'background' is used by default.
+_engines = [
+            'background', # jobs are run in a pool of threads (each running job holds a thread)
+            'asyncio' # jobs are run from an asyncio event loop (see nw.core.AsyncioEngine, requires the trollius package)
+           ]
+
+# Policies (periods of the tasks) supported by the Scheduler:
+#   - "<period>" (e.g. "30s", "5m", "1h", "2d"): the task runs every period, counted from the time it is scheduled,
+#   - "<period> aligned" (e.g. "5m aligned"): the task runs every period, aligned on the wall clock (e.g. at :00, :05, :10... for 5m),
+#   - "cron <minute> <hour> <day> <month> <day_of_week>" (e.g. "cron */5 8-18 * * mon-fri"): the task runs when the wall clock matches
+#     the cron expression (the days of week are mon,tue,wed,thu,fri,sat,sun, or 0-6 with 0 = monday).
+_aligned_pattern = re.compile(r"^(\S+)\s+aligned$")
+_cron_pattern = re.compile(r"^cron\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)$")
+_cron_fields = ['minute', 'hour', 'day', 'month', 'day_of_week']
+# Bounds of the numbers of each cron field (APScheduler loops forever on the values out of these bounds)
+_cron_bounds = {'minute': (0, 59), 'hour': (0, 23), 'day': (1, 31), 'month': (1, 12), 'day_of_week': (0, 6)}
+_cron_number_pattern = re.compile(r"(/?)([0-9]+)")
+# Origin of the aligned policies (local time): the runs are at the multiples of the period since this date
+_aligned_origin = datetime(2000, 1, 1)
+
+
+def parsePolicy(policy):
+    '''
+    Parse the policy (period) of a task. Returns a tuple (kind, value): ('interval', seconds), ('aligned', seconds) or ('cron', dict
+    of the cron fields). An Exception is raised if the policy is not well defined.
+    '''
+    policy = str(policy).strip()
+    match = _cron_pattern.match(policy)
+    if match:
+        fields = dict(zip(_cron_fields, match.groups()))
+        for field, expression in fields.iteritems():
+            for step, number in _cron_number_pattern.findall(expression):
+                if (step and int(number) == 0) or (not step and not _cron_bounds[field][0] <= int(number) <= _cron_bounds[field][1]):
+                    raise Exception('The cron expression "' + policy + '" is not well defined: ' + field + ' "' + expression + '" is out of range ' + \
+                                    str(_cron_bounds[field][0]) + '-' + str(_cron_bounds[field][1]))
+        try:
+            CronTrigger(**fields)
+        except ValueError, e:
+            raise Exception('The cron expression "' + policy + '" is not well defined: ' + str(e))
+        return 'cron', fields
+    match = _aligned_pattern.match(policy)
+    if match:
+        return 'aligned', period2seconds(match.group(1))
+    return 'interval', period2seconds(policy)
+
+def getPolicyPeriod(policy):
+    '''
+    Return the time (in seconds) between two runs of a task scheduled with the policy, or None for a cron policy.
+    '''
+    kind, value = parsePolicy(policy)
+    return None if kind == 'cron' else value
+
+def stretchPolicy(policy, factor):
+    '''
+    Return the policy with its period multiplied by factor (cron policies are not changed).
+    '''
+    kind, value = parsePolicy(policy)
+    if kind == 'cron':
+        return policy
+    return str(int(value * factor)) + 's' + (' aligned' if kind == 'aligned' else '')
+
+
+class _OffsetTrigger(BaseTrigger):
+    '''
+    Trigger firing offset seconds after the fire times of another trigger.
+    '''
+    def __init__(self, trigger, offset):
+        self.trigger = trigger
+        self.offset = timedelta(seconds = offset)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        next_fire_time = self.trigger.get_next_fire_time(previous_fire_time - self.offset if previous_fire_time else None, now - self.offset)
+        return next_fire_time + self.offset if next_fire_time else None
+
+    def __str__(self):
+        return str(self.trigger) + ' + ' + str(self.offset)
+
+
 class Scheduler:
-    def __init__(self):
+    def __init__(self, engine = 'background', engine_workers = None, job_listener = None):
         self.jobs = {}
-        self.scheduler = BackgroundScheduler({
-            'apscheduler.job_defaults.coalesce': 'true',
-        })
+        # Job id -> job name, used to give the name of the job to the job listener
+        self._job_names = {}
+        # Job name -> offset (in seconds) applied to the runs of the job (see addJob)
+        self._job_offsets = {}
+        # Function called with (job name, event code, planned run time as a timestamp) when a job has been run, has raised an error
+        # or has missed its run time (event codes are apscheduler.events.EVENT_JOB_EXECUTED, EVENT_JOB_ERROR and EVENT_JOB_MISSED)
+        self.job_listener = job_listener
+        if engine not in _engines:
+            raise Exception('Scheduler engine "' + str(engine) + '" is not supported. Supported engines are: ' + str(_engines))
+        self.engine = engine
+        # Event loop used by the asyncio engine (None for the background engine)
+        self.event_loop = None
+        if engine == 'asyncio':
+            # Imported only if required, as the asyncio engine has additional dependencies
+            from apscheduler.schedulers.asyncio import AsyncIOScheduler
+            from nw.core.AsyncioEngine import EventLoopThread, CoroutineExecutor
+            self._event_loop_thread = EventLoopThread(engine_workers)
+            self.event_loop = self._event_loop_thread.loop
+            self.scheduler = AsyncIOScheduler({
+                'apscheduler.job_defaults.coalesce': 'true',
+            }, event_loop = self.event_loop, executors = {'default': CoroutineExecutor()})
+        else:
+            self.scheduler = BackgroundScheduler({
+                'apscheduler.job_defaults.coalesce': 'true',
+            })
+        if job_listener is not None:
+            self.scheduler.add_listener(self._onJobEvent, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
 
 
-    def addJob(self, policy, job_function, job_name):
+    def addJob(self, policy, job_function, job_name, first_run_delay = None, jitter = None):
+        '''
+        Schedule the job according to the policy (see parsePolicy). If jitter (in seconds) is set, the runs of the job are delayed by
+        an offset between 0 and jitter which only depends on the job name, so that the jobs sharing a policy do not run all at once.
+        The first_run_delay only applies to the interval policies (the first run of the other policies is defined by the wall clock).
+        '''
         # Check that a job with the same name has not already be registered
         if self.jobs.has_key(job_name):
             raise Exception ('A job named "' + job_name + '" has already been scheduled')
+        self._job_offsets[job_name] = (stableHash(job_name) % int(jitter * 1000)) / 1000.0 if jitter and int(jitter * 1000) > 0 else 0
         # Get the period trigger to use
-        trigger = self._getTrigger(policy)
+        trigger = self._getTrigger(policy, self._job_offsets[job_name])
         # Add the job to the scheduler
-        j = self.scheduler.add_job(job_function, name = job_name, max_instances = 1, trigger=trigger)
-        getLogger(__name__).debug('Job "' + job_name +'" has been added to scheduler, it has the id ' + j.id + '. It is scheduled every ' + policy)
+        if first_run_delay is None or parsePolicy(policy)[0] != 'interval':
+            # First run is computed by the trigger (one period after the job is added)
+            j = self.scheduler.add_job(job_function, name = job_name, max_instances = 1, trigger=trigger)
+        else:
+            # First run is forced 'first_run_delay' seconds after the job is added, next runs are computed by the trigger
+            j = self.scheduler.add_job(job_function, name = job_name, max_instances = 1, trigger=trigger,
+                                       next_run_time = datetime.now() + timedelta(seconds = first_run_delay))
+        getLogger(__name__).debug('Job "' + job_name +'" has been added to scheduler, it has the id ' + j.id + '. It is scheduled with policy "' + policy + '"')
         # Store job if so that we can update it if needed
         self.jobs[job_name] = j.id
+        self._job_names[j.id] = job_name
 
 
-    def rescheduleJob(self, policy, job_name):
+    def rescheduleJob(self, policy, job_name, keep_phase = False):
+        '''
+        Schedule the job according to a new policy. For the interval policies, the runs restart one period after now, or if keep_phase
+        is True, one new period after the latest planned run of the job (so that the jobs rescheduled at once do not all run at the
+        same time). The runs of the aligned and cron policies are defined by the wall clock.
+        '''
         # Check that the job with job_name well exist
         if not(self.jobs.has_key(job_name)):
             raise Exception ('Job named "' + job_name + '" can not be rescheduled because it is not registered in scheduler')
         # Get the period trigger to use
-        trigger = self._getTrigger(policy)
+        trigger = None
+        if keep_phase:
+            trigger = self._getPhaseTrigger(policy, self.scheduler.get_job(self.jobs.get(job_name)))
+        if trigger is None:
+            trigger = self._getTrigger(policy, self._job_offsets.get(job_name, 0))
         # Reschedule the job with the new trigger
         getLogger(__name__).debug('Reschedule job "' + job_name +'" having id ' + self.jobs.get(job_name))
         self.scheduler.reschedule_job(self.jobs.get(job_name), trigger=trigger)
 
 
+    def removeJob(self, job_name):
+        # Check that the job with job_name well exist
+        if not(self.jobs.has_key(job_name)):
+            raise Exception ('Job named "' + job_name + '" can not be removed because it is not registered in scheduler')
+        getLogger(__name__).debug('Remove job "' + job_name +'" having id ' + self.jobs.get(job_name))
+        job_id = self.jobs.pop(job_name)
+        self._job_names.pop(job_id, None)
+        self._job_offsets.pop(job_name, None)
+        self.scheduler.remove_job(job_id)
+
+
     def start(self):
+        if self.event_loop is not None:
+            self._event_loop_thread.start()
         self.scheduler.start()
-        getLogger(__name__).info('Start scheduler')
+        getLogger(__name__).info('Start scheduler (engine: ' + self.engine + ')')
 
 
     def stop(self):
         self.scheduler.shutdown()
+        if self.event_loop is not None:
+            self._event_loop_thread.stop()
         getLogger(__name__).info('Stop scheduler')
 
 
-    def _getTrigger(self, policy):
-        comp = re.compile("^([0-9]*)([smhd])?$")
-        match = comp.match(policy)
-        policy = match.groups()
-        if (policy[0] == '' or policy[0] == None):
-            raise Exception ("The periodicity of your task is not well defined.")
-        else:
-            period = int(policy[0])
-        return IntervalTrigger(seconds=period)
+    def _onJobEvent(self, event):
+        job_name = self._job_names.get(event.job_id)
+        if job_name is None:
+            # The job has been removed meanwhile
+            return
+        scheduled_run_time = calendar.timegm(event.scheduled_run_time.utctimetuple()) + event.scheduled_run_time.microsecond / 1e6
+        try:
+            self.job_listener(job_name, event.code, scheduled_run_time)
+        except Exception:
+            getLogger(__name__).error('Job listener raised an error for job "' + job_name + '"', exc_info=True)
+
+
+    def _getTrigger(self, policy, offset = 0):
+        kind, value = parsePolicy(policy)
+        if kind == 'cron':
+            trigger = CronTrigger(**value)
+            return _OffsetTrigger(trigger, offset) if offset else trigger
+        if kind == 'aligned':
+            return IntervalTrigger(seconds = value, start_date = _aligned_origin + timedelta(seconds = offset))
+        # First run one period (plus the offset) after now, next runs every period
+        return IntervalTrigger(seconds = value, start_date = datetime.now() + timedelta(seconds = value + offset))
+
+
+    def _getPhaseTrigger(self, policy, job):
+        # Return the trigger of an interval policy whose runs are one period apart from the latest planned run of the job (the next
+        # planned run minus the current period), or None if the policy or the current trigger of the job is not an interval one
+        kind, value = parsePolicy(policy)
+        if kind != 'interval' or job is None or job.next_run_time is None or not isinstance(job.trigger, IntervalTrigger):
+            return None
+        now = datetime.now(job.next_run_time.tzinfo)
+        start_date = job.next_run_time - job.trigger.interval + timedelta(seconds = value)
+        if start_date <= now:
+            # Skip the periods already elapsed, keeping the phase of the runs
+            start_date += timedelta(seconds = value * (int((now - start_date).total_seconds() // value) + 1))
+        return IntervalTrigger(seconds = value, start_date = start_date)
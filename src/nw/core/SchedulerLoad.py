@@ -0,0 +1,100 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import time
+
+
+'''
+This module implements the detection of the overload of the scheduler, from how far the runs of the tasks fall behind their planned
+time: the lag of the run (time between its planned time and its actual start), plus the periods of the runs skipped before it by the
+scheduler (runs coalesced because the previous run was still running or the scheduler was late, without any event nor error):
+    - the lag is averaged over the latest runs of all the tasks (exponential moving average), so that one late run does not make the
+        scheduler overloaded,
+    - the scheduler is overloaded when the average lag exceeds overload_lag, and is back to normal when the average lag falls under
+        half of overload_lag (so that the state does not flap around the threshold),
+    - the tasks whose latest run was more than overload_lag behind its planned time (late start, or runs skipped by the scheduler
+        because the previous run was still running) are reported as behind,
+    - the state is reported as a health signal (see getHealth), and the TaskManager sheds load while the scheduler is overloaded.
+'''
+
+_default_overload_lag = 5 # Default average lag (in seconds, skipped runs included) above which the scheduler is overloaded
+_smoothing = 0.1 # Weight of the latest run in the average lag (about the latest 10 runs)
+
+
+class SchedulerLoad:
+    def __init__(self, overload_lag = _default_overload_lag):
+        self.overload_lag = overload_lag
+        self._lock = threading.Lock()
+        self.lag_avg = 0.0
+        self.overloaded = False
+        self.overloaded_since = None
+        self.overload_count = 0 # Number of times the scheduler has been overloaded since start
+        self._behind = {} # task name -> time (in seconds) its latest run was behind its planned time, if more than overload_lag
+
+    def observeRun(self, task_name, lag, behind):
+        '''
+        Record a run of the task which started lag seconds after its planned time, and was behind seconds behind the planned time
+        of the first run it replaces (lag plus the periods of the runs skipped before it). Returns True if the overload state has
+        changed.
+        '''
+        with self._lock:
+            self.lag_avg += _smoothing * (max(behind, lag, 0) - self.lag_avg)
+            if behind > self.overload_lag:
+                self._behind[task_name] = behind
+            else:
+                self._behind.pop(task_name, None)
+            if not self.overloaded and self.lag_avg > self.overload_lag:
+                self.overloaded = True
+                self.overloaded_since = time.time()
+                self.overload_count += 1
+                getLogger(__name__).warning('Scheduler is overloaded: the tasks run ' + '%.3f' % self.lag_avg + ' seconds behind their planned time on average (' + \
+                                            str(len(self._behind)) + ' tasks behind their planned time)')
+                return True
+            if self.overloaded and self.lag_avg < self.overload_lag / 2.0:
+                getLogger(__name__).warning('Scheduler is back to normal after ' + '%.3f' % (time.time() - self.overloaded_since) + ' seconds of overload')
+                self.overloaded = False
+                self.overloaded_since = None
+                return True
+            return False
+
+    def removeTask(self, task_name):
+        with self._lock:
+            self._behind.pop(task_name, None)
+
+    def isOverloaded(self):
+        return self.overloaded
+
+    def getHealth(self):
+        '''
+        Return the health of the scheduler: a dict with the status ('ok' or 'overloaded'), the average lag, the start of the current
+        overload, the number of overloads since start, and the tasks behind their planned time (task name -> seconds behind).
+        '''
+        with self._lock:
+            return {
+                    'status': 'overloaded' if self.overloaded else 'ok',
+                    'lag_avg': self.lag_avg,
+                    'overloaded_since': self.overloaded_since,
+                    'overload_count': self.overload_count,
+                    'tasks_behind': dict(self._behind)
+                    }
+
+    def getStats(self):
+        '''
+        Return the statistics of the scheduler load (numbers only, exported with the metrics).
+        '''
+        with self._lock:
+            return {'overloaded': int(self.overloaded), 'lag_avg': self.lag_avg, 'overload_count': self.overload_count, 'tasks_behind': len(self._behind)}
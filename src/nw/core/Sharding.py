@@ -0,0 +1,198 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import socket
+import bisect
+import time
+import os
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import period2seconds, stableHash
+
+
+'''
+This module implements the sharding of the tasks between several Night Watch instances sharing the same config files:
+    - each task is run by one instance only, chosen by consistent hashing of the task name on the instances (each instance has
+        several points on a hash ring, a task belongs to the instance of the first point after its hash), so that when an instance
+        joins or leaves, only the tasks of this instance move,
+    - the instances are either a static list (set in the config of every instance), or the instances alive in a shared lock
+        directory: each instance writes a heartbeat file in this directory every heartbeat_interval, and the instances whose heartbeat
+        file has not been written for heartbeat_timeout are considered dead (their tasks are rebalanced on the other instances),
+    - when the instances change, the TaskManager reloads the tasks, scheduling the tasks it now owns and unscheduling the others.
+A task may run on two instances (or on none) for up to heartbeat_interval while the instances change.
+The sharding is configured in the 'sharding' section of the Night Watch main config file (if this section is not defined, all the
+tasks are run by this instance).
+'''
+
+_default_heartbeat_interval = 10 # Default time (in seconds) between two heartbeats of the instance in the lock directory
+_default_heartbeat_timeout = 30 # Default time (in seconds) after which an instance without heartbeat is considered dead
+_virtual_nodes = 64 # Number of points of each instance on the hash ring (more points spread the tasks more evenly)
+_heartbeat_suffix = '.lock'
+
+
+class HashRing:
+    '''
+    Consistent hashing of keys (task names) on a set of members (instances).
+    '''
+    def __init__(self, members):
+        self.members = sorted(set(members))
+        self._ring = sorted((stableHash(member + '#' + str(i)), member) for member in self.members for i in range(_virtual_nodes))
+        self._hashes = [h for h, member in self._ring]
+
+    def getOwner(self, key):
+        '''
+        Return the member owning the key, or None if the ring has no member.
+        '''
+        if not self._ring:
+            return None
+        return self._ring[bisect.bisect(self._hashes, stableHash(key)) % len(self._ring)][1]
+
+
+class Sharding:
+    def __init__(self, instance, instances = None, lock_directory = None, heartbeat_interval = _default_heartbeat_interval,
+                 heartbeat_timeout = _default_heartbeat_timeout):
+        if not instance or '/' in instance:
+            raise ValueError('The name of the instance "' + str(instance) + '" is not valid')
+        if instances and instance not in instances:
+            raise ValueError('The instance "' + instance + '" is not in the sharding instances ' + str(instances))
+        self.instance = instance
+        self.instances = instances
+        self.lock_directory = lock_directory
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self._lock = threading.Lock()
+        self._changed = False
+        self._stopped = threading.Event()
+        self._thread = None
+        if lock_directory:
+            if not os.path.exists(lock_directory):
+                os.makedirs(lock_directory)
+            self._heartbeat_file = os.path.join(lock_directory, instance + _heartbeat_suffix)
+            self._heartbeat()
+        self._ring = HashRing([instance])
+        self._ring = HashRing(self._getMembers())
+        getLogger(__name__).info('Sharding enabled, instance "' + instance + '" among instances ' + str(self._ring.members))
+        if lock_directory:
+            self._thread = threading.Thread(target = self._run, name = 'Sharding')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def isOwner(self, task_name):
+        '''
+        Return True if the task task_name must be run by this instance.
+        '''
+        with self._lock:
+            return self._ring.getOwner(task_name) == self.instance
+
+    def getMembers(self):
+        with self._lock:
+            return list(self._ring.members)
+
+    def hasChanged(self):
+        '''
+        Return True if the instances have changed since the last call (the tasks must be rebalanced).
+        '''
+        with self._lock:
+            changed, self._changed = self._changed, False
+            return changed
+
+    def refresh(self):
+        # Read the instances alive, and rebuild the hash ring if they have changed
+        members = self._getMembers()
+        with self._lock:
+            if members == set(self._ring.members):
+                return
+            joined, left = sorted(members - set(self._ring.members)), sorted(set(self._ring.members) - members)
+            self._ring = HashRing(members)
+            self._changed = True
+        getLogger(__name__).warning('Sharding instances have changed (joined: ' + str(joined) + ', left: ' + str(left) + '), the tasks are rebalanced')
+
+    def stop(self):
+        '''
+        Stop the heartbeat and remove the heartbeat file, so that the other instances take over the tasks of this instance at once.
+        '''
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            try:
+                os.remove(self._heartbeat_file)
+            except OSError:
+                getLogger(__name__).warning('Could not remove heartbeat file ' + self._heartbeat_file, exc_info=True)
+
+    def _heartbeat(self):
+        try:
+            with open(self._heartbeat_file, 'w') as f:
+                f.write(socket.gethostname() + ' ' + str(os.getpid()) + '\n')
+        except IOError:
+            getLogger(__name__).error('Could not write heartbeat file ' + self._heartbeat_file, exc_info=True)
+
+    def _getMembers(self):
+        # The instances of the static list (if any), restricted to the instances alive in the lock directory (if any)
+        members = set(self.instances or [])
+        if self.lock_directory:
+            alive = set()
+            now = time.time()
+            try:
+                for f in os.listdir(self.lock_directory):
+                    if f.endswith(_heartbeat_suffix):
+                        try:
+                            if now - os.path.getmtime(os.path.join(self.lock_directory, f)) <= self.heartbeat_timeout:
+                                alive.add(f[:-len(_heartbeat_suffix)])
+                        except OSError:
+                            # Heartbeat file removed meanwhile (instance stopped)
+                            pass
+            except OSError:
+                getLogger(__name__).error('Could not read lock directory ' + self.lock_directory + ', the instances are not updated', exc_info=True)
+                with self._lock:
+                    return set(self._ring.members)
+            members = members & alive if self.instances else alive
+        # This instance always runs its tasks, even if its heartbeat could not be written
+        members.add(self.instance)
+        return members
+
+    def _run(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            self._heartbeat()
+            self.refresh()
+
+
+_sharding = None
+_sharding_lock = threading.Lock()
+
+def getSharding():
+    '''
+    Return the sharding of the tasks (created at first call from the 'sharding' section of the Night Watch main config file), or None
+    if all the tasks are run by this instance.
+    '''
+    global _sharding
+    with _sharding_lock:
+        config = getNwConfiguration().sharding
+        if _sharding is None and (config.get('instances') or config.get('lock_directory')):
+            _sharding = Sharding(str(config.get('instance') or socket.gethostname()),
+                                 [str(instance) for instance in config.get('instances') or []],
+                                 config.get('lock_directory'),
+                                 period2seconds(config.get('heartbeat_interval')) if config.get('heartbeat_interval') else _default_heartbeat_interval,
+                                 period2seconds(config.get('heartbeat_timeout')) if config.get('heartbeat_timeout') else _default_heartbeat_timeout)
+        return _sharding
+
+def stopSharding():
+    '''
+    Stop the heartbeat of this instance (if the sharding is enabled).
+    '''
+    with _sharding_lock:
+        if _sharding is not None:
+            _sharding.stop()
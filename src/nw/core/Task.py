@@ -14,10 +14,23 @@
 #    under the License.
 
 from logging import getLogger
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import threading
 import operator
+import time
+import os
 
 from nw.core import ProvidersManager
 from nw.core import ActionsManager
+from nw.core.ActionDispatcher import getActionDispatcher
+from nw.core.TaskStateStore import getTaskStateStore
+from nw.core.SampleHistory import SampleHistory
+from nw.core.WindowedCondition import WindowedCondition, aggregates, isNumber
+from nw.core.Metrics import getMetrics
+from nw.core.Scheduler import parsePolicy
+from nw.core.ProcessWorkers import getProcessWorkers, RemoteProvider
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import stableHash, period2seconds
 import nw.core
 
 # List of supported conditions
@@ -32,9 +45,14 @@ _operator_dict = {
                    'different': operator.ne
                   }
 
+# Default number of samples kept in the history of the values of each provider (see nw.core.SampleHistory)
+_default_history_depth = 10
+# Default number of threads of the pool shared by the tasks to run their providers concurrently
+_default_providers_threads = 20
+
 class Task():
     
-    def __init__(self, name, period_success, period_retry, period_failed, retries, providers, actions_failed, actions_success):
+    def __init__(self, name, period_success, period_retry, period_failed, retries, providers, actions_failed, actions_success, max_parallel_providers = None, providers_timeout = None, jitter = None):
         self.name = name
         
         if period_success is None:
@@ -49,9 +67,21 @@ class Task():
             raise ValueError('Mandatory parameter period_failed is not provided to task "' + name + '"')
         self.period_failed = period_failed
         
+        for period in (period_success, period_retry, period_failed):
+            if period is not None:
+                try:
+                    parsePolicy(period)
+                except Exception, e:
+                    raise ValueError('Period "' + str(period) + '" provided to task "' + name + '" is not valid: ' + str(e))
+        
         # Define the task period to period_success at init
         self.period = period_success
         
+        # Maximum delay (in seconds) of the runs of the task, so that the tasks sharing a period do not run all at once (see Scheduler.addJob)
+        if jitter is None:
+            jitter = getNwConfiguration().scheduler.get('jitter')
+        self.jitter = period2seconds(jitter) if jitter else None
+        
         # Number of retries before performing the actions
         if retries is None:
             getLogger(__name__).info('No retries parameter defined for Task "' + self.name + '", do not use retries (action(s) are perform as soon as the task fails)')
@@ -67,10 +97,32 @@ class Task():
         self.provider_conditions = []
         self.provider_thresholds = []
         self.provider_values = []
+        # History of the latest values of each provider (None if the history is disabled for the provider)
+        self.provider_histories = []
+        # Windowed condition of each provider (None if the condition is evaluated on the current value only)
+        self.provider_windows = []
+        # Maximum time (in seconds) to wait for the values of all the providers (by default, wait until all the providers return)
+        if providers_timeout is not None and not (type(providers_timeout) in (int, float) and providers_timeout > 0):
+            raise ValueError('Parameter providers_timeout provided to task "' + name + '" must be a positive number of seconds')
+        self.providers_timeout = providers_timeout
         self._loadProviders(self.providers, providers)
         self.numberOfProvidersFailed = 0
         self.numberOfProviders = len(self.providers)
         getLogger(__name__).info('Number of providers:' + str(self.numberOfProviders))
+        
+        # Maximum number of providers run concurrently (by default, all the providers of the task are run concurrently)
+        if max_parallel_providers is None:
+            self.max_parallel_providers = self.numberOfProviders
+        elif type(max_parallel_providers) is int and max_parallel_providers > 0:
+            self.max_parallel_providers = max_parallel_providers
+        else:
+            raise ValueError('Parameter max_parallel_providers provided to task "' + name + '" must be a positive integer')
+        # Providers of the task whose call is running on the shared pool of threads, including the calls abandoned by a previous run
+        # (providers_timeout elapsed): they count in the max_parallel_providers of the task, and are not called again until they return
+        self._running_providers = set()
+        self._running_providers_lock = threading.Lock()
+        # Function submitting the next provider of the current run (called when a call of the task returns and frees its slot)
+        self._submit_next_provider = None
 
         self.actions_failed = []
         if actions_failed and type(actions_failed) is dict:
@@ -86,6 +138,33 @@ class Task():
             
         # Boolean used to know if the task already failed in the previous iteration (allows to perform actions only the first time the issue failed)
         self._task_failed = False
+        # State (failed, remaining retries) of the task saved in the tasks states store
+        self._saved_state = (self._task_failed, self._remaining_retries)
+        # Time when the latest run of the task started (used to measure the scheduler lag)
+        self.last_run_start = None
+
+    def getState(self):
+        '''
+        Return the state of the task: (failed, remaining retries).
+        '''
+        return self._task_failed, self._remaining_retries
+
+    def restoreState(self, failed, remaining_retries):
+        '''
+        Restore the state of the task saved before the last stop of Night Watch (the task must not be scheduled yet): the task period
+        is set according to the state, and the actions_failed are not processed again if the task was failed.
+        '''
+        self._task_failed = failed
+        # The retries of the task may have been changed in the task config since the state has been saved
+        self._remaining_retries = max(min(remaining_retries, self.retries), 0)
+        if self._task_failed:
+            self.period = self.period_failed
+        elif self._remaining_retries != self.retries:
+            self.period = self.period_retry
+        else:
+            self.period = self.period_success
+        self._saved_state = (self._task_failed, self._remaining_retries)
+        getLogger(__name__).info('State of task "' + self.name + '" restored: ' + ('failed' if self._task_failed else 'not failed') + ', ' + str(self._remaining_retries) + ' remaining retries, period ' + str(self.period))
 
     def _loadActions(self, actions_loaded, actions):
         for action_name, action_options in actions.iteritems():
@@ -106,21 +185,203 @@ class Task():
                 if threshold is None:
                     raise ValueError('Mandatory parameter threshold is not provided to task "' + self.name + '"')
                 self.provider_thresholds.append(threshold)
-                p = ProvidersManager.getProviderClass(provider_name)
-                providers_loaded.append(p(provider_options.get('provider_options')))
+                self.provider_histories.append(self._createHistory(len(self.provider_histories), provider_name, provider_options.get('history_depth')))
+                self.provider_windows.append(self._createWindow(provider_options, condition, threshold, self.provider_histories[-1]))
+                providers_loaded.append(self._createProvider(len(providers_loaded), provider_name, provider_options.get('provider_options')))
+
+    def _createProvider(self, i, provider_name, provider_options):
+        # Create the provider i, in a worker process if the provider is run by the worker processes (see nw.core.ProcessWorkers)
+        workers = getProcessWorkers()
+        if workers is not None and workers.runsProvider(provider_name):
+            return RemoteProvider(workers, self.name, i, provider_name, provider_options, self.providers_timeout)
+        p = ProvidersManager.getProviderClass(provider_name)
+        return p(provider_options)
+
+    def _createHistory(self, i, provider_name, history_depth):
+        # Create the history of the values of the provider i. Its depth is the provider's history_depth, or the depth defined in the
+        # history section of the Night Watch main config file. If a directory is defined in this section, the history is saved in a file.
+        config = getNwConfiguration().history
+        if history_depth is None:
+            history_depth = config.get('depth') if config.get('depth') is not None else _default_history_depth
+        if type(history_depth) is not int or history_depth < 0:
+            raise ValueError('Parameter history_depth provided to task "' + self.name + '" must be a positive integer (or 0 to disable the history)')
+        if history_depth == 0:
+            return None
+        history_file = None
+        if config.get('directory'):
+            if not os.path.exists(config.get('directory')):
+                os.makedirs(config.get('directory'))
+            # The file name only depends on the task name and the provider position, so that the task finds its history after a restart
+            history_file = os.path.join(config.get('directory'), provider_name + '-' + '%08x' % stableHash(self.name + '/' + str(i)) + '.hist')
+        return SampleHistory(history_depth, history_file)
+
+    def _createWindow(self, provider_options, condition, threshold, history):
+        # Create the windowed condition of the provider if an aggregate is defined in its options
+        aggregate = provider_options.get('aggregate')
+        if aggregate is None:
+            return None
+        if aggregate not in aggregates:
+            raise ValueError('Parameter aggregate "' + str(aggregate) + '" provided to task "' + self.name + '" is not allowed. Allowed aggregates are: ' + str(aggregates))
+        if aggregate != 'k_of_n' and not isNumber(threshold):
+            raise ValueError('Parameter threshold provided to task "' + self.name + '" must be a number with aggregate ' + aggregate)
+        # The window is a number of values (integer) or a period (e.g. "5m")
+        window = provider_options.get('window')
+        size, duration = None, None
+        if type(window) is int and window > 0:
+            size = window
+        elif isinstance(window, basestring):
+            duration = period2seconds(window)
+        else:
+            raise ValueError('Mandatory parameter window is not provided to task "' + self.name + '" (or is not a positive integer or a period)')
+        percentile = provider_options.get('percentile')
+        if aggregate == 'percentile' and not (type(percentile) in (int, float) and 0 < percentile <= 100):
+            raise ValueError('Parameter percentile provided to task "' + self.name + '" must be a number between 0 and 100')
+        k = provider_options.get('k')
+        if aggregate == 'k_of_n' and not (type(k) is int and k > 0):
+            raise ValueError('Parameter k provided to task "' + self.name + '" must be a positive integer')
+        windowed_condition = WindowedCondition(aggregate, _operator_dict[condition], threshold, size, duration, percentile, k)
+        # Fill the window with the values saved in the history of the provider (if the history has been kept since the last run)
+        if history is not None:
+            for timestamp, value in history.getSamples():
+                windowed_condition.add(value, timestamp)
+        return windowed_condition
 
     def run(self):
+        # Collect the values from all the providers, then check the values against the task conditions
+        self.last_run_start = time.time()
+        results = self._collectProviderResults()
+        self._processResults(results)
+        self._recordRun(results)
+
+    def stop(self):
+        # Release the resources of the providers (e.g. the providers run in a worker process)
+        for i in range(self.numberOfProviders):
+            try:
+                self.providers[i].release()
+            except Exception:
+                getLogger(__name__).error('Provider "' + self.provider_names[i] + '" raised an error while being released for task "' + self.name + '"', exc_info=True)
+        self.closeHistories()
+
+    def closeHistories(self):
+        # Write the histories of the providers values to their files (if any), and release the files
+        for history in self.provider_histories:
+            if history is not None:
+                history.close()
+
+    def reopenHistories(self):
+        # Map again the files of the histories closed by closeHistories
+        for history in self.provider_histories:
+            if history is not None:
+                history.reopen()
+
+    def removeHistories(self):
+        # Delete the files of the histories once the task has been removed
+        for history in self.provider_histories:
+            if history is not None:
+                history.remove()
+
+    def _processProvider(self, i):
+        # Collect the metric's value from the provider i. Returns a tuple (success, value)
+        start = time.time()
+        try:
+            value = self.providers[i].process()
+            getLogger(__name__).debug('Task "' + self.name + '": used task provider "' + self.provider_names[i] + '" to retrieve the value and got ' + str(value))
+            self._recordProvider(i, start, True)
+            return True, value
+        except:
+            getLogger(__name__).error('Provider "' + self.provider_names[i] + '" raised an error while collecting value for task "' + self.name + '". Not able to process this task.', exc_info=True)
+            self._recordProvider(i, start, False)
+            return False, None
+
+    def _recordProvider(self, i, start, success):
+        # Record the duration of the call to the provider i, started at start, in the metrics
+        getMetrics().observeProvider(self.name, i, self.provider_names[i], time.time() - start, success)
+
+    def _recordRun(self, results):
+        # Record the duration of the run of the task (and whether a provider failed) in the metrics
+        getMetrics().observeTaskRun(self.name, time.time() - self.last_run_start, not all(success for success, value in results))
+
+    def _collectProviderResults(self):
+        # Returns the list of (success, value) tuples collected from the providers, in the order the providers are declared
+        if self.numberOfProviders == 0:
+            return []
+        if self.max_parallel_providers <= 1 and self.providers_timeout is None:
+            # Run the providers one after the other in the current thread
+            return [self._processProvider(i) for i in range(self.numberOfProviders)]
+        
+        # Run the providers concurrently on the pool of threads shared by the tasks
+        futures = self._submitProviders(getProvidersExecutor())
+        # Wait for all the providers, but not longer than the task's providers_timeout (if defined)
+        done, not_done = wait(futures, timeout = self.providers_timeout)
+        results = []
+        for i in range(self.numberOfProviders):
+            if futures[i] in done:
+                results.append(futures[i].result())
+            else:
+                # Provider did not return its value on time, consider it as an error (the provider keeps running in background, its value will be ignored)
+                if not futures[i].cancel():
+                    # The call is running: it keeps its thread and its slot of the task until it returns
+                    getMetrics().countAbandonedCall(self.name, i, self.provider_names[i])
+                getLogger(__name__).error('Provider "' + self.provider_names[i] + '" did not return its value within ' + str(self.providers_timeout) + ' seconds for task "' + self.name + '". Not able to process this task.')
+                results.append((False, None))
+        return results
+
+    def _submitProviders(self, executor):
+        # Submit the providers to the executor, no more than max_parallel_providers of the task at once (including the calls abandoned
+        # by the previous runs): each call which returns submits the next provider. A provider whose previous call is still running is
+        # not called again. Returns the list of Futures of the (success, value) tuples of the providers.
+        futures = [Future() for i in range(self.numberOfProviders)]
+        pending = []
+        with self._running_providers_lock:
+            for i in range(self.numberOfProviders):
+                if i in self._running_providers:
+                    getLogger(__name__).error('Provider "' + self.provider_names[i] + '" of task "' + self.name + '" is still running since a previous run, it is not called again. Not able to process this task.')
+                    futures[i].set_running_or_notify_cancel()
+                    futures[i].set_result((False, None))
+                else:
+                    pending.append(i)
+        pending.reverse()
+        def submitNext():
+            while True:
+                with self._running_providers_lock:
+                    if not pending or len(self._running_providers) >= self.max_parallel_providers:
+                        return
+                    i = pending.pop()
+                    # The providers whose Future has been cancelled (task's providers_timeout elapsed) are not run
+                    if not futures[i].set_running_or_notify_cancel():
+                        continue
+                    self._running_providers.add(i)
+                try:
+                    future = executor.submit(self._processProvider, i)
+                except RuntimeError:
+                    # The executor has been shut down (Night Watch is stopping)
+                    with self._running_providers_lock:
+                        self._running_providers.discard(i)
+                    futures[i].set_result((False, None))
+                    return
+                future.add_done_callback(lambda f, i = i: self._onProviderDone(i, futures[i], f))
+        self._submit_next_provider = submitNext
+        submitNext()
+        return futures
+
+    def _onProviderDone(self, i, future, call):
+        # Called when the call to the provider i returns (even if it has been abandoned): free its slot and submit the next provider of
+        # the current run of the task
+        with self._running_providers_lock:
+            self._running_providers.discard(i)
+        if not future.done():
+            future.set_result(call.result())
+        self._submit_next_provider()
+
+    def _processResults(self, results):
+        self._recordHistory(results)
         self.numberOfProvidersFailed = 0
         i = 0
         for provider in self.providers:
-            try:
-                # Collect the metric's value from the provider
-                value = provider.process()
-                getLogger(__name__).debug('Task "' + self.name + '": used task provider "' + self.provider_names[i] + '" to retrieve the value and got ' + str(value))
-            except:
-                getLogger(__name__).error('Provider "' + self.provider_names[i] + '" raised an error while collecting value for task "' + self.name + '". Not able to process this task.', exc_info=True)
-            else:
-                self._is_condition_conform(value, provider, i)
+            success, value = results[i]
+            # A provider which failed is evaluated if it has a window: its failure is added to the window as a value which is not a number
+            if success or self.provider_windows[i] is not None:
+                self._is_condition_conform(value if success else None, provider, i)
                 if i == self.numberOfProviders - 1:
                     # Check if the value obtained from the provider is conform to the condition defined in the task config
                     if self.numberOfProvidersFailed == self.numberOfProviders:
@@ -159,15 +420,32 @@ class Task():
                         else:
                             getLogger(__name__).debug('Task "' + self.name + '" is still normal.')
             i = i + 1
+        self._saveState()
+    
+    def _recordHistory(self, results):
+        # Add the values collected from the providers to their histories (None if the provider failed)
+        now = time.time()
+        for i in range(self.numberOfProviders):
+            if self.provider_histories[i] is not None:
+                success, value = results[i]
+                self.provider_histories[i].append(value if success else None, now)
+    
+    def _saveState(self):
+        # Save the state of the task in the tasks states store (if any) when it changes
+        state = (self._task_failed, self._remaining_retries)
+        if state != self._saved_state:
+            store = getTaskStateStore()
+            if store is not None:
+                store.update(self.name, self._task_failed, self._remaining_retries)
+            self._saved_state = state
                     
     def _makeAction(self, actions_to_do, log_message, state, conditions, thresholds, values):
         if (actions_to_do):
             for action in actions_to_do:
-                try:
-                    getLogger(__name__).info('Process the action "' + action.__class__.__name__ + '" for task "' + self.name + '" "' + log_message)
-                    action.process(state, conditions, thresholds, values)
-                except:
-                    getLogger(__name__).error('Action "' + action.__class__.__name__ + '" for task "' + self.name + '" "' + log_message +'" raised an error while processing', exc_info=True)
+                # The action is processed by the Action dispatcher, so that the task does not wait for it (the dispatcher retries the
+                # action if it fails). The lists are copied as they are reset by the next run of the task.
+                getLogger(__name__).debug('Dispatch the action "' + action.__class__.__name__ + '" for task "' + self.name + '" ' + log_message)
+                getActionDispatcher().dispatch(self.name, action, log_message, state, list(conditions), list(thresholds), list(values))
         else:
             getLogger(__name__).warning('No action is defined for this task ' + self.name + '" "' + log_message)      
 
@@ -178,7 +456,16 @@ class Task():
         threshold = self.provider_thresholds[i]
         self.provider_values.append(value)
         log_msg = 'Task "' + self.name + '": provider ' + self.provider_names[i] + ' returned ' + str(value) + ', expected: ' + condition + ' ' + str(threshold)
-        if _operator_dict[condition](value, threshold):
+        window = self.provider_windows[i]
+        if window is not None:
+            # Evaluate the condition on the window of the latest values
+            window.add(value, time.time())
+            conform = window.isConform()
+            log_msg += ' (' + window.aggregate + ' over ' + str(len(window)) + ' values: ' + str(window.getValue()) + \
+                       (', k: ' + str(window.k) if window.aggregate == 'k_of_n' else '') + ')'
+        else:
+            conform = _operator_dict[condition](value, threshold)
+        if conform:
             if (self.numberOfProvidersFailed > 0):
                 self.numberOfProvidersFailed = self.numberOfProvidersFailed - 1
             getLogger(__name__).debug(log_msg)
@@ -190,4 +477,29 @@ class Task():
         if new_period != self.period:
             getLogger(__name__).info('Update task period from ' + self.period + ' to ' + new_period)
             self.period = new_period
-            nw.core.TaskManager.getTaskManager().updateTaskPeriod(self)
\ No newline at end of file
+            nw.core.TaskManager.getTaskManager().updateTaskPeriod(self)
+
+
+_providers_executor = None
+_providers_executor_lock = threading.Lock()
+
+def getProvidersExecutor():
+    '''
+    Return the pool of threads shared by the tasks to run their providers concurrently (created at first call, its size is the
+    providers_threads option of the scheduler section of the Night Watch main config file).
+    '''
+    global _providers_executor
+    with _providers_executor_lock:
+        if _providers_executor is None:
+            _providers_executor = ThreadPoolExecutor(max_workers = getNwConfiguration().scheduler.get('providers_threads') or _default_providers_threads)
+        return _providers_executor
+
+def stopProvidersExecutor():
+    '''
+    Stop the pool of threads running the providers (if it has been started), without waiting for the providers still running.
+    '''
+    global _providers_executor
+    with _providers_executor_lock:
+        if _providers_executor is not None:
+            _providers_executor.shutdown(wait = False)
+            _providers_executor = None
@@ -13,86 +13,402 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import os, sys, time
+import os, sys, time, json, hashlib
 from logging import getLogger
+from apscheduler.events import EVENT_JOB_MISSED
 
-from nw.core.Task import Task
+from nw.core.Task import Task, stopProvidersExecutor
+from nw.core import ProvidersManager
+from nw.core import ActionsManager
 from nw.core.NwConfiguration import getNwConfiguration
-from nw.core.Scheduler import Scheduler
-from nw.core.Utils import isYamlFile, loadYamlFile
+from nw.core.Scheduler import Scheduler, getPolicyPeriod, stretchPolicy
+from nw.core.ActionDispatcher import stopActionDispatcher
+from nw.core.EmailDelivery import getEmailDelivery
+from nw.core.TaskStateStore import getTaskStateStore, stopTaskStateStore
+from nw.core.ConfigCache import loadConfigFile, saveConfigCache, startConfigLoad
+from nw.core.Metrics import getMetrics, startMetricsExporter, stopMetricsExporter
+from nw.core.SchedulerLoad import SchedulerLoad, _default_overload_lag
+from nw.core.Sharding import getSharding, stopSharding
+from nw.core.ProcessWorkers import getProcessWorkers, stopProcessWorkers
+from nw.core.Utils import isYamlFile, period2seconds, stableHash
+
+# Time (in seconds) to wait for the queued Actions to be processed when the TaskManager is stopped
+_action_dispatcher_stop_timeout = 30
+# Time (in seconds) to wait for the queued emails to be sent when the TaskManager is stopped
+_email_delivery_stop_timeout = 30
+# Default factor applied to the period_success of the tasks which are not failing while the scheduler is overloaded (1 to disable)
+_default_overload_shedding = 2
 
 class TaskManager:
     def __init__(self):
         self.tasks = {}
+        # Hash of the configuration of each task (see _getTaskHash), used to find the tasks changed when the configuration is reloaded
+        self.task_hashes = {}
         self.scheduler = None
+        # Signature of the config files (see _getConfigSignature), used to detect the changes of the config files
+        self._config_signature = None
+        # Planned time of the latest run of each task, used to count the runs skipped by the scheduler
+        self._last_run_times = {}
+        # Time of the latest change of the period of each task (the planned times of its runs restart from this time)
+        self._reschedule_times = {}
+        # Detection of the scheduler overload (see nw.core.SchedulerLoad)
+        self.scheduler_load = None
+        # True while the period_success of the tasks is stretched because the scheduler is overloaded
+        self._shedding = False
     
     def start(self):
+        # Start the worker processes (if configured) before the other threads of Night Watch, as they are forked from this process
+        workers = getProcessWorkers()
+        if workers is not None:
+            getMetrics().addCollector('process_workers', workers.getStats)
         # Load tasks from the config files located in the config task folder
         self._loadTasks()
-        self.scheduler = Scheduler()
-        for key, task in self.tasks.iteritems():
-            getLogger(__name__).info('Schedule task "' + key + '"')
-            # Add job to the scheduler so that it calls task.run every task.period
-            self.scheduler.addJob(task.period, task.run, task.name)
-            time.sleep(2)
+        overload_lag = getNwConfiguration().scheduler.get('overload_lag')
+        self.scheduler_load = SchedulerLoad(period2seconds(overload_lag) if overload_lag else _default_overload_lag)
+        getMetrics().addCollector('scheduler', self.scheduler_load.getStats)
+        getMetrics().setHealthCheck(self.scheduler_load.getHealth)
+        self.scheduler = Scheduler(getNwConfiguration().scheduler.get('engine') or 'background',
+                                   getNwConfiguration().scheduler.get('engine_workers'),
+                                   job_listener = self._onJobEvent)
+        startup_begin = time.time()
+        self._scheduleTasks(self._getStartupJitter())
         self.scheduler.start()
+        startMetricsExporter()
+        self._config_signature = self._getConfigSignature()
+        getLogger(__name__).info(str(len(self.tasks)) + ' tasks scheduled in ' + '%.3f' % (time.time() - startup_begin) + ' seconds')
+    
+    def reload(self):
+        '''
+        Reload the tasks config files (and the Providers and Actions config files): the new tasks are scheduled, the removed tasks are
+        unscheduled (and their history files deleted), and the tasks whose configuration has changed are replaced (keeping their state
+        and their history). The other tasks are kept as they are, with their Providers' connections and their state.
+        '''
+        getLogger(__name__).info('Reload tasks configuration')
+        reload_begin = time.time()
+        self._config_signature = self._getConfigSignature()
+        startConfigLoad()
+        ProvidersManager.reloadProviderConfigs()
+        ActionsManager.reloadActionConfigs()
+        if getProcessWorkers() is not None:
+            getProcessWorkers().reloadProviderConfigs()
+        try:
+            all_configs = self._readTasksConfigs()
+            configs = self._getOwnedConfigs(all_configs)
+        except Exception:
+            getLogger(__name__).error('Could not read the tasks config files, the tasks are not reloaded', exc_info=True)
+            return
+        store = getTaskStateStore()
+        hashes = dict((task_name, self._getTaskHash(task)) for task_name, (task, task_file) in configs.iteritems())
+        removed = [task_name for task_name in self.tasks if not configs.has_key(task_name)]
+        added = [task_name for task_name in configs if not self.tasks.has_key(task_name)]
+        changed = [task_name for task_name in configs if self.tasks.has_key(task_name) and hashes[task_name] != self.task_hashes.get(task_name)]
+        for task_name in removed:
+            getLogger(__name__).info('Task "' + task_name + '" has been removed (or is now run by another instance), unschedule it')
+            task = self.tasks[task_name]
+            self._unscheduleTask(task_name)
+            task.removeHistories()
+            getMetrics().removeTask(task_name)
+            self.scheduler_load.removeTask(task_name)
+        for task_name in added + changed:
+            task, task_file = configs[task_name]
+            if self.tasks.has_key(task_name):
+                # Write the histories of the task to their files before the new task maps them
+                self.tasks[task_name].closeHistories()
+            try:
+                t = self._createTask(task_name, task)
+            except Exception, e:
+                if self.tasks.has_key(task_name):
+                    self.tasks[task_name].reopenHistories()
+                getLogger(__name__).error('Could not load task "' + task_name + '" from task config file ' + task_file + '. Reason is: ' + str(e.message) + \
+                                          ('. The previous configuration of the task is kept' if self.tasks.has_key(task_name) else ''), exc_info=True)
+                continue
+            if self.tasks.has_key(task_name):
+                getLogger(__name__).info('Task "' + task_name + '" has changed, replace it')
+                # Keep the state of the task, so that its actions_failed are not processed again if it is still failed
+                t.restoreState(*self.tasks[task_name].getState())
+                self._unscheduleTask(task_name)
+            else:
+                getLogger(__name__).info('Task "' + task_name + '" has been added')
+                # Restore the state saved for the task, if it has already been run by this instance or by another instance (sharding)
+                state = store.get(task_name) if store is not None else None
+                if state is not None:
+                    t.restoreState(*state)
+            self.tasks[task_name] = t
+            self.task_hashes[task_name] = hashes[task_name]
+            self._scheduleTask(t, self._getStartupJitter())
+        if store is not None:
+            # Keep the states of the tasks run by the other instances, in case they come back to this instance
+            store.retain(all_configs.keys())
+        # Save the config files parsed during the reload in the config cache (if configured)
+        saveConfigCache()
+        getLogger(__name__).info('Tasks configuration reloaded in ' + '%.3f' % (time.time() - reload_begin) + ' seconds: ' + str(len(added)) + ' tasks added, ' + \
+                                 str(len(changed)) + ' tasks changed, ' + str(len(removed)) + ' tasks removed')
+    
+    def reloadIfChanged(self):
+        # Reload the configuration if a config file has been added, removed or modified since the last (re)load
+        if self.scheduler is not None and self._getConfigSignature() != self._config_signature:
+            self.reload()
+    
+    def rebalanceIfChanged(self):
+        # Reload the tasks if the sharding instances have changed, so that this instance runs the tasks it now owns (and only them)
+        sharding = getSharding()
+        if self.scheduler is not None and sharding is not None and sharding.hasChanged():
+            getLogger(__name__).info('Rebalance the tasks on the sharding instances ' + str(sharding.getMembers()))
+            self.reload()
     
     def updateTaskPeriod(self, task):
+        if self.tasks.get(task.name) is not task:
+            # The task has been removed or replaced by a reload of the configuration
+            return
         # Change the task periodicity in scheduler
         getLogger(__name__).debug('Reschedule task "' + task.name + '" to period ' + task.period)
+        self._reschedule_times[task.name] = time.time()
         # Update scheduler job so that it redefines periodicity of calls to task.run for task task.name
-        self.scheduler.rescheduleJob(task.period, task.name)
+        self.scheduler.rescheduleJob(self._getSchedulePeriod(task), task.name)
     
     def stop(self):
         # Stop the scheduler
         if self.scheduler != None:
             self.scheduler.stop()
+        # Leave the sharding instances, so that the other instances take over the tasks
+        stopSharding()
+        # Release the resources used by the tasks
+        for task in self.tasks.itervalues():
+            task.stop()
+        stopProvidersExecutor()
+        # Stop the worker processes running the providers (if any)
+        stopProcessWorkers()
+        # Write the latest states of the tasks
+        stopTaskStateStore()
+        # Process the Actions still queued
+        stopActionDispatcher(_action_dispatcher_stop_timeout)
+        # Send the emails still queued (or grouped in digests) by the Email Actions
+        getEmailDelivery().stop(_email_delivery_stop_timeout)
+        # Stop exposing the metrics (written one last time to the JSON file, if configured)
+        stopMetricsExporter()
+    
+    def _onJobEvent(self, task_name, event_code, scheduled_run_time):
+        # Record the scheduler metrics of a task when its job has been run or has missed its run time (called by the scheduler)
+        task = self.tasks.get(task_name)
+        if task is None:
+            return
+        # Time between two runs of the task (None for the cron periods, whose runs are not evenly spaced)
+        period = getPolicyPeriod(self._getSchedulePeriod(task))
+        if event_code == EVENT_JOB_MISSED:
+            # The run started too late (more than the misfire grace time) and has been dropped by the scheduler
+            getMetrics().countMissedRuns(task_name)
+            lag = time.time() - scheduled_run_time
+            self._observeLoad(task_name, lag, lag)
+            return
+        lag = task.last_run_start - scheduled_run_time if task.last_run_start is not None else 0
+        getMetrics().observeTaskLag(task_name, lag)
+        previous_run_time = self._last_run_times.get(task_name)
+        self._last_run_times[task_name] = scheduled_run_time
+        skipped = 0
+        if period is not None and previous_run_time is not None and previous_run_time >= self._reschedule_times.get(task_name, 0):
+            # The scheduler coalesces the runs which could not be started on time (previous run still running, or scheduler late)
+            # into one run, without any event: count the periods elapsed since the previous run without a run
+            skipped = max(int(round((scheduled_run_time - previous_run_time) / period)) - 1, 0)
+            if skipped > 0:
+                getMetrics().countMissedRuns(task_name, skipped)
+        self._observeLoad(task_name, lag, lag + skipped * period)
+    
+    def _observeLoad(self, task_name, lag, behind):
+        # Update the scheduler load with a run of the task, and shed load (or stop shedding) if the overload state has changed
+        if self.scheduler_load.observeRun(task_name, lag, behind):
+            self._setShedding(self.scheduler_load.isOverloaded())
+    
+    def _setShedding(self, shedding):
+        # While the scheduler is overloaded, the tasks which are not failing (period_success) run less often, so that the tasks in
+        # retry or failed state (and the other jobs) keep running on time
+        factor = self._getOverloadShedding()
+        if factor <= 1 or shedding == self._shedding:
+            return
+        self._shedding = shedding
+        tasks = [task for task in self.tasks.values() if task.period == task.period_success]
+        getLogger(__name__).warning(('Stretch' if shedding else 'Restore') + ' the period of ' + str(len(tasks)) + ' tasks not failing' + \
+                                    (' by a factor ' + str(factor) + ' while the scheduler is overloaded' if shedding else ''))
+        for task in tasks:
+            try:
+                self._reschedule_times[task.name] = time.time()
+                # Keep the phase of each task, so that the tasks sharing a period keep running at different times
+                self.scheduler.rescheduleJob(self._getSchedulePeriod(task), task.name, keep_phase = True)
+            except Exception:
+                # The task has been removed meanwhile
+                getLogger(__name__).debug('Could not reschedule task "' + task.name + '"', exc_info=True)
+    
+    def _getSchedulePeriod(self, task):
+        # Period to schedule the task with: its current period, stretched if the scheduler is shedding load and the task is not failing
+        if self._shedding and task.period == task.period_success:
+            return stretchPolicy(task.period, self._getOverloadShedding())
+        return task.period
+    
+    def _getOverloadShedding(self):
+        overload_shedding = getNwConfiguration().scheduler.get('overload_shedding')
+        return overload_shedding if overload_shedding is not None else _default_overload_shedding
+    
+    def _getJobFunction(self, task):
+        # Return the function to be called by the scheduler to run the task, according to the scheduler's engine
+        if self.scheduler.engine == 'asyncio':
+            from nw.core.AsyncioEngine import getTaskCoroutine
+            return getTaskCoroutine(task, self.scheduler.event_loop)
+        return task.run
+    
+    def _scheduleTasks(self, startup_jitter):
+        # Register the jobs of all the loaded tasks at once. If a startup jitter is configured, the first runs are spread over the jitter
+        # window. Otherwise, the first run of each task is one period after the first run of the previous task plus 2 seconds (as
+        # when the tasks were registered one after the other every 2 seconds), without blocking the startup
+        if startup_jitter is not None:
+            getLogger(__name__).info('Schedule ' + str(len(self.tasks)) + ' tasks with first runs spread over ' + str(startup_jitter) + ' seconds')
+        for index, (key, task) in enumerate(self.tasks.iteritems()):
+            if startup_jitter is None:
+                period = getPolicyPeriod(task.period)
+                first_run_delay = period + 2 * index if period is not None else None
+            else:
+                first_run_delay = self._getFirstRunDelay(task.name, startup_jitter)
+            getLogger(__name__).info('Schedule task "' + key + '"' + (', first run in ' + '%.3f' % first_run_delay + ' seconds' if first_run_delay is not None else ''))
+            # Add job to the scheduler so that it calls task.run in first_run_delay seconds, then every task.period
+            self.scheduler.addJob(task.period, self._getJobFunction(task), task.name, first_run_delay, task.jitter)
+    
+    def _getFirstRunDelay(self, task_name, startup_jitter):
+        # The delay is computed from a hash of the task name, so that a task always gets the same delay from one start to another
+        # while the tasks are evenly spread over the jitter window
+        return (stableHash(task_name) % 1000) * startup_jitter / 1000.0
             
                     
+    def _getStartupJitter(self):
+        startup_jitter = getNwConfiguration().scheduler.get('startup_jitter')
+        return period2seconds(startup_jitter) if startup_jitter is not None else None
+    
+    def _scheduleTask(self, task, startup_jitter):
+        # Schedule a task added by a reload of the configuration (its first run is spread over the startup jitter window, if any)
+        first_run_delay = self._getFirstRunDelay(task.name, startup_jitter) if startup_jitter is not None else None
+        self.scheduler.addJob(self._getSchedulePeriod(task), self._getJobFunction(task), task.name, first_run_delay, task.jitter)
+    
+    def _unscheduleTask(self, task_name):
+        self.scheduler.removeJob(task_name)
+        self.tasks.pop(task_name).stop()
+        self.task_hashes.pop(task_name, None)
+        self._last_run_times.pop(task_name, None)
+        self._reschedule_times.pop(task_name, None)
+    
+    def _getTaskHash(self, task):
+        # Hash of the configuration of the task, including the config files of the Providers and Actions it uses (as their options
+        # apply to the task unless they are overloaded)
+        h = hashlib.md5(json.dumps(task, sort_keys = True, default = str))
+        config_files = set()
+        for provider in task.get('providers') or []:
+            for provider_name in provider:
+                config_files.add(ProvidersManager.getProviderConfigPath(provider_name))
+        for actions in (task.get('actions_failed'), task.get('actions_success')):
+            if actions and type(actions) is dict:
+                for action_name in actions:
+                    config_files.add(ActionsManager.getActionConfigPath(action_name))
+        for config_file in sorted(config_files):
+            if os.path.exists(config_file):
+                with open(config_file, 'rb') as f:
+                    h.update(config_file + '\0' + f.read())
+        return h.hexdigest()
+    
+    def _getConfigSignature(self):
+        # Signature of the tasks, Providers and Actions config files: (path, modification time, size) of each file
+        signature = []
+        config = getNwConfiguration()
+        for location in (config.tasks_location, config.providers_location, config.actions_location):
+            try:
+                for f in sorted(os.listdir(location)):
+                    path = os.path.join(location, f)
+                    if os.path.isfile(path) and isYamlFile(f):
+                        stat = os.stat(path)
+                        signature.append((path, stat.st_mtime, stat.st_size))
+            except OSError:
+                signature.append((location, None, None))
+        return signature
+    
+    def _readTasksConfigs(self):
+        # Read all the tasks' config files. Returns a dict: task name -> (task config, task config file)
+        # An Exception is raised if the tasks' directory or a task config file can not be read
+        tasks_location = getNwConfiguration().tasks_location
+        
+        tasks_files = []
+        try:
+            for f in os.listdir(tasks_location):
+                if os.path.isfile(os.path.join(tasks_location,f)) and isYamlFile(f):
+                    tasks_files.append(f)
+        except Exception, e:
+            raise Exception('The directory ' + tasks_location + ' is not reachable. Reason is: ' + str(e))
+        
+        getLogger(__name__).debug('List of task config files to load: ' + str(tasks_files))
+        configs = {}
+        # Load all the tasks' config files
+        for task_file in tasks_files:
+            try:
+                getLogger(__name__).info('Load task config file from ' + task_file)
+                config = loadConfigFile(os.path.join(tasks_location,task_file))
+            except Exception, e:
+                raise Exception('Could not read task config file from ' + task_file + '. Reason is: ' + str(e))
+            for task_name, task in (config or {}).iteritems():
+                if configs.has_key(task_name):
+                    getLogger(__name__).warning('A task named "' + task_name + '" has already been loaded and is overwritten by the task from task config file ' + task_file)
+                configs[task_name] = (task, task_file)
+        return configs
+    
+    def _getOwnedConfigs(self, configs):
+        # Keep only the tasks run by this instance (all the tasks if the sharding is not enabled)
+        sharding = getSharding()
+        if sharding is None:
+            return configs
+        owned = dict((task_name, config) for task_name, config in configs.iteritems() if sharding.isOwner(task_name))
+        getLogger(__name__).info('Instance "' + sharding.instance + '" runs ' + str(len(owned)) + ' of the ' + str(len(configs)) + ' tasks')
+        return owned
+    
+    def _createTask(self, task_name, task):
+        getLogger(__name__).debug('Load task "' + task_name + '"')
+        return Task(name = task_name,
+                    period_success = task.get('period_success'),
+                    period_retry = task.get('period_retry'),
+                    period_failed = task.get('period_failed'),
+                    retries = task.get('retries'), 
+                    providers = task.get('providers'),
+                    actions_failed = task.get('actions_failed'),
+                    actions_success = task.get('actions_success'),
+                    max_parallel_providers = task.get('max_parallel_providers'),
+                    providers_timeout = task.get('providers_timeout'),
+                    jitter = task.get('jitter'))
+                    
     def _loadTasks(self):
-            tasks_location = getNwConfiguration().tasks_location
-            
-            tasks_files = []
+            startConfigLoad()
             try:
-                for f in os.listdir(tasks_location):
-                    if os.path.isfile(os.path.join(tasks_location,f)) and isYamlFile(f):
-                        tasks_files.append(f)
+                all_configs = self._readTasksConfigs()
+                configs = self._getOwnedConfigs(all_configs)
             except Exception, e:
-                getLogger(__name__).critical('The directory ' + tasks_location + ' is not reachable', exc_info=True)
+                getLogger(__name__).critical(str(e), exc_info=True)
                 exit(-1)
-            
-            getLogger(__name__).debug('List of task config files to load: ' + str(tasks_files))
-            # Load all the tasks' config files
-            for task_file in tasks_files:
+                
+            # Instantiate a Task for every task in the tasks config files
+            for task_name, (task, task_file) in configs.iteritems():
                 try:
-                    getLogger(__name__).info('Load task config file from ' + task_file)
-                    config = loadYamlFile(os.path.join(tasks_location,task_file))
+                    self.tasks[task_name] = self._createTask(task_name, task)
+                    self.task_hashes[task_name] = self._getTaskHash(task)
+                # TODO: add a better error management (specific errors for invalid configuration, missing required parameters, provider/action initialization problem,...)
                 except Exception, e:
-                    getLogger(__name__).critical('Could not read task config file from ' + task_file + '. Reason is: ' + e.message, exc_info=True)
-                    exit(-1)
-                    
-                # Instantiate a Task for every task in the current task config file
-                for task_name, task in config.iteritems():
-                    getLogger(__name__).debug('Load task "' + task_name + '"')
-                    try:
-                        t = Task(name = task_name,
-                            period_success = task.get('period_success'),
-                            period_retry = task.get('period_retry'),
-                            period_failed = task.get('period_failed'),
-                            retries = task.get('retries'), 
-                            providers = task.get('providers'),
-                            actions_failed = task.get('actions_failed'),
-                            actions_success = task.get('actions_success'))
-                        
-                        if self.tasks.has_key(t.name)   :
-                            getLogger(__name__).warning('A task named "' + task_name + '" has already been loaded and is overwritten by the task from task config file ' + task_file)
-                        self.tasks[t.name] = t
-                    # TODO: add a better error management (specific errors for invalid configuration, missing required parameters, provider/action initialization problem,...)
-                    except Exception, e:
-                        # TBD: Exit program with critical error or execute the successfully loaded tasks anyway?
-                        print "Error occurred during the Night Watch starting..."
-                        getLogger(__name__).critical('Could not load task "' + task_name + '" from task config file ' + task_file + '. Reason is: ' + str(e.message), exc_info=True)
-                        sys.exit(2)
+                    # TBD: Exit program with critical error or execute the successfully loaded tasks anyway?
+                    print "Error occurred during the Night Watch starting..."
+                    getLogger(__name__).critical('Could not load task "' + task_name + '" from task config file ' + task_file + '. Reason is: ' + str(e.message), exc_info=True)
+                    sys.exit(2)
+            
+            # Restore the states of the tasks saved before the last stop (if the tasks states are saved)
+            store = getTaskStateStore()
+            if store is not None:
+                for task in self.tasks.itervalues():
+                    state = store.get(task.name)
+                    if state is not None:
+                        task.restoreState(*state)
+                # Keep the states of the tasks run by the other instances, in case they come back to this instance
+                store.retain(all_configs.keys())
+            
+            # Save the config files parsed during the loading in the config cache (if configured)
+            saveConfigCache()
 
 
 tm = TaskManager()
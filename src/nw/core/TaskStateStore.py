@@ -0,0 +1,228 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+import threading
+import sqlite3
+import time
+import json
+import os
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.Utils import period2seconds, stableHash
+
+
+'''
+This module implements the store of the tasks states (task failed or not, remaining retries), saved in a SQLite database so that
+a restart of Night Watch does not make the failed tasks run their retries and process their actions_failed again:
+    - the states are loaded once from the database when the store is opened, and read by the TaskManager when the tasks are loaded,
+    - the tasks only update the store when their state changes. The updates are kept in memory and written to the database every
+        flush_interval seconds in one transaction (if a task changes several times between two writes, only its latest state is written),
+    - the states of the tasks which are not configured anymore are removed from the database. The states of the tasks run by other
+        instances (see nw.core.Sharding) are kept, so that a task which comes back to this instance after a rebalance gets its state back,
+    - if a shared directory is configured (e.g. on the NFS share of the sharding lock_directory), each state written to the database is
+        also written to a small file of this directory, so that a task moved to another instance by a rebalance (instance stopped or
+        dead) starts from its latest state there instead of processing its actions_failed again. The most recent state wins, the
+        clocks of the instances must be synchronized.
+The store is configured in the 'task_state' section of the Night Watch main config file (if this section is not defined, the tasks
+states are not saved).
+'''
+
+_default_flush_interval = 5 # Default time (in seconds) between two writes of the updated states to the database
+
+
+class TaskStateStore:
+    def __init__(self, state_file, flush_interval = _default_flush_interval, shared_directory = None):
+        self.state_file = state_file
+        self.flush_interval = flush_interval
+        self.shared_directory = shared_directory
+        self._lock = threading.Lock()
+        # States written in the database: task name -> (failed, remaining retries)
+        self._states = {}
+        # Time of the latest change of the states written in the database: task name -> timestamp
+        self._updated = {}
+        # States updated since the last write: task name -> (failed, remaining retries)
+        self._dirty = {}
+        self._stopped = threading.Event()
+        for directory in (os.path.dirname(state_file), shared_directory):
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+        self._db = sqlite3.connect(state_file, check_same_thread = False)
+        # The state is written in batches, no need to wait for the disk at each transaction (WAL mode keeps the database consistent)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS task_state (name TEXT PRIMARY KEY, failed INTEGER NOT NULL, remaining_retries INTEGER NOT NULL, updated REAL NOT NULL)')
+        self._db.commit()
+        for name, failed, remaining_retries, updated in self._db.execute('SELECT name, failed, remaining_retries, updated FROM task_state'):
+            self._states[name] = (bool(failed), remaining_retries)
+            self._updated[name] = updated
+        getLogger(__name__).info('Tasks states loaded from ' + state_file + ' (' + str(len(self._states)) + ' tasks)')
+        self._thread = threading.Thread(target = self._run, name = 'TaskStateStore')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self, task_name):
+        '''
+        Return the latest state (failed, remaining retries) saved for the task task_name, or None if no state is saved for this task.
+        The state saved in the shared directory (if any) is returned if it is more recent, i.e. if the task has been run by another
+        instance since this instance saved its state.
+        '''
+        with self._lock:
+            if self._dirty.has_key(task_name):
+                return self._dirty[task_name]
+            state, updated = self._states.get(task_name), self._updated.get(task_name, 0)
+        if self.shared_directory:
+            shared = self._readSharedState(task_name)
+            if shared is not None and shared[1] > updated:
+                getLogger(__name__).info('State of task "' + task_name + '" taken over from the shared directory ' + self.shared_directory)
+                return shared[0]
+        return state
+
+    def update(self, task_name, failed, remaining_retries):
+        '''
+        Save the new state of the task task_name (written to the database at the next flush).
+        '''
+        with self._lock:
+            self._dirty[task_name] = (failed, remaining_retries)
+
+    def retain(self, task_names):
+        '''
+        Remove the states of the tasks which are not in task_names (tasks which are not configured anymore). task_names must contain
+        all the configured tasks, including the tasks run by the other instances.
+        '''
+        task_names = set(task_names)
+        with self._lock:
+            removed = [name for name in self._states if name not in task_names]
+            for name in removed:
+                del self._states[name]
+                self._updated.pop(name, None)
+                self._dirty.pop(name, None)
+            if removed:
+                self._db.executemany('DELETE FROM task_state WHERE name = ?', [(name,) for name in removed])
+                self._db.commit()
+                getLogger(__name__).info('States of ' + str(len(removed)) + ' tasks not configured anymore removed from ' + self.state_file)
+        if self.shared_directory:
+            for name in removed:
+                try:
+                    os.remove(self._getSharedFile(name))
+                except OSError:
+                    # Already removed by another instance (or never written)
+                    pass
+
+    def flush(self):
+        '''
+        Write the states updated since the last write to the database, in one transaction.
+        '''
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty = self._dirty
+            self._dirty = {}
+            now = time.time()
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO task_state (name, failed, remaining_retries, updated) VALUES (?, ?, ?, ?)',
+                                     [(name, int(failed), remaining_retries, now) for name, (failed, remaining_retries) in dirty.iteritems()])
+                self._db.commit()
+            except Exception:
+                getLogger(__name__).error('Could not write tasks states to ' + self.state_file, exc_info=True)
+                self._db.rollback()
+                # Keep the states to write them at the next flush (unless they have been updated again meanwhile)
+                dirty.update(self._dirty)
+                self._dirty = dirty
+                return
+            self._states.update(dirty)
+            self._updated.update((name, now) for name in dirty)
+        getLogger(__name__).debug('States of ' + str(len(dirty)) + ' tasks written to ' + self.state_file)
+        if self.shared_directory:
+            # Written outside of the lock, so that the tasks do not wait for the shared directory
+            for name, (failed, remaining_retries) in dirty.iteritems():
+                self._writeSharedState(name, failed, remaining_retries, now)
+
+    def stop(self):
+        '''
+        Write the pending states and close the database.
+        '''
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def _getSharedFile(self, task_name):
+        # The file name only depends on the task name, so that all the instances use the same file for a task
+        return os.path.join(self.shared_directory, '%08x' % stableHash(task_name) + '.state')
+
+    def _writeSharedState(self, task_name, failed, remaining_retries, updated):
+        path = self._getSharedFile(task_name)
+        try:
+            # Write a temporary file first, so that the other instances never read a partially written state
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'name': task_name, 'failed': failed, 'remaining_retries': remaining_retries, 'updated': updated}, f)
+            os.rename(path + '.tmp', path)
+        except Exception:
+            getLogger(__name__).error('Could not write the state of task "' + task_name + '" to the shared directory ' + self.shared_directory, exc_info=True)
+
+    def _readSharedState(self, task_name):
+        # Return ((failed, remaining retries), time of the change) saved in the shared directory for the task, or None
+        path = self._getSharedFile(task_name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except Exception:
+            getLogger(__name__).warning('Could not read the state of task "' + task_name + '" from the shared directory ' + self.shared_directory, exc_info=True)
+            return None
+        # Another task may have the same file name (hash collision)
+        if state.get('name') != task_name:
+            return None
+        return (bool(state['failed']), state['remaining_retries']), state['updated']
+
+
+_store = None
+_store_failed = False # True if the tasks state file could not be opened
+_store_lock = threading.Lock()
+
+def getTaskStateStore():
+    '''
+    Return the tasks states store shared by the process (opened at first call from the 'task_state' section of the Night Watch main
+    config file), or None if the tasks states are not saved.
+    '''
+    global _store, _store_failed
+    with _store_lock:
+        if _store is None:
+            config = getNwConfiguration().task_state
+            if config.get('file') and not _store_failed:
+                try:
+                    _store = TaskStateStore(config.get('file'),
+                                            period2seconds(config.get('flush_interval')) if config.get('flush_interval') else _default_flush_interval,
+                                            config.get('shared_directory'))
+                except Exception:
+                    # Do not prevent the tasks from running, and do not try again for each task
+                    getLogger(__name__).error('Could not open tasks state file ' + str(config.get('file')) + ', the state of the tasks is not saved', exc_info=True)
+                    _store_failed = True
+        return _store
+
+def stopTaskStateStore():
+    '''
+    Write the pending states and close the tasks states store (if it has been opened).
+    '''
+    with _store_lock:
+        if _store is not None:
+            _store.stop()
@@ -14,6 +14,22 @@
 #    under the License.
 
 import yaml
+import re
+import hashlib
+
+# Use the C yaml loader (much faster) if PyYAML has been built with libyaml, the pure Python loader otherwise
+_yaml_loader = getattr(yaml, 'CLoader', yaml.Loader)
+
+# Regex used to parse periods (e.g. "30s", "5m", "1h", "2d" or simply "30" for 30 seconds)
+_period_pattern = re.compile("^([0-9]+)([smhd])?$")
+# Number of seconds for each unit of a period
+_period_units = {
+                 None: 1,
+                 's': 1,
+                 'm': 60,
+                 'h': 3600,
+                 'd': 86400
+                }
 
 def str2num(s):
     try:
@@ -30,6 +46,24 @@ def isYamlFile(f):
 def loadYamlFile(f):
     if isYamlFile(f):
         with open(f, "r") as yml:
-            return yaml.load(yml)
+            return yaml.load(yml, Loader = _yaml_loader)
     else:
         raise Exception('The file "' + f + '" is not a yaml file.')
+
+def period2seconds(period):
+    '''
+    Convert a period (e.g. "30s", "5m", "1h", "2d" or an integer number of seconds) into a number of seconds (integer).
+    An Exception is raised if the period is not well defined.
+    '''
+    match = _period_pattern.match(str(period).strip())
+    if not match:
+        raise Exception('The period "' + str(period) + '" is not well defined (expected format is "<integer>[s|m|h|d]").')
+    return int(match.group(1)) * _period_units[match.group(2)]
+
+def stableHash(s):
+    '''
+    Return a hash (integer) of the string s which, unlike the builtin hash(), is the same on every host and every run.
+    '''
+    if isinstance(s, unicode):
+        s = s.encode('utf-8')
+    return int(hashlib.md5(s).hexdigest()[:8], 16)
@@ -0,0 +1,163 @@
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import deque
+import bisect
+import numbers
+
+
+'''
+This module implements the conditions of the tasks evaluated on a window of the latest values of a provider, instead of its
+current value only:
+    - 'avg': the average of the values of the window is compared to the threshold,
+    - 'percentile': the given percentile of the values of the window is compared to the threshold,
+    - 'rate': the rate of change (per second) between the oldest and the newest values of the window is compared to the threshold,
+    - 'k_of_n': each value of the window is compared to the threshold (as returned by the provider, so it may be e.g. a string), the
+        condition fails if at least k values do not match.
+The window is either the latest N values (window defined as an integer), or the values of the latest T seconds (window defined as
+a period, e.g. "5m").
+The windows are updated incrementally when a value is added: the average, the rate and the number of failed values are computed in
+O(1), the percentile in O(log N) to find the position of the value in the sorted values list, plus O(N) to shift the list (a memmove
+of at most N pointers, negligible for the windows of a few hundreds of values used by the tasks).
+The values which are not numbers (e.g. None when the provider failed, or a boolean) take their place in the window but are not
+aggregated: the aggregates other than 'k_of_n' do not match the condition while the latest value is not a number. For 'k_of_n', None
+(provider failed) counts as a failed value.
+Note: the history of the provider, from which the windows are filled at startup, only keeps numbers (see nw.core.SampleHistory): the
+other values (e.g. the strings compared by 'k_of_n') are restored as None, so they count as failed values until they leave the window.
+'''
+
+# List of the aggregates supported by the windowed conditions
+aggregates = ['avg', 'percentile', 'rate', 'k_of_n']
+
+
+class WindowedCondition:
+    def __init__(self, aggregate, operator, threshold, size = None, duration = None, percentile = None, k = None):
+        '''
+        Condition comparing with operator the aggregate of the window of the latest size values (or of the values of the latest
+        duration seconds) to threshold.
+        '''
+        self.aggregate = aggregate
+        self.operator = operator
+        self.threshold = threshold
+        self.size = size
+        self.duration = duration
+        self.percentile = percentile
+        self.k = k
+        self._samples = deque() # (timestamp, value, failed) of the values of the window, from the oldest to the newest (value is None if not a number, failed is only set for k_of_n)
+        self._numbers = deque() # (timestamp, value) of the values of the window which are numbers, from the oldest to the newest
+        self._sum = 0.0 # avg: sum of the values of the window
+        self._sorted = [] # percentile: values of the window, sorted
+        self._failed = 0 # k_of_n: number of values of the window which do not match the condition
+
+    def add(self, value, timestamp):
+        '''
+        Add a value to the window (removing the values which are out of the window). None (provider failed) counts as a failed
+        value for 'k_of_n'.
+        '''
+        failed = self.aggregate == 'k_of_n' and not self._matches(value)
+        value = _toNumber(value)
+        self._samples.append((timestamp, value, failed))
+        if failed:
+            self._failed += 1
+        if value is not None:
+            self._numbers.append((timestamp, value))
+            self._onAdd(value)
+        while (self.size is not None and len(self._samples) > self.size) or \
+              (self.duration is not None and timestamp - self._samples[0][0] > self.duration):
+            oldest_timestamp, value, failed = self._samples.popleft()
+            if failed:
+                self._failed -= 1
+            if value is not None:
+                # The oldest value of the window which is a number is the oldest of the numbers
+                self._numbers.popleft()
+                self._onRemove(value)
+
+    def getValue(self):
+        '''
+        Return the aggregate of the window (the number of values which do not match the condition for 'k_of_n'), or None if the
+        window does not contain enough values.
+        '''
+        if self.aggregate == 'k_of_n':
+            return self._failed if self._samples else None
+        if not self._numbers:
+            return None
+        if self.aggregate == 'avg':
+            return self._sum / len(self._numbers)
+        if self.aggregate == 'percentile':
+            # Nearest-rank percentile
+            rank = max(int(round(self.percentile / 100.0 * len(self._sorted))), 1)
+            return self._sorted[rank - 1]
+        if self.aggregate == 'rate':
+            (first_timestamp, first_value), (last_timestamp, last_value) = self._numbers[0], self._numbers[-1]
+            if last_timestamp <= first_timestamp:
+                return None
+            return (last_value - first_value) / float(last_timestamp - first_timestamp)
+
+    def isConform(self):
+        '''
+        Return True if the window matches the condition (also if the window does not contain enough values to be evaluated), False
+        if the latest value is not a number (except for 'k_of_n', where it counts as one of the failed values).
+        '''
+        value = self.getValue()
+        if self.aggregate == 'k_of_n':
+            return value is None or value < self.k
+        if self._samples and self._samples[-1][1] is None:
+            return False
+        if value is None:
+            return True
+        return self.operator(value, self.threshold)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def _matches(self, value):
+        # k_of_n: compare the value returned by the provider to the threshold (None, the provider failed, does not match)
+        if value is None:
+            return False
+        try:
+            return bool(self.operator(value, self.threshold))
+        except Exception:
+            return False
+
+    def _onAdd(self, value):
+        if self.aggregate == 'avg':
+            self._sum += value
+        elif self.aggregate == 'percentile':
+            bisect.insort(self._sorted, value)
+
+    def _onRemove(self, value):
+        if self.aggregate == 'avg':
+            self._sum -= value
+        elif self.aggregate == 'percentile':
+            del self._sorted[bisect.bisect_left(self._sorted, value)]
+
+
+def isNumber(value):
+    '''
+    Return True if value is a number (e.g. int, float or decimal.Decimal) which can be aggregated. The booleans are not numbers.
+    '''
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _toNumber(value):
+    # Return the value as a float (as it is stored in the history of the provider), or None if it is not a number
+    if not isNumber(value):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        # e.g. a complex number
+        return None
+    return None if value != value else value
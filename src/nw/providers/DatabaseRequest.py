@@ -16,9 +16,235 @@
 from nw.providers.Provider import Provider
 
 from logging import getLogger
-import psycopg2, psycopg2.extras
+from contextlib import contextmanager
+import threading
+import hashlib
+import time
+import psycopg2
 import MySQLdb
 
+# List of data the DatabaseRequest Provider can return (set in Provider's config field 'requested_data').
+# If the Provider is configured with another requested_data, an exception is raised.
+# If no requested_data is configured for DatabaseRequest Provider, status is used by default.
+_data_available = [
+                   'status', # returns "OK" if the request succeeded, "NOK" otherwise (string). See option 'status_requires_row' for the requests returning no row
+                   'value', # returns the value of the first row of the request result, in the first column or in the column set in 'column' option (None if the request returned no row or failed)
+                   'response_time' # returns the execution time of the request (in ms) (float) (None if the request failed)
+                  ]
+
+
+def _connectPostgresql(host, database, user, password, read_only, statement_timeout):
+    con = psycopg2.connect(host=str(host), database=str(database), user=str(user), password=str(password))
+    if read_only:
+        con.set_session(readonly=True, autocommit=True)
+    if statement_timeout:
+        cursor = con.cursor()
+        cursor.execute('SET statement_timeout = %s', (int(statement_timeout * 1000),))
+        cursor.close()
+        con.commit()
+    return con
+
+def _connectMysql(host, database, user, password, read_only, statement_timeout):
+    con = MySQLdb.connect(host, user, password, database)
+    cursor = con.cursor()
+    if read_only:
+        con.autocommit(True)
+        cursor.execute('SET SESSION TRANSACTION READ ONLY')
+    if statement_timeout:
+        # Note: max_execution_time (MySQL >= 5.7.8) only applies to SELECT statements. The older servers do not know it: the requests
+        # are then run without statement timeout rather than failing the connection
+        try:
+            cursor.execute('SET SESSION max_execution_time = %s', (int(statement_timeout * 1000),))
+        except MySQLdb.Error:
+            getLogger(__name__).warning('Could not set the statement timeout of the connection to MySQL database ' + str(database) + ' on ' + str(host) + \
+                                        ' (max_execution_time requires MySQL >= 5.7.8), the requests are run without statement timeout', exc_info=True)
+    cursor.close()
+    return con
+
+# Functions opening a connection for each type of database supported by DatabaseRequest Provider
+_connect_functions = {
+                   'postgresql': _connectPostgresql,
+                   'mysql': _connectMysql
+                  }
+
+# Default values of the connection pool options (see DatabaseRequest._optional_parameters)
+_default_pool_min_size = 1
+_default_pool_max_size = 5
+_default_pool_idle_timeout = 300
+_checkout_timeout = 30 # Maximum time (in seconds) to wait for a connection when all the connections of a pool are in use
+_max_reconnect_delay = 60 # Maximum time (in seconds) between two attempts to connect to a database which can not be reached
+_sweep_interval = 30 # Time (in seconds) between two closings of the idle connections of all the pools (see _sweepPools)
+
+# Connection pools shared by all the DatabaseRequest Providers:
+# (database_type, host, database, user, hash of the password, read_only, statement_timeout) -> _ConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+_sweep_thread = None
+
+
+class _ConnectionPool:
+    '''
+    Pool of connections to one database, shared by all the DatabaseRequest Providers using the same database, user and session settings:
+        - the connections are checked (SELECT 1) before being used, broken connections are closed and replaced,
+        - the connections unused for idle_timeout seconds are closed, except the min_size most recently used ones (when a connection
+            is checked out, and periodically for all the pools, see _sweepPools),
+        - at most max_size connections are opened, the Providers wait for a free connection if all of them are in use,
+        - if the database can not be reached, the next attempts to connect are delayed (the delay doubles after each failure).
+    '''
+    def __init__(self, name, connect, min_size, max_size, idle_timeout):
+        self.name = name
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = [] # Connections not in use: list of (connection, time when it has been checked in)
+        self._size = 0 # Number of connections opened (in use and idle)
+        self._condition = threading.Condition()
+        self._reconnect_delay = 0
+        self._next_connect = 0 # Time before which no connection attempt is made (backoff after a connection failure)
+
+    @contextmanager
+    def connection(self):
+        '''
+        Context manager checking out a connection from the pool, and giving it back to the pool when the block ends (even if it raised an error).
+        '''
+        con = self._checkout()
+        try:
+            yield con
+        except:
+            self._checkin(con, rollback = True)
+            raise
+        else:
+            self._checkin(con)
+
+    def _checkout(self):
+        deadline = time.time() + _checkout_timeout
+        while True:
+            with self._condition:
+                self._closeIdleConnections()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Exception('No connection to database ' + self.name + ' available after ' + str(_checkout_timeout) + ' seconds (all the ' + str(self.max_size) + ' connections are in use)')
+                    self._condition.wait(remaining)
+                if self._idle:
+                    # Use the most recently used connection (the older ones are closed when they are idle for too long)
+                    con = self._idle.pop()[0]
+                else:
+                    if time.time() < self._next_connect:
+                        raise Exception('Database ' + self.name + ' is not reachable, next connection attempt in ' + '%.0f' % (self._next_connect - time.time()) + ' seconds')
+                    # Reserve the place of the new connection in the pool, the connection is opened without holding the lock
+                    con = None
+                    self._size += 1
+            # Connection and validation are performed without holding the lock, so that the other Providers are not blocked meanwhile
+            if con is None:
+                return self._open()
+            if self._isValid(con):
+                return con
+            getLogger(__name__).info('Connection to database ' + self.name + ' is broken, close it')
+            with self._condition:
+                self._close(con)
+                self._condition.notify()
+
+    def _checkin(self, con, rollback = False):
+        with self._condition:
+            try:
+                if rollback:
+                    # End the transaction which failed, so that the connection can be reused
+                    con.rollback()
+                self._idle.append((con, time.time()))
+            except Exception:
+                getLogger(__name__).info('Connection to database ' + self.name + ' can not be reused, close it', exc_info=True)
+                self._close(con)
+            self._condition.notify()
+
+    def _open(self):
+        # The place of the connection has already been reserved in the pool (self._size)
+        try:
+            con = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._reconnect_delay = min(self._reconnect_delay * 2 or 1, _max_reconnect_delay)
+                self._next_connect = time.time() + self._reconnect_delay
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._reconnect_delay = 0
+            self._next_connect = 0
+        getLogger(__name__).debug('Connection to database ' + self.name + ' opened (' + str(self._size) + ' connections opened)')
+        return con
+
+    def _close(self, con):
+        # Must be called with self._condition acquired
+        self._size -= 1
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    def closeIdleConnections(self):
+        '''
+        Close the connections unused for idle_timeout seconds (called periodically, so that the connections of the pools no longer
+        used are closed as well).
+        '''
+        with self._condition:
+            self._closeIdleConnections()
+
+    def _closeIdleConnections(self):
+        # Must be called with self._condition acquired. Close the connections unused for idle_timeout seconds (the oldest are at the beginning of the list), keeping min_size connections
+        now = time.time()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            getLogger(__name__).debug('Close idle connection to database ' + self.name)
+            self._close(self._idle.pop(0)[0])
+
+    def _isValid(self, con):
+        try:
+            cursor = con.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            cursor.close()
+            con.rollback()
+            return True
+        except Exception:
+            return False
+
+
+def _getConnectionPool(database_type, host, database, user, password, read_only, statement_timeout, min_size, max_size, idle_timeout):
+    # Return the connection pool of the database (created at first use). The session settings (read_only, statement_timeout) are
+    # set when the connections are opened, so Providers with different settings use different pools. The pools are keyed by a hash of
+    # the password, so that a Provider with another password (e.g. changed by a reload of the configuration) does not get connections
+    # opened with the previous one
+    global _sweep_thread
+    key = (database_type, host, database, user, hashlib.sha1(str(password)).hexdigest(), read_only, statement_timeout)
+    with _pools_lock:
+        if _sweep_thread is None:
+            _sweep_thread = threading.Thread(target = _sweepPools, name = 'DatabasePoolsSweep')
+            _sweep_thread.daemon = True
+            _sweep_thread.start()
+        if not _pools.has_key(key):
+            name = database_type + '://' + str(user) + '@' + str(host) + '/' + str(database)
+            getLogger(__name__).info('Create connection pool for database ' + name + ' (min size: ' + str(min_size) + ', max size: ' + str(max_size) + \
+                                     ', read only: ' + str(read_only) + ', statement timeout: ' + str(statement_timeout) + ')')
+            _pools[key] = _ConnectionPool(name, lambda: _connect_functions[database_type](host, database, user, password, read_only, statement_timeout),
+                                          min_size, max_size, idle_timeout)
+        return _pools[key]
+
+
+def _sweepPools():
+    # Close the idle connections of all the pools every _sweep_interval seconds: the connections of a pool are otherwise only closed
+    # when a connection is checked out from it
+    while True:
+        time.sleep(_sweep_interval)
+        with _pools_lock:
+            pools = _pools.values()
+        for pool in pools:
+            try:
+                pool.closeIdleConnections()
+            except Exception:
+                getLogger(__name__).error('Could not close the idle connections to database ' + pool.name, exc_info=True)
+
+
 class DatabaseRequest(Provider):
     
     # Overload _mandatory_parameters and _optional_parameters to list the parameters required by DatabaseRequest provider
@@ -31,6 +257,17 @@ class DatabaseRequest(Provider):
                         'request' # request used for your monitoring
                         ]
     
+    _optional_parameters = [
+                        'requested_data', # (string) Requested data (default is 'status'). See _data_available for available options.
+                        'column', # (string/integer) Name or index of the column returned for requested_data 'value' (default is the first column).
+                        'statement_timeout', # (number) Time in seconds after which the database server cancels the request (not set by default). For MySQL, it requires MySQL >= 5.7.8 and only applies to SELECT requests.
+                        'read_only', # (boolean) Run the request in a read only session, in autocommit mode, so that it never holds locks once executed (default is False).
+                        'pool_min_size', # (integer) Minimum number of connections kept open to the database once opened, even if they are idle (default is 1). The connections are shared by all the DatabaseRequest Providers using the same database and user (the first Provider using the database sets the pool options).
+                        'pool_max_size', # (integer) Maximum number of connections opened to the database (default is 5).
+                        'pool_idle_timeout', # (integer) Time in seconds after which unused connections are closed (default is 300).
+                        'status_requires_row' # (boolean) For requested_data 'status', return "OK" only if the request returned at least one row (default is False: for PostgreSQL, "OK" if the request returned a result, even without rows; for MySQL, "OK" if the request returned or changed at least one row).
+                        ]
+    
     def __init__(self, options):
         Provider.__init__(self, options)
         self.machine_addr = self._config.get('machine_addr')
@@ -39,47 +276,88 @@ class DatabaseRequest(Provider):
         self.database_name = self._config.get('database_name')
         self.database_type = self._config.get('database_type')
         self.query = self._config.get('request')
+        self.pool_min_size = self._config.get('pool_min_size') if self._config.get('pool_min_size') != None else _default_pool_min_size
+        self.pool_max_size = self._config.get('pool_max_size') or _default_pool_max_size
+        self.pool_idle_timeout = self._config.get('pool_idle_timeout') if self._config.get('pool_idle_timeout') != None else _default_pool_idle_timeout
+        self.statement_timeout = self._config.get('statement_timeout')
+        self.read_only = self._config.get('read_only') is True
+        self.column = self._config.get('column')
+        self.status_requires_row = self._config.get('status_requires_row') is True
+        # Load requested data (default is 'status')
+        self.requested_data = self._config.get('requested_data') or "status"
 
     def process(self):
-        if (self.database_type == "postgresql"):
-            getLogger(__name__).info(self.database_type + "is selected")
-            try:
-                con = psycopg2.connect(host=str(self.machine_addr), database=str(self.database_name), user=str(self.user), password=str(self.password))
-                cur = con.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                cur.execute(self.query)
-                result = cur.fetchone()
-                con.commit()
-                if result == "" and result == None:
-                    getLogger(__name__).info("The database request for " + self.database_name + " is failed.")
-                    return "NOK"
-                else:
-                    getLogger(__name__).info("The database request for " + self.database_name + " is success.")
-                    return "OK"
-            except:
-                getLogger(__name__).info("The database " + self.database_name + " is not accessible. Please check your credentials in the configuration file.")
-                return "NOK"
-        elif (self.database_type == "mysql"):
-            getLogger(__name__).info(self.database_type + "is selected")
-            try:
-                db = MySQLdb.connect(self.machine_addr, self.user, self.password, self.database_name)
-                cursor = db.cursor()
+        if not _connect_functions.has_key(self.database_type):
+            getLogger(__name__).error(self.database_type + " is not a type of database known by this tool.")
+            return
+        getLogger(__name__).info(self.database_type + "is selected")
+        pool = _getConnectionPool(self.database_type, self.machine_addr, self.database_name, self.user, self.password, self.read_only, self.statement_timeout,
+                                  self.pool_min_size, self.pool_max_size, self.pool_idle_timeout)
+        try:
+            with pool.connection() as con:
+                start = time.time()
+                cursor = con.cursor()
                 lineNumber = cursor.execute(self.query)
-                if (lineNumber != 0):
-                    getLogger(__name__).info("The database request for : " + self.database_name + " is success.")
-                    return "OK"
+                returned_result = cursor.description is not None
+                result = cursor.fetchone() if returned_result else None
+                elapsed = (time.time() - start) * 1000
+                if (self.requested_data == "value") and result is not None:
+                    result = result[self._getColumnIndex(cursor.description)]
+                cursor.close()
+                con.commit()
+                if self.status_requires_row:
+                    success = result is not None
+                elif (self.database_type == "postgresql"):
+                    success = returned_result
                 else:
-                    return "NOK"
-                    getLogger(__name__).info("The database request for : " + self.database_name + " is failed.")
-            except:
-                getLogger(__name__).info("The database " + self.database_name + " is not accessible. Please check your credentials in the configuration file.")
-                return "NOK"        
-        else: 
-            getLogger(__name__).error(self.database_type + " is not a type of database known by this tool.")
+                    success = lineNumber != 0
+        except:
+            getLogger(__name__).info("The database request for " + self.database_name + " failed or the database is not accessible. Please check your request and your credentials in the configuration file.", exc_info=True)
+            return "NOK" if self.requested_data == "status" else None
+        if (self.requested_data == "value"):
+            getLogger(__name__).info("The database request for " + self.database_name + " returned " + str(result))
+            return result
+        if (self.requested_data == "response_time"):
+            getLogger(__name__).info("The database request for " + self.database_name + " has been executed in " + '%.3f' % elapsed + " ms")
+            return elapsed
+        if success:
+            getLogger(__name__).info("The database request for " + self.database_name + " is success.")
+            return "OK"
+        else:
+            getLogger(__name__).info("The database request for " + self.database_name + " is failed.")
+            return "NOK"
+
+    
+    def _getColumnIndex(self, description):
+        # Return the index of the column returned for requested_data 'value'
+        if self.column is None:
+            return 0
+        if type(self.column) is int:
+            return self.column
+        names = [c[0] for c in description]
+        if self.column not in names:
+            raise Exception('Column "' + str(self.column) + '" is not returned by the request. Returned columns are: ' + str(names))
+        return names.index(self.column)
 
     
     # This function is called by __init__ of the abstract Provider class, it verify during the object initialization if the Provider' configuration is valid.
     def _isConfigValid(self):
         Provider._isConfigValid(self)
+        # If requested_data is provided, check if it is managed by DatabaseRequest provider
+        if self._config.get('requested_data') and not (self._config.get('requested_data') in _data_available):
+            getLogger(__name__).error('Parameter requested_data "' + self._config.get('requested_data') + '" provided to provider DatabaseRequest is not allowed. Allowed conditions are: ' + str(_data_available))
+            return False
+        if self._config.get('statement_timeout') != None and not (type(self._config.get('statement_timeout')) in (int, float) and self._config.get('statement_timeout') > 0):
+            getLogger(__name__).error('Parameter statement_timeout provided to provider DatabaseRequest must be a positive number of seconds')
+            return False
+        min_size = self._config.get('pool_min_size')
+        max_size = self._config.get('pool_max_size')
+        if min_size != None and not (type(min_size) is int and min_size >= 0):
+            getLogger(__name__).error('Parameter pool_min_size provided to provider DatabaseRequest must be a positive integer')
+            return False
+        if max_size != None and not (type(max_size) is int and max_size > 0 and max_size >= (min_size or 0)):
+            getLogger(__name__).error('Parameter pool_max_size provided to provider DatabaseRequest must be a positive integer, greater than pool_min_size')
+            return False
         return True
     
     
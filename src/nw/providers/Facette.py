@@ -14,9 +14,12 @@
 #    under the License.
 
 from nw.providers.Provider import Provider
+from nw.core.FacetteGraphIndex import getFacetteGraphIndex
+from nw.core.FacettePlotCache import getFacettePlotCache
 
-import sys, re
+import sys, re, json
 from logging import getLogger
+import requests
 from facette.client import Facette as FacetteClient
 
 
@@ -43,6 +46,22 @@ _plot_infos = [
 # If no plot_range is configured for Facette Provider, '-300s' is used by default.
 _plot_range_pattern = "^-[\d]+[smhdy]|mo$"
 
+# Default time (in seconds) during which a plot fetched from Facette server is shared with the other Facette Providers (see nw.core.FacettePlotCache)
+_default_plot_cache_ttl = 10
+
+# List of the ways the Facette Provider can get the plots of its metrics (set in Provider's config field 'query_mode').
+# If no query_mode is configured for Facette Provider, 'graph' is used by default.
+_query_modes = [
+                   'graph', # reads the plots of a graph of the Facette server containing the metrics (the graph is found in the graphs index of the server, see nw.core.FacetteGraphIndex)
+                   'series' # asks the plots of the metrics series to the Facette server plots API, without using a graph of the server (requires 'origin_name')
+                ]
+
+# Path of the Facette server plots API, used by the 'series' query_mode
+_plots_api_path = 'api/v1/library/graphs/plots'
+# Timeout (in seconds) of the requests to the Facette server plots API, and of the wait for a plot being fetched by another Provider (see
+# nw.core.FacettePlotCache)
+_plots_api_timeout = 30
+
 class Facette(Provider):
     
     # Overload _mandatory_parameters and _optional_parameters to list the parameters required by Facette provider
@@ -55,12 +74,16 @@ class Facette(Provider):
                         'requested_data', # (string) Requested data (default is 'raw_value' which returns the value obtained from Facette server). See _data_available for available options.
                         'facette_srv_user', # (string) User name for Facette server API authentication
                         'facette_srv_pwd', # (string) User password for Facette server API authentication
-                        'graph_name_filter', # (string) Facette graph name is optional but recommended. It allows to reduce the list of graphs to loop for searching the requested metric. The filter can be the exact name of the graph or 'regexp:graph name pattern*'
+                        'graph_name_filter', # (string) Facette graph name is optional. It allows to choose the graph used if the requested metric is in several graphs. The filter can be the exact name of the graph, 'glob:graph name pattern*' or 'regexp:graph name pattern.*'
+                        'facette_index_file', # (string) Path of the file where the index of the Facette server graphs is saved, so that it does not have to be built again from Facette server at next start (optional)
                         'metric_name', # (string) Name of the metric to get from the Facette graph (mandatory if requested_data is 'raw_value')
                         'metrics_names_list_numerator', # (array of strings) List of metrics names to get from the graph and to use in the numerator for computing the ratio (mandatory if requested_data is 'ratio')
                         'metrics_names_list_denominator', # (array of strings) List of metrics names to get from the graph and to use in the denominator for computing the ratio (mandatory if requested_data is 'ratio')
                         'plot_range', # (string) plot range is optional, -300s is used by default if plot_range is not provided
-                        'plot_info' # (string) plot info is optional, avg is used by default if plot_range is not provided
+                        'plot_info', # (string) plot info is optional, avg is used by default if plot_range is not provided
+                        'query_mode', # (string) Way to get the plots of the metrics (default is 'graph'). See _query_modes for available options.
+                        'origin_name', # (string) Name of the Facette origin (e.g. 'collectd') of the source and metrics (mandatory if query_mode is 'series')
+                        'plot_cache_ttl' # (integer) time in seconds during which a plot fetched from Facette server is shared by all the Facette Providers reading the same graph and plot range (default is 10, 0 to disable the cache)
                          ]
     
     def __init__(self, options):
@@ -76,6 +99,8 @@ class Facette(Provider):
         self.plot_range = self._config.get('plot_range') or '-300s'
         # If plot_info is not provided, use avg by default
         self.plot_info = self._config.get('plot_info') or 'avg'
+        # If plot_cache_ttl is not provided, use the default value
+        self.plot_cache_ttl = self._config.get('plot_cache_ttl') if self._config.get('plot_cache_ttl') != None else _default_plot_cache_ttl
         
         # Compute the list of metrics names requested according to requested_data
         if self.requested_data == "raw_value":
@@ -85,49 +110,53 @@ class Facette(Provider):
             # Remove duplicates metrics from metrics_names_list (some metrics can be both on numerator and denominator, removing the duplicates avoid to search twice the same metric's serie)
             self.metrics_names_list = list(set(self.metrics_names_list))
         
+        # If query_mode is not provided, use graph by default
+        self.query_mode = self._config.get('query_mode') or 'graph'
+        
+        if self.query_mode == 'series':
+            # The series of the metrics are sent to the plots API of the Facette server (see _getSeriesValues), no graph has to be found.
+            # Each metric is requested in its own serie, named from its position in metrics_names_list.
+            self.graph_id = None
+            self.series_names = dict((metric, 'serie' + str(i)) for i, metric in enumerate(self.metrics_names_list))
+            self._session = requests.Session()
+            if self._config.get('facette_srv_user'):
+                self._session.auth = (self._config.get('facette_srv_user'), self._config.get('facette_srv_pwd'))
+            return
+        
         # Instantiate the Facette client
         getLogger(__name__).debug('Instantiate Facette client with url ' + self._config.get('facette_srv_url'))
         self.fc = FacetteClient(self._config.get('facette_srv_url'), 
                                 user = self._config.get('facette_srv_user'), 
                                 passwd = self._config.get('facette_srv_pwd'))
         
+        # Index of the graphs of the Facette server, shared by all the Facette Providers using the same server
+        self.graph_index = getFacetteGraphIndex(self._config.get('facette_srv_url'), self.fc, self._config.get('facette_index_file'))
+        
         # Required data to get the plot allowing to retrieve the required data are the graph id and the series names. 
-        # Search them from the provided data (metrics_names_list and source_name) by looping on all graphs available on Facette server.
+        # Search them from the provided data (metrics_names_list and source_name) in the graphs index of the Facette server.
         self.graph_id, self.series_names = self._findGraph(self.fc, self._config.get('source_name'), self.metrics_names_list, self._config.get('graph_name_filter'))
 
 
     def process(self):
-        try:
-            plot = self.fc.library.graphs.plots.get(self.graph_id, self.plot_range)
-        except Exception:
-            getLogger(__name__).error('Error occurred while trying to get plots from graph with id ' + self.graph_id + '. Facette server may be down.', exc_info=True)
+        # Get the values of all the requested metrics (metric name -> value)
+        if self.query_mode == 'series':
+            values = self._getSeriesValues()
+            read_from = 'series query'
+        else:
+            values = self._getGraphValues()
+            read_from = 'graph with id ' + str(self.graph_id)
+        if values is None:
             return None
-        if not plot:
-            # Graph id may has changed (delete/recreate graph, facette server re-deployed,...) - try to find again the graph id and relaunch the process function (if a new graph is not found, an exception will be raised by _findGraph)
-            getLogger(__name__).error('The plots from graph with id ' + self.graph_id + ' is not found. The graph may has been deleted... Try to find the new graph id and call again process')
-            self.graph_id, self.series_names = self._findGraph(self.fc, self._config.get('source_name'), self.metrics_names_list, self._config.get('graph_name_filter'))
-            getLogger(__name__).info('Plot containing requested metrics "' + str(self.metrics_names_list) + '" for source "' + self._config.get('source_name') +'" has been found in graph with id ' + self.graph_id + '. Use this one from now on')
-            return self.process()
         
         if self.requested_data == 'raw_value':
             # Get the value from the requested metric and return it
-            value = self._getMetricValueFromPlot(plot, self.series_names[self._config.get('metric_name')], self.plot_info)
-            getLogger(__name__).debug('Value is ' + str(value) + ' for requested metric "' + self._config.get('metric_name') + '". Read from graph with id ' + self.graph_id + ', serie name "' + self.series_names[self._config.get('metric_name')] + '"')
+            value = values[self._config.get('metric_name')]
+            getLogger(__name__).debug('Value is ' + str(value) + ' for requested metric "' + self._config.get('metric_name') + '". Read from ' + read_from + ', serie name "' + self.series_names[self._config.get('metric_name')] + '"')
             return value
         
         elif self.requested_data == 'ratio':
-            numerator_values = []
-            denominator_values = []
-            for metric_numerator in self._config.get('metrics_names_list_numerator'):
-                # Get the value from the current metric
-                value = self._getMetricValueFromPlot(plot, self.series_names[metric_numerator], self.plot_info)
-                # Add the value to the numerator array
-                numerator_values.append(value)
-            for metric_denominator in self._config.get('metrics_names_list_denominator'):
-                # Get the value from the current metric
-                value = self._getMetricValueFromPlot(plot, self.series_names[metric_denominator], self.plot_info)
-                # Add the value to the numerator array
-                denominator_values.append(value)
+            numerator_values = [values[metric_numerator] for metric_numerator in self._config.get('metrics_names_list_numerator')]
+            denominator_values = [values[metric_denominator] for metric_denominator in self._config.get('metrics_names_list_denominator')]
             # Compute the ratio
             if None in numerator_values or None in denominator_values:
                 getLogger(__name__).error('Not able to compute ratio from following values: ' + str(numerator_values) + ' / ' + str(denominator_values))
@@ -136,42 +165,84 @@ class Facette(Provider):
             else:
                 getLogger(__name__).debug('Compute ratio from following values: ' + str(numerator_values) + ' / ' + str(denominator_values))
                 ratio = sum(numerator_values) / sum(denominator_values)
-                getLogger(__name__).debug('Ratio value is ' + str(ratio) + ' for requested metrics (' + str(self._config.get('metrics_names_list_numerator')) + ') / (' + str(self._config.get('metrics_names_list_denominator')) + '). Read from graph with id ' + self.graph_id)
+                getLogger(__name__).debug('Ratio value is ' + str(ratio) + ' for requested metrics (' + str(self._config.get('metrics_names_list_numerator')) + ') / (' + str(self._config.get('metrics_names_list_denominator')) + '). Read from ' + read_from)
                 return ratio
     
     
-    def _findGraph(self, fc, source_name, metrics_names_list, graph_name = None):
-        # Search the graph and the name of the series containing the requested metrics from the requested source name.
-        # Note: if a graph name is provided, we can filter on this name to reduce the number of graphs to look for the requested metrics
-        graph_list = fc.library.graphs.list(filter=graph_name)
-        if not graph_list:
-            if graph_name:
-                err_msg = 'The graph with name "' + graph_name + '" is not found on Facette server'
+    def _getGraphValues(self):
+        # Get the values of the requested metrics from the plot of the graph found during the initialization
+        plot = self._getPlot()
+        if plot is False:
+            return None
+        if not plot:
+            # Graph id may has changed (delete/recreate graph, facette server re-deployed,...) - refresh the graphs index and try once to find again the graph id
+            getLogger(__name__).error('The plots from graph with id ' + self.graph_id + ' is not found. The graph may has been deleted... Try to find the new graph id')
+            try:
+                # The index is refreshed at most once a minute (it may just have been refreshed by another Provider using the same graph)
+                refreshed = self.graph_index.refreshIfOutdated()
+                graph_id, series_names = self._findGraph(self.fc, self._config.get('source_name'), self.metrics_names_list, self._config.get('graph_name_filter'))
+            except Exception:
+                getLogger(__name__).error('No graph containing requested metrics "' + str(self.metrics_names_list) + '" for source "' + self._config.get('source_name') + '" found', exc_info=True)
+                return None
+            if graph_id == self.graph_id and not refreshed:
+                getLogger(__name__).error('The graphs index has been refreshed less than a minute ago and still contains graph with id ' + self.graph_id + ', give up until next run')
+                return None
+            self.graph_id, self.series_names = graph_id, series_names
+            getLogger(__name__).info('Plot containing requested metrics "' + str(self.metrics_names_list) + '" for source "' + self._config.get('source_name') +'" has been found in graph with id ' + self.graph_id + '. Use this one from now on')
+            plot = self._getPlot()
+            if not plot:
+                getLogger(__name__).error('The plots from graph with id ' + self.graph_id + ' is not found either, give up until next run')
+                return None
+        return dict((metric, self._getMetricValueFromPlot(plot, self.series_names[metric], self.plot_info)) for metric in self.metrics_names_list)
+    
+    
+    def _getPlot(self):
+        # Return the plot of the graph (None if it is not found, False if an error occurred)
+        try:
+            if self.plot_cache_ttl:
+                return getFacettePlotCache().get(self._config.get('facette_srv_url'), self.fc, self.graph_id, self.plot_range, self.plot_cache_ttl, _plots_api_timeout)
             else:
-                err_msg = 'No graphs found. Please check if Facette server is running and has graphs defined.'
-            raise Exception(err_msg)
-        # Look in the graph list which one has a serie containing the requested metric
-        getLogger(__name__).debug('Search graph containing the metrics "' + str(metrics_names_list) + '" for source "' + source_name + '" from "' + str(len(graph_list)) + ' graphs')
-        metrics_series_names = {}
-        for g in graph_list:
-            graph = fc.library.graphs.get(g.id)
-            # Find the serie containing the requested metric or serie name
-            for group in graph.groups:
-                for serie in group.series:
-                    if serie.source == source_name and serie.metric in metrics_names_list:
-                        getLogger(__name__).debug('Requested metric "' + serie.metric + '" for source "' + source_name + '" has been found in group named ' + group.name + '" from graph with id ' + g.id + ', related serie name is "' + serie.name + '"')
-                        metrics_series_names[serie.metric] = serie.name
-            # Once the loop on groups is finished, if metrics_series_names is defined it means that metrics have been found in this graph
-            if metrics_series_names:
-                if len(metrics_series_names.keys()) == len(metrics_names_list):
-                    # All the metrics have been found in this graph, return the graph id and the dictionary mapping the metrics names to the series names
-                    return g.id, metrics_series_names
-                else:
-                    # Some metrics have not been found in the graph 
-                    raise Exception('Only the following metrics where found in graph with id ' + str(g.id) + ': ' + str(metrics_series_names.keys()))
-                    
-        # If no graph found, raise an exception
-        raise Exception('No graph found for metrics "' + str(metrics_names_list) + '" and source "' + source_name + '"')
+                return self.fc.library.graphs.plots.get(self.graph_id, self.plot_range)
+        except Exception:
+            getLogger(__name__).error('Error occurred while trying to get plots from graph with id ' + self.graph_id + '. Facette server may be down.', exc_info=True)
+            return False
+    
+    
+    def _getSeriesValues(self):
+        # Get the values of the requested metrics with one request to the plots API of the Facette server: the request describes a graph
+        # containing a serie for each metric (numerator and denominator metrics in the case of a ratio), so no graph of the server is used.
+        groups = []
+        for metric in self.metrics_names_list:
+            serie = {'name': self.series_names[metric],
+                     'origin': self._config.get('origin_name'),
+                     'source': self._config.get('source_name'),
+                     'metric': metric}
+            groups.append({'name': self.series_names[metric], 'type': 1, 'series': [serie]})
+        body = {'range': self.plot_range, 'graph': {'name': 'night-watch', 'type': 1, 'stack_mode': 1, 'groups': groups}}
+        url = self._config.get('facette_srv_url').rstrip('/') + '/' + _plots_api_path
+        try:
+            response = self._session.post(url, data = json.dumps(body), headers = {'Content-Type': 'application/json'}, timeout = _plots_api_timeout)
+        except Exception:
+            getLogger(__name__).error('Error occurred while trying to get plots of series ' + str(self.metrics_names_list) + ' for source "' + self._config.get('source_name') + '". Facette server may be down.', exc_info=True)
+            return None
+        if response.status_code != 200:
+            getLogger(__name__).error('Facette server returned status ' + str(response.status_code) + ' for plots of series ' + str(self.metrics_names_list) + ' for source "' + self._config.get('source_name') + '": ' + response.text)
+            return None
+        series = dict((serie.get('name'), serie) for serie in response.json().get('series') or [])
+        values = {}
+        for metric in self.metrics_names_list:
+            serie = series.get(self.series_names[metric])
+            if serie is None:
+                raise Exception('The plot serie "' + self.series_names[metric] + '" containing the required metric "' + metric + '" is not found in Facette server response')
+            values[metric] = (serie.get('summary') or {}).get(self.plot_info)
+        return values
+    
+    
+    def _findGraph(self, fc, source_name, metrics_names_list, graph_name = None):
+        # Search the graph and the name of the series containing the requested metrics from the requested source name, using the graphs index of the Facette server.
+        # Note: if a graph name is provided, only the graphs matching this name are used
+        getLogger(__name__).debug('Search graph containing the metrics "' + str(metrics_names_list) + '" for source "' + source_name + '"')
+        return self.graph_index.find(source_name, metrics_names_list, graph_name)
     
     
     def _findPlotSerie(self, plot, serie_name):
@@ -210,6 +281,18 @@ class Facette(Provider):
         if self._config.get('plot_range') and not(re.match(_plot_range_pattern, self._config.get('plot_range'))):
             getLogger(__name__).error('Parameter plot_range "' + self._config.get('plot_range') + '" provided to provider Facette is not allowed. plot_range must match the regex ' + str(_plot_range_pattern))
             return False
+        # If query_mode is provided, check if it is managed by Facette provider
+        if self._config.get('query_mode') and not (self._config.get('query_mode') in _query_modes):
+            getLogger(__name__).error('Parameter query_mode "' + self._config.get('query_mode') + '" provided to provider Facette is not allowed. Allowed query_mode are: ' + str(_query_modes))
+            return False
+        # If query_mode is 'series', check that 'origin_name' mandatory parameter is well provided
+        if self._config.get('query_mode') == 'series' and not self._config.get('origin_name'):
+            getLogger(__name__).error('Parameter origin_name is not provided. Parameter origin_name is mandatory if query_mode parameter is "series".')
+            return False
+        # If plot_cache_ttl is provided, check that it is a positive integer
+        if self._config.get('plot_cache_ttl') != None and not (type(self._config.get('plot_cache_ttl')) is int and self._config.get('plot_cache_ttl') >= 0):
+            getLogger(__name__).error('Parameter plot_cache_ttl provided to provider Facette must be a positive integer (or 0 to disable the cache)')
+            return False
         # If plot_info is provided, check if it is managed by Facette provider
         if self._config.get('plot_info') and not (self._config.get('plot_info') in _plot_infos):
             getLogger(__name__).error('Parameter plot_info "' + self._config.get('plot_info') + '" provided to provider Facette is not allowed. Allowed plot_info are: ' + str(_plot_infos))
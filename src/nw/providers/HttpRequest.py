@@ -16,27 +16,56 @@
 from nw.providers.Provider import Provider
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.poolmanager import PoolManager, SSL_KEYWORDS
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urlparse import urlparse
+import threading
+import socket
+import ssl
+import time
+import re
+import hashlib
 from logging import getLogger
 
+try:
+    # Only required by the requested_data 'content_json'
+    import ijson
+except ImportError:
+    ijson = None
+
 # List of data the HttpRequest Provider can return (set in Provider's config field 'requested_data').
 # If the Provider is configured with another requested_data, an exception is raised.
 # If no requested_data is configured for HttpRequest Provider, status is used by default.
+# Note: if the server returns an error status (4xx or 5xx), the request is considered as failed and None is returned whatever the
+# requested_data (as well as if the request could not be performed).
 _data_available = [
                    'status', # returns the HTTP status code (integer)
-                   'content' # returns the response content (json object is returned if the request response is json, string is returned otherwise)
+                   'content', # returns the response content (json object is returned if the request response is json, string is returned otherwise)
+                   'response_time', # returns the total time of the request, until the whole response is received (in ms) (float)
+                   'response_time_ttfb', # returns the time until the response headers are received (time to first byte) (in ms) (float)
+                   'response_time_dns', # returns the time to resolve the host name (in ms) (float) (measured on a new connection, see HttpRequest._measureConnection)
+                   'response_time_connect', # returns the time to open the TCP connection (in ms) (float) (measured on a new connection, see HttpRequest._measureConnection)
+                   'response_time_tls', # returns the time of the TLS handshake (in ms) (float), 0 for http URLs (measured on a new connection, see HttpRequest._measureConnection)
+                   # The following data are computed while the response content is received: the content is read by chunks (it is not loaded in memory),
+                   # reading stops as soon as the data is known, and at most max_content_bytes bytes are read.
+                   'content_match', # returns True if the response content matches content_regex or contains content_substring, False otherwise (boolean)
+                   'content_json', # returns the first value found at json_path in the JSON response content (requires the ijson package), None if not found
+                   'content_size', # returns the size of the response content (in bytes) (integer), None if larger than max_content_bytes
+                   'content_hash' # returns the hash of the response content (string) computed with hash_algorithm, None if larger than max_content_bytes
                   ]
 
 # List of HTTP methods supported by HttpRequest Provider. 
 # If the Provider is configured with another method, an exception is raised.
 # If no method is configured for HttpRequest Provider, GET is used by default.
-_HTTP_methods = {
-                   'GET':       requests.get,
-                   'POST':      requests.post,
-                   'PUT':       requests.put,
-                   'DELETE':    requests.delete,
-                   'HEAD':      requests.head,
-                   'OPTIONS':   requests.options
-                  }
+_HTTP_methods = [
+                 'GET',
+                 'POST',
+                 'PUT',
+                 'DELETE',
+                 'HEAD',
+                 'OPTIONS'
+                ]
 
 # List of authentication methods supported by HttpRequest Provider. 
 # If the Provider is configured with another method, an exception is raised.
@@ -46,6 +75,156 @@ _authentication_methods = {
                    'digest':      requests.auth.HTTPDigestAuth
                   }
 
+# Default values of the connection pool options (see HttpRequest._optional_parameters)
+_default_pool_size = 10
+_default_pool_idle_timeout = 60
+# Default values of the timeouts options (see HttpRequest._optional_parameters)
+_default_connect_timeout = 10
+_default_read_timeout = 30
+# Default values of the content options (see HttpRequest._optional_parameters)
+_default_max_content_bytes = 10485760 # 10 MB
+_default_hash_algorithm = 'md5'
+_chunk_size = 8192 # Size of the chunks of response content read for the content_* requested_data
+_regex_overlap = 1024 # Number of bytes of the previous chunk kept to match content_regex across two chunks
+
+# Connection pools shared by all the HttpRequest Providers: (scheme, host, port) -> _ConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+# Whether the latest connection taken from a pool by the current thread was already open (reused) or new (see _IdleConnectionsPool)
+_connections = threading.local()
+
+
+class _ConnectionPool:
+    '''
+    Pool of keep-alive connections to one target host (scheme, host, port), shared by all the HttpRequest Providers requesting this host.
+    The pool is a requests HTTPAdapter, mounted in the Session of each Provider: the connections are shared, but each Provider keeps
+    its own cookies. The connections unused for idle_timeout seconds are closed (see _IdleConnectionsPool), and the pool is closed
+    once all the Providers using it have been released.
+    '''
+    def __init__(self, pool_size, idle_timeout):
+        self.adapter = _IdleHTTPAdapter(idle_timeout, pool_connections = 1, pool_maxsize = pool_size)
+        self.idle_timeout = idle_timeout
+        self.providers = 0 # Number of Providers using the pool
+
+
+class _IdleConnectionsPool(object):
+    '''
+    Mixin of the urllib3 connection pools closing a connection unused for idle_timeout seconds when it is taken from the pool (the
+    server has likely closed it meanwhile), so that the request is sent on a new connection instead. Each time a connection is put
+    back, the other connections of the pool unused for idle_timeout seconds are closed as well, so that the connections no longer
+    needed (e.g. opened during a burst of requests) do not stay open until they are taken again.
+    '''
+    idle_timeout = 0
+
+    def _get_conn(self, timeout = None):
+        conn = super(_IdleConnectionsPool, self)._get_conn(timeout)
+        last_used = getattr(conn, 'nw_last_used', None)
+        if self.idle_timeout and last_used is not None and conn.sock is not None and time.time() - last_used > self.idle_timeout:
+            getLogger(__name__).debug('Close connection to ' + self.host + ' unused for ' + '%.0f' % (time.time() - last_used) + ' seconds')
+            conn.close()
+        conn.nw_last_used = None
+        _connections.reused = conn.sock is not None
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.nw_last_used = time.time()
+        super(_IdleConnectionsPool, self)._put_conn(conn)
+        self._closeIdleConnections()
+
+    def _closeIdleConnections(self):
+        queue = self.pool
+        if not self.idle_timeout or queue is None:
+            return
+        now = time.time()
+        # The connections are closed while the queue is locked, so that they can not be taken meanwhile (a closed connection is
+        # reopened when it is taken again)
+        with queue.mutex:
+            for conn in queue.queue:
+                last_used = getattr(conn, 'nw_last_used', None)
+                if conn is not None and conn.sock is not None and last_used is not None and now - last_used > self.idle_timeout:
+                    getLogger(__name__).debug('Close connection to ' + self.host + ' unused for ' + '%.0f' % (now - last_used) + ' seconds')
+                    conn.close()
+
+
+class _IdleHTTPConnectionPool(_IdleConnectionsPool, HTTPConnectionPool):
+    pass
+
+
+class _IdleHTTPSConnectionPool(_IdleConnectionsPool, HTTPSConnectionPool):
+    pass
+
+
+class _IdlePoolManager(PoolManager):
+    '''
+    urllib3 PoolManager creating connection pools which close their idle connections (see _IdleConnectionsPool).
+    '''
+    _pool_classes = {'http': _IdleHTTPConnectionPool, 'https': _IdleHTTPSConnectionPool}
+
+    def __init__(self, idle_timeout, **kwargs):
+        PoolManager.__init__(self, **kwargs)
+        self.idle_timeout = idle_timeout
+
+    def _new_pool(self, scheme, host, port):
+        kwargs = self.connection_pool_kw
+        if scheme == 'http':
+            kwargs = dict((key, value) for key, value in kwargs.iteritems() if key not in SSL_KEYWORDS)
+        pool = self._pool_classes[scheme](host, port, **kwargs)
+        pool.idle_timeout = self.idle_timeout
+        return pool
+
+
+class _IdleHTTPAdapter(HTTPAdapter):
+    '''
+    requests HTTPAdapter whose connection pools close their idle connections (see _IdleConnectionsPool).
+    '''
+    def __init__(self, idle_timeout, **kwargs):
+        self.idle_timeout = idle_timeout
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block = False, **pool_kwargs):
+        HTTPAdapter.init_poolmanager(self, connections, maxsize, block, **pool_kwargs)
+        self.poolmanager = _IdlePoolManager(self.idle_timeout, num_pools = connections, maxsize = maxsize, block = block, **pool_kwargs)
+
+
+def _getPoolPrefix(url):
+    # Return the prefix of the URLs served by the connection pool of the target host of url
+    u = urlparse(url)
+    return u.scheme + '://' + u.netloc + '/'
+
+
+def _getPoolKey(url):
+    u = urlparse(url)
+    return (u.scheme, u.hostname, u.port)
+
+
+def _getConnectionPool(url, pool_size, idle_timeout):
+    # Return the connection pool of the target host of url (created at first request to the host). Each call must be matched by a
+    # call to _releaseConnectionPool once the Provider no longer uses the pool
+    key = _getPoolKey(url)
+    with _pools_lock:
+        if not _pools.has_key(key):
+            getLogger(__name__).info('Create connection pool of ' + str(pool_size) + ' connections for ' + key[0] + '://' + urlparse(url).netloc)
+            _pools[key] = _ConnectionPool(pool_size, idle_timeout)
+        _pools[key].providers += 1
+        return _pools[key]
+
+
+def _releaseConnectionPool(url):
+    # Release the connection pool of the target host of url, and close it (with its connections) if no other Provider uses it
+    key = _getPoolKey(url)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            return
+        pool.providers -= 1
+        if pool.providers > 0:
+            return
+        del _pools[key]
+    getLogger(__name__).info('Close connection pool of ' + key[0] + '://' + urlparse(url).netloc + ' (no longer used)')
+    pool.adapter.close()
+
+
 class HttpRequest(Provider):
     
     # Overload _mandatory_parameters and _optional_parameters to list the parameters required by HttpRequest provider
@@ -62,7 +241,17 @@ class HttpRequest(Provider):
                         'authentication_method', # (string) Authentication method to use for the HTTP request (optional). Supported authentication methods are "basic" and "digest". If user and password are provided and authentication_method is not provided, "basic" authentication method is used by default.
                         'user', # (string) User name to use for authentication of the HTTP request.
                         'password', # (string) User password to use for authentication of the HTTP request.
-                        'allow_redirects' # (boolean) Disable redirection handling.
+                        'allow_redirects', # (boolean) Disable redirection handling.
+                        'keep_alive', # (boolean) Keep the connections open between the requests (default is True). If False, a new connection is opened for each request.
+                        'pool_size', # (integer) Maximum number of connections kept open to the target host (default is 10). The connections are shared by all the HttpRequest Providers requesting the same host (the first Provider requesting the host sets the pool size).
+                        'pool_idle_timeout', # (integer) Time in seconds after which unused connections are closed (default is 60, 0 to never close them).
+                        'connect_timeout', # (number) Time in seconds to wait for the connection to the server (default is 10).
+                        'read_timeout', # (number) Time in seconds to wait for data from the server once connected (default is 30).
+                        'content_regex', # (string) Regular expression searched in the response content (requested_data 'content_match'). Matches longer than 1024 bytes may be missed.
+                        'content_substring', # (string) String searched in the response content (requested_data 'content_match').
+                        'json_path', # (string) Path of the value to extract from the JSON response content (requested_data 'content_json'), using ijson prefixes syntax (e.g. "status" or "checks.item.state").
+                        'hash_algorithm', # (string) Hash algorithm (any hashlib algorithm) used for requested_data 'content_hash' (default is 'md5').
+                        'max_content_bytes' # (integer) Maximum number of bytes of the response content read for the content_* requested_data (default is 10485760).
                          ]
     
     def __init__(self, options):
@@ -104,19 +293,68 @@ class HttpRequest(Provider):
         else:
             self.allow_redirects = True
         
-        # TODO: add more actions (regexp on response body, headers,...)
+        if self._config.get('keep_alive') != None and type(self._config.get('keep_alive')) is bool:
+            self.keep_alive = self._config.get('keep_alive')
+        else:
+            self.keep_alive = True
+        self.pool_size = self._config.get('pool_size') or _default_pool_size
+        if self._config.get('pool_idle_timeout') != None:
+            self.pool_idle_timeout = self._config.get('pool_idle_timeout')
+        else:
+            self.pool_idle_timeout = _default_pool_idle_timeout
+        
+        self.connect_timeout = self._config.get('connect_timeout') or _default_connect_timeout
+        self.read_timeout = self._config.get('read_timeout') or _default_read_timeout
+        
+        # Session of the Provider: stores the cookies of the Provider, uses the connection pool shared with the other Providers if keep_alive is enabled
+        self._session = requests.Session()
+        if self.keep_alive:
+            self._pool = _getConnectionPool(self.url, self.pool_size, self.pool_idle_timeout)
+            self._session.mount(_getPoolPrefix(self.url), self._pool.adapter)
+        else:
+            self._pool = None
+            self._session.headers['Connection'] = 'close'
+        
+        self.content_regex = None
+        if self._config.get('content_regex'):
+            self.content_regex = re.compile(self._config.get('content_regex'))
+        self.content_substring = self._config.get('content_substring')
+        self.json_path = self._config.get('json_path')
+        self.hash_algorithm = self._config.get('hash_algorithm') or _default_hash_algorithm
+        self.max_content_bytes = self._config.get('max_content_bytes') or _default_max_content_bytes
+        
+        # TODO: add more actions (headers,...)
         # Load requested data (default is 'status')
         self.requested_data = self._config.get('requested_data') or "status"
 
 
     def process(self):
+        # The connection phases are measured on a new connection, before the request
+        if self.requested_data in ("response_time_dns", "response_time_connect", "response_time_tls"):
+            try:
+                return self._measureConnection()[self.requested_data]
+            except Exception:
+                getLogger(__name__).error('Could not measure the connection time to ' + self.url, exc_info=True)
+                return None
         # Perform the request
-        response = self._performRequest()
+        start = time.time()
+        stream = self.requested_data.startswith("content_")
+        response = self._performRequest(stream)
         if not response:
-            # response is not defined because an error occurred in _performRequest, return None
+            # response is not defined because an error occurred in _performRequest, or the server returned an error status (4xx
+            # or 5xx, the response is then False), return None
+            if response is not None:
+                response.close()
             return None
+        elif stream:
+            return self._processContent(response)
         else:
             # TODO: add more actions
+            if (self.requested_data == "response_time"):
+                # The request is performed with stream=False, the whole response content has been received
+                return (time.time() - start) * 1000
+            if (self.requested_data == "response_time_ttfb"):
+                return response.elapsed.total_seconds() * 1000
             if (self.requested_data == "status"):
                 return response.status_code
             if (self.requested_data == "content"):
@@ -126,7 +364,68 @@ class HttpRequest(Provider):
                     return response.content
   
   
-    def _performRequest(self):
+    # Release the connection pool used by the Provider (it is closed if no other Provider uses it)
+    def release(self):
+        if self._pool is not None:
+            _releaseConnectionPool(self.url)
+            self._pool = None
+  
+  
+    def _processContent(self, response):
+        # Compute the requested data while reading the response content
+        reader = _ContentReader(response, self.max_content_bytes)
+        try:
+            if (self.requested_data == "content_match"):
+                value = self._matchContent(reader)
+            elif (self.requested_data == "content_json"):
+                value = self._extractJson(reader)
+            else:
+                h = hashlib.new(self.hash_algorithm)
+                chunk = reader.read(_chunk_size)
+                while chunk:
+                    h.update(chunk)
+                    chunk = reader.read(_chunk_size)
+                if reader.truncated:
+                    value = None
+                elif (self.requested_data == "content_size"):
+                    value = reader.bytes_read
+                else:
+                    value = h.hexdigest()
+        finally:
+            reader.close()
+        if reader.truncated:
+            getLogger(__name__).warning('Response content of ' + self.url + ' is larger than ' + str(self.max_content_bytes) + ' bytes, stopped reading it')
+        getLogger(__name__).debug('Read ' + str(reader.bytes_read) + ' bytes of response content of ' + self.url + ' to compute ' + self.requested_data + ': ' + str(value))
+        return value
+    
+    
+    def _matchContent(self, reader):
+        # Keep the end of the previous chunk, so that a match across two chunks is found
+        overlap = len(self.content_substring) - 1 if self.content_substring else _regex_overlap
+        tail = ''
+        chunk = reader.read(_chunk_size)
+        while chunk:
+            data = tail + chunk
+            if self.content_substring and self.content_substring in data:
+                return True
+            if self.content_regex and self.content_regex.search(data):
+                return True
+            tail = data[-overlap:] if overlap > 0 else ''
+            chunk = reader.read(_chunk_size)
+        return False
+    
+    
+    def _extractJson(self, reader):
+        try:
+            return ijson.items(reader, self.json_path).next()
+        except StopIteration:
+            return None
+        except ijson.JSONError:
+            getLogger(__name__).warning('Response content of ' + self.url + ' is not a valid JSON document (or is larger than ' + str(self.max_content_bytes) + ' bytes)', exc_info=True)
+            return None
+    
+    
+    def _performRequest(self, stream = False):
         try:
             getLogger(__name__).debug('Perform http request ' + self.method + ' ' + self.url + ', allow redirects: ' + str(self.allow_redirects) + \
                                       ', body: ' + str(self.body) + ', headers: ' + str(self.headers) + ', cookies: ' + str(self.cookies) + \
@@ -136,12 +435,62 @@ class HttpRequest(Provider):
             if self.authentication_method:
                 auth = _authentication_methods[self.authentication_method](self.user, self.password)
             # Perform the HTTP request using the requested parameters
-            return _HTTP_methods[self.method](self.url, data=self.body, headers=self.headers, cookies=self.cookies, auth=auth, allow_redirects=self.allow_redirects)
-        # TODO: better management of requests exceptions (timeout, toomanyredirects, dns issue,...)
+            _connections.reused = False
+            try:
+                return self._request(auth, stream)
+            except requests.exceptions.ConnectionError, e:
+                # Retry once only if the request was sent on a pooled connection, which may have been closed by the server while it was
+                # idle (the failed connection has been dropped from the pool). The timeouts and the errors on a new connection (host down,
+                # connection refused) are not retried, so that they do not cost twice their time.
+                if isinstance(e, requests.exceptions.Timeout) or not self._pool or self.method == 'POST' or not _connections.reused:
+                    raise
+                getLogger(__name__).info('Connection error on a pooled connection to ' + self.url + ', retry on a new connection', exc_info=True)
+                return self._request(auth, stream)
+        except requests.exceptions.Timeout:
+            getLogger(__name__).error('The request ' + self.method + ' ' + self.url + ' timed out (connect timeout: ' + str(self.connect_timeout) + 's, read timeout: ' + str(self.read_timeout) + 's).')
+        # TODO: better management of requests exceptions (toomanyredirects, dns issue,...)
         except Exception:
             getLogger(__name__).error('The url specified in your config file is not known by the DNS. Please check your url.', exc_info=True)
     
     
+    def _request(self, auth, stream = False):
+        return self._session.request(self.method, self.url, data=self.body, headers=self.headers, cookies=self.cookies, auth=auth, allow_redirects=self.allow_redirects,
+                                     timeout=(self.connect_timeout, self.read_timeout), stream=stream)
+    
+    
+    def _measureConnection(self):
+        '''
+        Open a new connection to the target host and return the time (in ms) of each phase: host name resolution, TCP connection and
+        TLS handshake (https URLs only). These phases can not be measured on the requests of the Provider, as they reuse the
+        connections of the pool (see keep_alive option).
+        '''
+        u = urlparse(self.url)
+        port = u.port or (443 if u.scheme == 'https' else 80)
+        timings = {'response_time_tls': 0.0}
+        start = time.time()
+        family, socktype, proto, canonname, sockaddr = socket.getaddrinfo(u.hostname, port, 0, socket.SOCK_STREAM)[0]
+        resolved = time.time()
+        timings['response_time_dns'] = (resolved - start) * 1000
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(self.connect_timeout)
+            sock.connect(sockaddr)
+            connected = time.time()
+            timings['response_time_connect'] = (connected - resolved) * 1000
+            if u.scheme == 'https':
+                # Only the handshake is measured, the certificate is not verified
+                sock.settimeout(self.read_timeout)
+                if hasattr(ssl, 'SSLContext'):
+                    sock = ssl.SSLContext(ssl.PROTOCOL_SSLv23).wrap_socket(sock, server_hostname = u.hostname)
+                else:
+                    sock = ssl.wrap_socket(sock)
+                timings['response_time_tls'] = (time.time() - connected) * 1000
+        finally:
+            sock.close()
+        getLogger(__name__).debug('Connection time to ' + self.url + ': ' + str(timings))
+        return timings
+    
+    
     # This function is called by __init__ of the abstract Provider class, it verify during the object initialization if the Provider' configuration is valid.
     def _isConfigValid(self):
         Provider._isConfigValid(self)
@@ -150,11 +499,78 @@ class HttpRequest(Provider):
             getLogger(__name__).error('Parameter requested_data "' + self._config.get('requested_data') + '" provided to provider HttpRequest is not allowed. Allowed conditions are: ' + str(_data_available))
             return False
         # If method is provided, check if it is managed by HttpRequest provider
-        if self._config.get('method') and not _HTTP_methods.has_key(self._config.get('method')):
-            getLogger(__name__).error('Parameter method "' + self._config.get('method') + '" provided to provider HttpRequest is not allowed. Allowed conditions are: ' + str(_HTTP_methods.keys()))
+        if self._config.get('method') and not self._config.get('method') in _HTTP_methods:
+            getLogger(__name__).error('Parameter method "' + self._config.get('method') + '" provided to provider HttpRequest is not allowed. Allowed conditions are: ' + str(_HTTP_methods))
             return False
         # If authentication_method is provided, check if it is managed by HttpRequest provider
         if self._config.get('authentication_method') and not _authentication_methods.has_key(self._config.get('authentication_method')):
             getLogger(__name__).error('Parameter authentication_method "' + self._config.get('authentication_method') + '" provided to provider HttpRequest is not allowed. Allowed conditions are: ' + str(_authentication_methods.keys()))
             return False
+        # If pool_size is provided, check that it is a positive integer
+        if self._config.get('pool_size') != None and not (type(self._config.get('pool_size')) is int and self._config.get('pool_size') > 0):
+            getLogger(__name__).error('Parameter pool_size provided to provider HttpRequest must be a positive integer')
+            return False
+        # Check that the options required by the content_* requested_data are provided
+        requested_data = self._config.get('requested_data')
+        if requested_data == 'content_match' and not (self._config.get('content_regex') or self._config.get('content_substring')):
+            getLogger(__name__).error('Parameter content_regex or content_substring must be provided to provider HttpRequest for requested_data "content_match"')
+            return False
+        if requested_data == 'content_json' and not self._config.get('json_path'):
+            getLogger(__name__).error('Parameter json_path must be provided to provider HttpRequest for requested_data "content_json"')
+            return False
+        if requested_data == 'content_json' and ijson is None:
+            getLogger(__name__).error('The ijson package is required by provider HttpRequest for requested_data "content_json", but it is not installed')
+            return False
+        if self._config.get('hash_algorithm'):
+            try:
+                hashlib.new(self._config.get('hash_algorithm'))
+            except ValueError:
+                getLogger(__name__).error('Parameter hash_algorithm "' + self._config.get('hash_algorithm') + '" provided to provider HttpRequest is not supported')
+                return False
+        # If timeouts are provided, check that they are positive numbers
+        for param in ('connect_timeout', 'read_timeout'):
+            if self._config.get(param) != None and not (type(self._config.get(param)) in (int, float) and self._config.get(param) > 0):
+                getLogger(__name__).error('Parameter ' + param + ' provided to provider HttpRequest must be a positive number of seconds')
+                return False
         return True
+
+
+
+class _ContentReader:
+    '''
+    File-like object reading the content of a streamed response by chunks, and stopping after max_bytes bytes.
+    close must be called once the content is read, to release the connection of the response.
+    '''
+    def __init__(self, response, max_bytes):
+        self._response = response
+        self._chunks = response.iter_content(_chunk_size)
+        self._buffer = ''
+        self._max_bytes = max_bytes
+        self.bytes_read = 0
+        self.truncated = False # True if the content is larger than max_bytes
+        self._exhausted = False # True if the whole content has been read
+
+    def read(self, size = -1):
+        remaining = self._max_bytes - self.bytes_read
+        size = remaining if size < 0 else min(size, remaining)
+        # When reading up to max_bytes, one more byte is read to tell a content of exactly max_bytes from a larger one
+        wanted = size + 1 if size == remaining else size
+        while len(self._buffer) < wanted and not self._exhausted:
+            try:
+                self._buffer += self._chunks.next()
+            except StopIteration:
+                self._exhausted = True
+        data = self._buffer[:size]
+        self._buffer = self._buffer[len(data):]
+        self.bytes_read += len(data)
+        if self.bytes_read >= self._max_bytes and self._buffer:
+            self.truncated = True
+        return data
+
+    def close(self):
+        if not self._exhausted:
+            # The content has not been read entirely: the connection can not be reused for another request, close it
+            connection = getattr(self._response.raw, '_connection', None)
+            if connection is not None:
+                connection.close()
+        self._response.close()
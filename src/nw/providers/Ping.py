@@ -14,12 +14,25 @@
 #    under the License.
 
 from nw.providers.Provider import Provider
+from nw.core.Icmp import getIcmpEngine, _interval as _icmp_interval, _default_timeout as _icmp_default_timeout
+from nw.core.PingSweep import getPingSweep
+from nw.core.Utils import period2seconds
 
 import subprocess
+import socket
 import re
+import math
 from logging import getLogger
 
-# /!\ Warning: this Provider uses the ping system command and has been designed for Linux (Debian Wheezy).
+try:
+    # Only required by processAsync, which is called by the asyncio engine of the scheduler (see nw.core.AsyncioEngine)
+    import trollius as asyncio
+    from trollius import From, Return
+    _coroutine = asyncio.coroutine
+except ImportError:
+    _coroutine = lambda f: f
+
+# /!\ Warning: this Provider uses the ping system command (if the ICMP engine is not used) and has been designed for Linux (Debian Wheezy).
 
 # List of data the Ping Provider can return (set in Provider's config field 'requested_data').
 # If the Provider is configured with another requested_data, an exception is raised.
@@ -35,6 +48,15 @@ _data_available = [
                    'ping_max' # returns the max ping time (in ms) (float) (extracted from stdout of ping command using a regex)
                   ]
 
+# List of engines the Ping Provider can use to ping (set in Provider's config field 'engine').
+# If the Provider is configured with another engine, an exception is raised.
+# If no engine is configured for Ping Provider, command is used by default (the ICMP engine is opt-in).
+_engines = [
+            'auto', # use the ICMP engine if the process is allowed to open an ICMP socket, the ping command otherwise
+            'icmp', # send the echo requests from the Night Watch process, on an ICMP socket shared by all the Ping Providers (see nw.core.Icmp)
+            'command' # fork the ping system command
+           ]
+
 class Ping(Provider):
     
     # Overload _mandatory_parameters and _optional_parameters to list the parameters required by HttpRequest provider
@@ -45,7 +67,9 @@ class Ping(Provider):
     _optional_parameters = [
                         'requested_data', # (string) Requested data (default is 'status' which returns the status code of ping command execution). See _data_available for available options.
                         'count', # (integer) -c option of ping: Stop after sending (and receiving) count ECHO_RESPONSE packets. If not defined, default value is 1.
-                        'timeout' # (integer) -W option of ping: Time to wait for a response, in seconds. The option affects only timeout in absense of any responses, otherwise ping waits for two RTTs.
+                        'timeout', # (integer) -W option of ping: Time to wait for a response, in seconds. The option affects only timeout in absense of any responses, otherwise ping waits for two RTTs.
+                        'engine', # (string) Engine used to ping (default is 'command'). See _engines for available options.
+                        'sweep_interval' # (period, e.g. "30s") If defined, ping_addr is pinged by the ping sweep service (shared by all the Ping Providers) every sweep_interval instead of at each run, and each run returns the latest results. Requires the ICMP engine.
                         ]
     
     def __init__(self, options):
@@ -70,9 +94,23 @@ class Ping(Provider):
         
         # Load requested data (default is 'status')
         self.requested_data = self._config.get('requested_data') or "status"
+        
+        # Load engine (default is 'command', the ICMP engine has to be selected explicitly). IPv6 addresses are not supported by the ICMP engine, always use the ping command for them
+        self.engine = self._config.get('engine') or "command"
+        if ':' in self._config.get('ping_addr'):
+            self.engine = "command"
+        
+        # Load sweep interval (in seconds) if the ping sweep service has to be used. The target is registered to the service at first run
+        self.sweep_interval = None
+        if self._config.get('sweep_interval') is not None:
+            self.sweep_interval = period2seconds(self._config.get('sweep_interval'))
+        self._sweep_key = None
 
 
     def process(self):
+        engine = self._getIcmpEngine()
+        if engine is not None:
+            return self._processIcmp(engine)
         if (self.requested_data == "status"):
             return self._getPingStatus()
         else:
@@ -81,23 +119,132 @@ class Ping(Provider):
                 ping_data = self._performPing()
             except:
                 return None # Ping error
-            # Return the requested data
-            if (self.requested_data == "ping_response"):
-                return ping_data.ping_response
-            if (self.requested_data == "pkt_transmitted"):
-                return ping_data.pkt_transmitted
-            if (self.requested_data == "pkt_received"):
-                return ping_data.pkt_received
-            elif (self.requested_data == "pkt_loss"):
-                return ping_data.pkt_loss
-            if (self.requested_data == "ping_avg"):
-                return ping_data.ping_avg
-            if (self.requested_data == "ping_min"):
-                return ping_data.ping_min
-            if (self.requested_data == "ping_max"):
-                return ping_data.ping_max
+            return self._getRequestedData(ping_data)
+
 
+    # Coroutine version of process, run on the event loop by the asyncio engine of the scheduler: the echo requests of the ICMP engine
+    # and the ping command are waited for without holding a thread
+    @_coroutine
+    def processAsync(self):
+        loop = asyncio.get_event_loop()
+        engine = self._getIcmpEngine()
+        if engine is None:
+            value = yield From(self._processCommandAsync(loop))
+        elif self.sweep_interval is not None and getPingSweep() is not None:
+            # The ping sweep service returns its latest results at once (it only waits at first run), no need to wait on the event loop
+            value = yield From(loop.run_in_executor(None, self._processIcmp, engine))
+        else:
+            value = yield From(self._processIcmpAsync(engine, loop))
+        raise Return(value)
+
+
+    # Return the requested data from the ping statistics
+    def _getRequestedData(self, ping_data):
+        if (self.requested_data == "ping_response"):
+            return ping_data.ping_response
+        if (self.requested_data == "pkt_transmitted"):
+            return ping_data.pkt_transmitted
+        if (self.requested_data == "pkt_received"):
+            return ping_data.pkt_received
+        elif (self.requested_data == "pkt_loss"):
+            return ping_data.pkt_loss
+        if (self.requested_data == "ping_avg"):
+            return ping_data.ping_avg
+        if (self.requested_data == "ping_min"):
+            return ping_data.ping_min
+        if (self.requested_data == "ping_max"):
+            return ping_data.ping_max
 
+
+    # Return the ICMP engine to use, or None if the ping command has to be used
+    def _getIcmpEngine(self):
+        if self.engine == "command":
+            return None
+        engine = getIcmpEngine()
+        if engine is None and self.engine == "icmp":
+            raise Exception('Provider Ping is configured to use the ICMP engine, but the process is not allowed to open an ICMP socket')
+        return engine
+    
+    
+    # Ping using the ICMP engine (directly or through the ping sweep service), returns the same data as the ping command would
+    def _processIcmp(self, engine):
+        addr = self._config.get('ping_addr')
+        try:
+            if self.sweep_interval is not None and getPingSweep() is not None:
+                rtts = self._getSweepResult(getPingSweep())
+            else:
+                getLogger(__name__).debug('Ping ' + addr + ' using the ICMP engine (count: ' + str(self.count) + ', timeout: ' + str(self._config.get('timeout')) + ')')
+                rtts = engine.ping(addr, int(self.count), self._config.get('timeout'))
+        except:
+            getLogger(__name__).debug('Ping error', exc_info=True)
+            return self._getIcmpError()
+        return self._getIcmpResult(rtts)
+    
+    
+    # Coroutine version of _processIcmp (without the ping sweep service): the echo requests are sent from the event loop, and the
+    # replies are waited for on the event loop
+    @_coroutine
+    def _processIcmpAsync(self, engine, loop):
+        addr = self._config.get('ping_addr')
+        timeout = self._config.get('timeout')
+        done = asyncio.Future(loop = loop)
+        # Called by the receiving thread of the ICMP engine when all the replies have been received
+        pending = engine.newPing(int(self.count), lambda: loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None)))
+        getLogger(__name__).debug('Ping ' + addr + ' using the ICMP engine on the event loop (count: ' + str(self.count) + ', timeout: ' + str(timeout) + ')')
+        try:
+            addr_infos = yield From(loop.getaddrinfo(addr, None, family = socket.AF_INET))
+            for r in range(int(self.count)):
+                if r > 0:
+                    yield From(asyncio.sleep(_icmp_interval, loop = loop))
+                engine.sendEchoRequest(addr_infos[0][4][0], pending)
+            yield From(asyncio.wait([done], timeout = timeout if timeout is not None else _icmp_default_timeout, loop = loop))
+        except Exception:
+            getLogger(__name__).debug('Ping error', exc_info=True)
+            raise Return(self._getIcmpError())
+        finally:
+            engine.releasePing(pending)
+        raise Return(self._getIcmpResult(list(pending.rtts)))
+    
+    
+    # Return the requested data from the round trip times returned by the ICMP engine
+    def _getIcmpResult(self, rtts):
+        ping_data = IcmpPingData(self._config.get('ping_addr'), int(self.count), rtts)
+        getLogger(__name__).debug('ICMP engine returned: ' + ping_data.ping_response)
+        if (self.requested_data == "status"):
+            # Same status code as the ping command: 0 if at least one reply has been received, 1 otherwise
+            return 0 if ping_data.pkt_received else 1
+        return getattr(ping_data, self.requested_data)
+    
+    
+    # Return the requested data if the ICMP engine could not ping (e.g. unknown host)
+    def _getIcmpError(self):
+        # Same status code as the ping command for other errors than no reply
+        if (self.requested_data == "status"):
+            return 2
+        return None
+    
+    
+    # Return the latest round trip times of ping_addr from the ping sweep service (raise an Exception if the latest sweep failed)
+    def _getSweepResult(self, sweep):
+        if self._sweep_key is None:
+            self._sweep_key = sweep.register(self._config.get('ping_addr'), int(self.count), self._config.get('timeout'), self.sweep_interval)
+        # At first run, wait for the first sweep of the target (the time required to ping it)
+        result = sweep.getResult(self._sweep_key, self.sweep_interval + int(self.count) + (self._config.get('timeout') or 10))
+        if result is None:
+            raise Exception('Ping sweep did not return results for ' + self._config.get('ping_addr') + ' on time')
+        if isinstance(result, Exception):
+            raise result
+        getLogger(__name__).debug('Ping sweep returned latest results for ' + self._config.get('ping_addr'))
+        return result
+    
+    
+    # Unregister the target from the ping sweep service (if registered), so that it is no longer pinged once the task is removed or changed
+    def release(self):
+        if self._sweep_key is not None and getPingSweep() is not None:
+            getPingSweep().unregister(self._sweep_key, self.sweep_interval)
+            self._sweep_key = None
+    
+    
     # Simply execute ping command to retrieve the command's returned code
     def _getPingStatus(self):
         getLogger(__name__).debug('Call ping command with the following options: ' + self.ping_cmd)
@@ -124,6 +271,29 @@ class Ping(Provider):
             raise Exception(error)
     
     
+    # Coroutine version of _getPingStatus and _performPing: the ping command is waited for on the event loop
+    @_coroutine
+    def _processCommandAsync(self, loop):
+        getLogger(__name__).debug('Call ping command on the event loop with the following options: ' + self.ping_cmd)
+        process = yield From(asyncio.create_subprocess_shell(self.ping_cmd,
+                                                             stdout=subprocess.PIPE,
+                                                             stderr=subprocess.PIPE,
+                                                             loop=loop))
+        (output, error) = yield From(process.communicate())
+        if (self.requested_data == "status"):
+            getLogger(__name__).debug('Ping command returned status code: ' + str(process.returncode))
+            raise Return(process.returncode)
+        if not output:
+            getLogger(__name__).debug('Ping error: ' + error)
+            raise Return(None) # Ping error
+        getLogger(__name__).debug('Ping command returned: ' + output)
+        try:
+            ping_data = PingData(output)
+        except:
+            raise Return(None) # Ping error
+        raise Return(self._getRequestedData(ping_data))
+    
+    
     # This function is called by __init__ of the abstract Provider class, it verify during the object initialization if the Provider' configuration is valid.
     def _isConfigValid(self):
         Provider._isConfigValid(self)
@@ -131,6 +301,17 @@ class Ping(Provider):
         if self._config.get('requested_data') and not (self._config.get('requested_data') in _data_available):
             getLogger(__name__).error('Parameter requested_data "' + self._config.get('requested_data') + '" provided to provider Ping is not allowed. Allowed conditions are: ' + str(_data_available))
             return False
+        # If engine is provided, check if it is managed by Ping provider
+        if self._config.get('engine') and not (self._config.get('engine') in _engines):
+            getLogger(__name__).error('Parameter engine "' + self._config.get('engine') + '" provided to provider Ping is not allowed. Allowed engines are: ' + str(_engines))
+            return False
+        # If sweep_interval is provided, check that it is a valid period
+        if self._config.get('sweep_interval') is not None:
+            try:
+                period2seconds(self._config.get('sweep_interval'))
+            except Exception, e:
+                getLogger(__name__).error('Parameter sweep_interval provided to provider Ping is not valid: ' + str(e))
+                return False
         return True
     
     
@@ -163,3 +344,27 @@ class PingData:
         self.ping_avg = float(result.group('ping_avg'))
         self.ping_max = float(result.group('ping_max'))
         self.ping_stddev = float(result.group('ping_stddev'))
+
+
+
+class IcmpPingData(PingData):
+    """
+    PingData computed from the round trip times returned by the ICMP engine (instead of being extracted from the ping command response).
+    ping_response is built with the same statistics lines as the ping command. If no reply has been received, the response time
+    data are None.
+    """
+    def __init__(self, ping_addr, pkt_transmitted, rtts):
+        self.pkt_transmitted = pkt_transmitted
+        self.pkt_received = len(rtts)
+        self.pkt_loss = 100.0 * (pkt_transmitted - self.pkt_received) / pkt_transmitted if pkt_transmitted else 0.0
+        self.ping_response = '--- ' + ping_addr + ' ping statistics ---\n' + \
+            '%d packets transmitted, %d received, %g%% packet loss\n' % (self.pkt_transmitted, self.pkt_received, self.pkt_loss)
+        if rtts:
+            self.ping_min = min(rtts)
+            self.ping_max = max(rtts)
+            self.ping_avg = sum(rtts) / len(rtts)
+            # Same standard deviation as the one computed by the ping command (mdev)
+            self.ping_stddev = math.sqrt(max(sum(rtt * rtt for rtt in rtts) / len(rtts) - self.ping_avg * self.ping_avg, 0))
+            self.ping_response += 'rtt min/avg/max/mdev = %.3f/%.3f/%.3f/%.3f ms\n' % (self.ping_min, self.ping_avg, self.ping_max, self.ping_stddev)
+        else:
+            self.ping_min = self.ping_avg = self.ping_max = self.ping_stddev = None
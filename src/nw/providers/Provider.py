@@ -29,6 +29,9 @@ The Provider's configuration comes from:
     NOTE: the options coming from the "options" argument overwrite the options coming from the Provider's configuration file.
 
 The Providers can overload the method '_isConfigValid' to add other verifications on their configuration.        
+
+The Providers can also define a 'processAsync' coroutine (trollius), equivalent to 'process' but not blocking. When the scheduler uses
+the asyncio engine, 'processAsync' is run on the event loop instead of running 'process' in a thread.
 '''
 
 
@@ -70,6 +73,13 @@ class Provider:
         '''
         pass
     
+    def release(self):
+        '''
+        Method which can be overloaded by the Providers to release their resources (e.g. registrations to shared services) when the
+        task is stopped, removed or changed by a reload of the configuration. The Provider is not used after this call.
+        '''
+        pass
+    
     def _isConfigValid(self):
         '''
         Method which verify if the Provider's configuration is valid:
@@ -15,9 +15,16 @@
 #    under the License.
 
 import sys
+import os
 from nw.core import Log
 import logging
 from facette.client import Facette
+from nw.core import ProvidersManager
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core.FacetteGraphIndex import getFacetteGraphIndex
+
+# Night Watch main config file, read (if it exists) to use the graphs index file of the Facette Providers
+_config_file = '/etc/night-watch/night-watch.yml'
 
 def _checkMetricAvailability(fc, source_name, metric_name):
     test_metric = fc.catalog.metrics.get(metric_name)
@@ -27,22 +34,25 @@ def _checkMetricAvailability(fc, source_name, metric_name):
     else:
         return False
 
-def _findGraphName(fc, source_name, metric_name):
-    graph_list = fc.library.graphs.list(filter=None)
-    # Look in the graph list which one has a serie containing the requested metric
-    logging.getLogger(__name__).info('Search graph containing the metric "' + metric_name + '" for source "' + source_name + '" from "' + str(len(graph_list)) + ' graphs')
-    for g in graph_list:
-        #logging.getLogger(__name__).info('Look for requested metric "' + metric_name + '" for source "' + source_name + '" in graph with id ' + g.id + ' named "' + g.name + '"')
-        graph = fc.library.graphs.get(g.id)
-        # Find the serie containing the requested metric or serie name
-        for group in graph.groups:
-            #logging.getLogger(__name__).debug('Look for requested metric "' + metric_name + '" for source "' + source_name + '" in group named ' + group.name + '" from graph with id ' + g.id + ' named "' + g.name + '"')
-            for serie in group.series:
-                if serie.source == source_name and serie.metric == metric_name:
-                    logging.getLogger(__name__).info('Requested metric "' + metric_name + '" for source "' + source_name + '" found in graph with id ' + g.id + ' named "' + g.name + '", related serie name is "' + serie.name + '"')
-                    return serie.name
-    # If no graph found, return an 
-    logging.getLogger(__name__).info('No graph found for metric "' + metric_name + '" and source "' + source_name + '"')
+def _getIndexFile():
+    # Return the graphs index file configured for the Facette Providers (None if Night Watch is not configured or the index is not saved)
+    if not os.path.isfile(_config_file):
+        return None
+    getNwConfiguration().read(_config_file)
+    return (ProvidersManager.getProviderConfig('Facette') or {}).get('facette_index_file')
+
+def _findGraphName(fc, srv, source_name, metric_name, index_file = None):
+    # Look in the graphs index of the Facette server which graph has a serie containing the requested metric (the index is loaded from
+    # index_file if provided, so that only the graphs changed since it has been saved are fetched from the Facette server)
+    logging.getLogger(__name__).info('Search graph containing the metric "' + metric_name + '" for source "' + source_name + '"')
+    try:
+        graph_id, series_names = getFacetteGraphIndex(srv, fc, index_file).find(source_name, [metric_name])
+    except Exception, e:
+        # If no graph found, return None
+        logging.getLogger(__name__).info(str(e))
+        return None
+    logging.getLogger(__name__).info('Requested metric "' + metric_name + '" for source "' + source_name + '" found in graph with id ' + graph_id + ', related serie name is "' + series_names[metric_name] + '"')
+    return series_names[metric_name]
 
 
 if __name__ == "__main__":
@@ -96,4 +106,4 @@ if __name__ == "__main__":
     metric_required = args[2]   # ex: "load.midterm"
     
     if _checkMetricAvailability(fc, source_name, metric_required):
-        _findGraphName(fc, source_name, metric_required)
+        _findGraphName(fc, srv, source_name, metric_required, _getIndexFile())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future
+
+from nw.core.ActionDispatcher import ActionDispatcher
+
+
+'''
+Unit tests of the Action dispatcher: the Actions which fail (by raising an error, or through the Future they return) are retried,
+then written to the dead letter file.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _FailingAction:
+    def __init__(self):
+        self.calls = 0
+
+    def process(self, state, conditions, thresholds, values):
+        self.calls += 1
+        raise Exception('SMTP server is down')
+
+
+class _FailingFutureAction:
+    def __init__(self):
+        self.calls = 0
+
+    def process(self, state, conditions, thresholds, values):
+        self.calls += 1
+        future = Future()
+        future.set_exception(Exception('Email refused'))
+        return future
+
+
+class _SucceedingFutureAction:
+    def __init__(self):
+        self.calls = 0
+
+    def process(self, state, conditions, thresholds, values):
+        self.calls += 1
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+class _RecordingAction:
+    # Action recording its calls in the shared list calls, failing the first fail_count times
+    def __init__(self, name, calls, fail_count = 0):
+        self.name = name
+        self.calls = calls
+        self.fail_count = fail_count
+
+    def process(self, state, conditions, thresholds, values):
+        self.calls.append(self.name)
+        if self.fail_count:
+            self.fail_count -= 1
+            raise Exception('SMTP server is down')
+
+
+class TestActionDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dead_letter_file = os.path.join(self.directory, 'dead-actions.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _dispatch(self, action, workers = 1):
+        dispatcher = ActionDispatcher(workers = workers, max_attempts = 2, retry_delay = 0.05, dead_letter_file = self.dead_letter_file)
+        dispatcher.dispatch('task1', action, 'on failure', 'failed', [], [], {'value': 1})
+        deadline = time.time() + 5
+        while dispatcher.getStats()['dead'] + dispatcher.getStats()['processed'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        dispatcher.stop(5)
+        return dispatcher
+
+    def _readDeadLetters(self):
+        if not os.path.exists(self.dead_letter_file):
+            return []
+        with open(self.dead_letter_file) as f:
+            return [json.loads(line) for line in f]
+
+    def test_failing_action_is_dead_lettered(self):
+        action = _FailingAction()
+        dispatcher = self._dispatch(action)
+        self.assertEqual(action.calls, 2)
+        self.assertEqual(dispatcher.getStats()['retried'], 1)
+        records = self._readDeadLetters()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['task'], 'task1')
+        self.assertEqual(records[0]['action'], '_FailingAction')
+        self.assertEqual(records[0]['attempts'], 2)
+        self.assertEqual(records[0]['error'], 'SMTP server is down')
+
+    def test_failed_future_is_dead_lettered(self):
+        action = _FailingFutureAction()
+        self._dispatch(action)
+        self.assertEqual(action.calls, 2)
+        records = self._readDeadLetters()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['error'], 'Email refused')
+
+    def test_succeeded_future_is_processed(self):
+        action = _SucceedingFutureAction()
+        dispatcher = self._dispatch(action)
+        self.assertEqual(action.calls, 1)
+        self.assertEqual(dispatcher.getStats()['processed'], 1)
+        self.assertEqual(self._readDeadLetters(), [])
+
+    def test_failing_action_without_worker_is_dead_lettered(self):
+        action = _FailingAction()
+        self._dispatch(action, workers = 0)
+        self.assertEqual(action.calls, 1)
+        self.assertEqual(len(self._readDeadLetters()), 1)
+
+    def test_next_actions_held_behind_retry(self):
+        calls = []
+        dispatcher = ActionDispatcher(workers = 1, max_attempts = 3, retry_delay = 0.1, dead_letter_file = self.dead_letter_file)
+        dispatcher.dispatch('task1', _RecordingAction('failed', calls, 1), 'on failure', 'failed', [], [], {'value': 1})
+        dispatcher.dispatch('task1', _RecordingAction('success', calls), 'on success', 'success', [], [], {'value': 1})
+        dispatcher.dispatch('task2', _RecordingAction('other', calls), 'on success', 'success', [], [], {'value': 1})
+        deadline = time.time() + 5
+        while dispatcher.getStats()['processed'] < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        dispatcher.stop(5)
+        # The Action of task1 queued after the failed one is processed after its retry, the Actions of task2 are not held
+        self.assertEqual(calls, ['failed', 'other', 'failed', 'success'])
+        self.assertEqual(dispatcher.getStats()['queue_depth'], 0)
+
+    def test_held_actions_processed_at_stop(self):
+        calls = []
+        dispatcher = ActionDispatcher(workers = 1, max_attempts = 2, retry_delay = 60, dead_letter_file = self.dead_letter_file)
+        dispatcher.dispatch('task1', _RecordingAction('failed', calls, 1), 'on failure', 'failed', [], [], {'value': 1})
+        dispatcher.dispatch('task1', _RecordingAction('success', calls), 'on success', 'success', [], [], {'value': 1})
+        deadline = time.time() + 5
+        while (dispatcher.getStats()['queue_depth'], dispatcher.getStats()['retry_depth']) != (1, 1) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(calls, ['failed'])
+        dispatcher.stop(5)
+        # The Action waiting for its retry is dead lettered, the Action held behind it is processed
+        self.assertEqual(calls, ['failed', 'success'])
+        self.assertEqual([record['event'] for record in self._readDeadLetters()], ['on failure'])
+
+
+if __name__ == '__main__':
+    unittest.main()
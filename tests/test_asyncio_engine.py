@@ -0,0 +1,110 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import threading
+import time
+
+import trollius as asyncio
+from trollius import From, Return
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core import ProvidersManager
+from nw.core import Task as TaskModule
+from nw.core.Task import Task
+from nw.core.Scheduler import Scheduler
+from nw.core.AsyncioEngine import EventLoopThread, getTaskCoroutine
+
+
+'''
+Unit tests of the asyncio execution engine of the Scheduler.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _AsyncProvider:
+    # Provider returning its delay after waiting for it on the event loop, and counting the calls running at once
+    running = 0
+    peak = 0
+
+    def __init__(self, options):
+        self.delay = options['delay']
+
+    @asyncio.coroutine
+    def processAsync(self):
+        _AsyncProvider.running += 1
+        _AsyncProvider.peak = max(_AsyncProvider.peak, _AsyncProvider.running)
+        try:
+            yield From(asyncio.sleep(self.delay))
+        finally:
+            _AsyncProvider.running -= 1
+        raise Return(self.delay)
+
+    def release(self):
+        pass
+
+
+class TestAsyncioEngine(unittest.TestCase):
+
+    def setUp(self):
+        config = getNwConfiguration()
+        config.scheduler, config.history, config.process_workers = {}, {'depth': 0}, {}
+        self._getProviderClass = ProvidersManager.getProviderClass
+        ProvidersManager.getProviderClass = lambda name: _AsyncProvider
+        _AsyncProvider.running = _AsyncProvider.peak = 0
+
+    def tearDown(self):
+        ProvidersManager.getProviderClass = self._getProviderClass
+        TaskModule.stopProvidersExecutor()
+
+    def test_task_coroutine(self):
+        providers = [{'Wait': {'condition': 'lower', 'threshold': 10, 'provider_options': {'delay': 0.2}}} for i in range(4)]
+        task = Task('task1', '1m', '1m', '1m', None, providers, None, None, 2, None)
+        event_loop_thread = EventLoopThread(2)
+        event_loop_thread.start()
+        done = threading.Event()
+        def runTask():
+            asyncio.async(getTaskCoroutine(task, event_loop_thread.loop)(), loop = event_loop_thread.loop).add_done_callback(lambda f: done.set())
+        try:
+            event_loop_thread.loop.call_soon_threadsafe(runTask)
+            self.assertTrue(done.wait(5))
+        finally:
+            event_loop_thread.stop()
+        # The providers were run on the event loop, two at a time (max_parallel_providers), and their values are conform
+        self.assertEqual(_AsyncProvider.peak, 2)
+        self.assertEqual(task.provider_values, [0.2] * 4)
+        self.assertEqual(task.getState(), (False, 0))
+
+    def test_coroutine_job(self):
+        runs = []
+        @asyncio.coroutine
+        def job():
+            runs.append(threading.current_thread().name)
+            yield From(asyncio.sleep(0))
+        scheduler = Scheduler('asyncio', 2)
+        # A jitter below one millisecond is ignored (no modulo by zero)
+        scheduler.addJob('1s', job, 'job1', first_run_delay = 0.1, jitter = 0.0005)
+        scheduler.start()
+        try:
+            deadline = time.time() + 5
+            while not runs and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+        self.assertEqual(runs[:1], ['EventLoop'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import tempfile
+import shutil
+import os
+
+from nw.core import ConfigCache as ConfigCacheModule
+from nw.core.ConfigCache import ConfigCache
+
+
+'''
+Unit tests of the cache of the parsed config files.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class TestConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.directory, 'config.cache')
+        # Count the config files parsed (cache misses)
+        self.parsed = []
+        self._loadYamlFile = ConfigCacheModule.loadYamlFile
+        def loadYamlFile(path):
+            self.parsed.append(os.path.basename(path))
+            return self._loadYamlFile(path)
+        ConfigCacheModule.loadYamlFile = loadYamlFile
+
+    def tearDown(self):
+        ConfigCacheModule.loadYamlFile = self._loadYamlFile
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, content, mtime = None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_hit_and_miss(self):
+        path = self._write('task1.yml', 'task1:\n  retries: 1\n', 1000)
+        cache = ConfigCache(self.cache_file)
+        self.assertEqual(cache.load(path), {'task1': {'retries': 1}})
+        cache.save()
+        # The file has not changed: it is read from the cache file by the next instance
+        cache = ConfigCache(self.cache_file)
+        self.assertEqual(cache.load(path), {'task1': {'retries': 1}})
+        self.assertEqual(self.parsed, ['task1.yml'])
+        # Same content with another modification time: found by its hash
+        os.utime(path, (2000, 2000))
+        self.assertEqual(cache.load(path), {'task1': {'retries': 1}})
+        self.assertEqual(self.parsed, ['task1.yml'])
+        # The content has changed
+        self._write('task1.yml', 'task1:\n  retries: 2\n', 3000)
+        self.assertEqual(cache.load(path), {'task1': {'retries': 2}})
+        self.assertEqual(self.parsed, ['task1.yml', 'task1.yml'])
+
+    def test_removed_files_are_dropped(self):
+        path1 = self._write('task1.yml', 'task1: {}\n')
+        path2 = self._write('task2.yml', 'task2: {}\n')
+        cache = ConfigCache(self.cache_file)
+        cache.startLoad()
+        cache.load(path1)
+        cache.load(path2)
+        cache.save()
+        # Reload: task2.yml has been removed, task1.yml is still there (even if it is not read again)
+        os.remove(path2)
+        cache.startLoad()
+        cache.save()
+        self.assertEqual(sorted(ConfigCache(self.cache_file)._entries), [path1])
+
+
+if __name__ == '__main__':
+    unittest.main()
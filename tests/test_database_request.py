@@ -0,0 +1,201 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import time
+
+from nw.core.NwConfiguration import getNwConfiguration
+
+try:
+    from nw.providers import DatabaseRequest as DatabaseRequestModule
+    from nw.providers.DatabaseRequest import DatabaseRequest, _ConnectionPool, _getConnectionPool
+except ImportError:
+    # The database drivers (psycopg2 and MySQLdb) are not installed
+    DatabaseRequestModule = None
+
+
+'''
+Unit tests of the DatabaseRequest Provider and of its connection pools, using fake connections (no database is required, but the
+database drivers must be installed).
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _Cursor:
+    # The SELECT requests return the rows of the connection (one row for the validation request), the other requests return no result
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._rows = []
+
+    def execute(self, query, args = None):
+        if self.connection.broken:
+            raise Exception('Connection lost')
+        for prefix, error in self.connection.errors.iteritems():
+            if query.startswith(prefix):
+                raise error
+        self.connection.queries.append(query)
+        if not query.startswith('SELECT'):
+            return 0
+        self.description = [('id',), ('value',)]
+        self._rows = [(1, 1)] if query == 'SELECT 1' else list(self.connection.rows)
+        return len(self._rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        pass
+
+
+class _Connection:
+    def __init__(self, rows = [], errors = {}):
+        self.broken = False
+        self.closed = False
+        self.queries = []
+        self.rows = rows
+        self.errors = errors # Requests failing: prefix of the request -> error raised
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        if self.broken:
+            raise Exception('Connection lost')
+
+    def close(self):
+        self.closed = True
+
+    def autocommit(self, on):
+        pass
+
+
+@unittest.skipIf(DatabaseRequestModule is None, 'psycopg2 or MySQLdb is not installed')
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self._checkout_timeout = DatabaseRequestModule._checkout_timeout
+
+    def tearDown(self):
+        DatabaseRequestModule._checkout_timeout = self._checkout_timeout
+
+    def _connect(self):
+        self.connections.append(_Connection())
+        return self.connections[-1]
+
+    def _createPool(self, min_size = 1, max_size = 2, idle_timeout = 300):
+        return _ConnectionPool('test', self._connect, min_size, max_size, idle_timeout)
+
+    def test_connection_reused(self):
+        pool = self._createPool()
+        for i in range(3):
+            with pool.connection() as con:
+                con.cursor().execute('SELECT 2')
+        self.assertEqual(len(self.connections), 1)
+        # The connection is validated before each use, except when it has just been opened
+        self.assertEqual(self.connections[0].queries, ['SELECT 2', 'SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 2'])
+
+    def test_broken_connection_replaced(self):
+        pool = self._createPool()
+        with pool.connection() as con:
+            pass
+        con.broken = True
+        with pool.connection() as con:
+            pass
+        self.assertEqual(len(self.connections), 2)
+        self.assertTrue(self.connections[0].closed)
+        self.assertTrue(con is self.connections[1])
+
+    def test_max_size(self):
+        DatabaseRequestModule._checkout_timeout = 0.2
+        pool = self._createPool(max_size = 1)
+        with pool.connection():
+            begin = time.time()
+            self.assertRaises(Exception, pool._checkout)
+            self.assertTrue(time.time() - begin >= 0.2)
+
+    def test_idle_connections_closed(self):
+        pool = self._createPool(min_size = 1, max_size = 3, idle_timeout = 0.1)
+        with pool.connection():
+            with pool.connection():
+                with pool.connection():
+                    pass
+        time.sleep(0.2)
+        # Closed by the periodic sweep, without any checkout, except the min_size most recently used connection
+        pool.closeIdleConnections()
+        self.assertEqual([con.closed for con in self.connections], [False, True, True])
+
+    def test_password_in_pool_key(self):
+        pool = _getConnectionPool('postgresql', 'localhost', 'nw', 'nw', 'secret', False, None, 1, 5, 300)
+        self.assertTrue(_getConnectionPool('postgresql', 'localhost', 'nw', 'nw', 'secret', False, None, 1, 5, 300) is pool)
+        self.assertFalse(_getConnectionPool('postgresql', 'localhost', 'nw', 'nw', 'changed', False, None, 1, 5, 300) is pool)
+        # The password is not kept in clear in the keys of the pools
+        self.assertFalse([key for key in DatabaseRequestModule._pools if 'secret' in key])
+
+
+@unittest.skipIf(DatabaseRequestModule is None, 'psycopg2 or MySQLdb is not installed')
+class TestDatabaseRequest(unittest.TestCase):
+
+    def setUp(self):
+        getNwConfiguration().providers_location = '/nonexistent'
+        self._connect_functions = dict(DatabaseRequestModule._connect_functions)
+        self.rows = []
+
+    def tearDown(self):
+        DatabaseRequestModule._connect_functions.update(self._connect_functions)
+
+    def _process(self, database_type, request, **options):
+        # Each test uses its own pool (the pools are keyed by the user), its connections return the rows of the test
+        DatabaseRequestModule._connect_functions[database_type] = lambda *args: _Connection(self.rows)
+        options.update({'database_type': database_type, 'machine_addr': 'localhost', 'database_name': 'nw', 'user_database': self.id(),
+                        'password_database': 'nw', 'request': request})
+        return DatabaseRequest(options).process()
+
+    def test_postgresql_status(self):
+        self.assertEqual(self._process('postgresql', 'SELECT value FROM queue'), 'OK')
+        self.assertEqual(self._process('postgresql', 'UPDATE queue SET value = 0'), 'NOK')
+
+    def test_postgresql_status_requires_row(self):
+        self.assertEqual(self._process('postgresql', 'SELECT value FROM queue', status_requires_row = True), 'NOK')
+        self.rows.append((1, 12))
+        self.assertEqual(self._process('postgresql', 'SELECT value FROM queue', status_requires_row = True), 'OK')
+
+    def test_mysql_status(self):
+        self.assertEqual(self._process('mysql', 'SELECT value FROM queue'), 'NOK')
+        self.rows.append((1, 12))
+        self.assertEqual(self._process('mysql', 'SELECT value FROM queue'), 'OK')
+
+    def test_value(self):
+        self.rows.extend([(1, 12), (2, 15)])
+        self.assertEqual(self._process('postgresql', 'SELECT id, value FROM queue', requested_data = 'value', column = 'value'), 12)
+        self.assertEqual(self._process('postgresql', 'SELECT id, value FROM queue', requested_data = 'value', column = 'missing'), None)
+
+    def test_mysql_without_max_execution_time(self):
+        # MySQL < 5.7.8 does not know max_execution_time: the connection is used without statement timeout
+        connection = _Connection(errors = {'SET SESSION max_execution_time': DatabaseRequestModule.MySQLdb.OperationalError(1193, 'Unknown system variable')})
+        connect, DatabaseRequestModule.MySQLdb.connect = DatabaseRequestModule.MySQLdb.connect, lambda *args: connection
+        try:
+            self.assertTrue(DatabaseRequestModule._connectMysql('localhost', 'nw', 'nw', 'nw', True, 10) is connection)
+        finally:
+            DatabaseRequestModule.MySQLdb.connect = connect
+        self.assertEqual(connection.queries, ['SET SESSION TRANSACTION READ ONLY'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import asyncore
+import smtpd
+import socket
+import threading
+import unittest
+
+from nw.core.EmailDelivery import EmailDelivery
+
+
+'''
+Unit tests of the background delivery of the emails, to a local SMTP server.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _SmtpServer(smtpd.SMTPServer):
+    # SMTP server keeping the received messages
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.messages = []
+        self.port = self.socket.getsockname()[1]
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+def _getClosedPort():
+    # Return a local port on which no server is listening
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class TestEmailDelivery(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _SmtpServer()
+        self._thread = threading.Thread(target = asyncore.loop, kwargs = {'timeout': 0.05, 'map': None})
+        self._thread.daemon = True
+        self._thread.start()
+        self.delivery = EmailDelivery()
+        self.settings = {'url': '127.0.0.1', 'port': self.server.port}
+
+    def tearDown(self):
+        self.delivery.stop(5)
+        self.server.close()
+        self._thread.join(5)
+
+    def test_send(self):
+        future = self.delivery.send(self.settings, 'nw@example.com', ['admin@example.com'], None, 'Task failed', 'Body')
+        self.assertEqual(future.result(5), None)
+        self.assertEqual(len(self.server.messages), 1)
+        mailfrom, rcpttos, data = self.server.messages[0]
+        self.assertEqual((mailfrom, rcpttos), ('nw@example.com', ['admin@example.com']))
+        self.assertTrue('Subject: Task failed' in data)
+
+    def test_digest(self):
+        futures = [self.delivery.send(self.settings, 'nw@example.com', ['admin@example.com'], None, 'Task ' + str(i) + ' failed', 'Body', 0.3)
+                   for i in range(3)]
+        for future in futures:
+            self.assertEqual(future.result(5), None)
+        # The 3 emails have been sent in one digest email
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertTrue('Subject: [3 alerts] Task 0 failed' in self.server.messages[0][2])
+
+    def test_pending_digest_sent_at_stop(self):
+        future = self.delivery.send(self.settings, 'nw@example.com', ['admin@example.com'], None, 'Task failed', 'Body', 3600)
+        self.delivery.stop(5)
+        self.assertEqual(future.result(0), None)
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_server_down(self):
+        settings = {'url': '127.0.0.1', 'port': _getClosedPort()}
+        futures = [self.delivery.send(settings, 'nw@example.com', ['admin@example.com'], None, 'Task ' + str(i) + ' failed', 'Body', 0.1)
+                   for i in range(2)]
+        # The error of the last attempt fails the Futures of all the emails of the digest
+        for future in futures:
+            self.assertTrue(isinstance(future.exception(5), socket.error))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from nw.core.NwConfiguration import getNwConfiguration
+
+try:
+    from nw.providers.Facette import Facette
+except ImportError:
+    # The Facette client (python-facette) is not installed
+    Facette = None
+
+
+'''
+Unit tests of the 'series' query mode of the Facette Provider, requesting the plots API of a local fake Facette server.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _Handler(BaseHTTPRequestHandler):
+    # Plots API returning, for each serie requested, the summary of its metric set in the server's summaries
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.path, request))
+        series = []
+        for group in request['graph']['groups']:
+            for serie in group['series']:
+                summary = self.server.summaries.get((serie['origin'], serie['source'], serie['metric']))
+                if summary is not None:
+                    series.append({'name': serie['name'], 'summary': summary})
+        body = json.dumps({'series': series})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipIf(Facette is None, 'python-facette is not installed')
+class TestSeriesQueryMode(unittest.TestCase):
+
+    def setUp(self):
+        getNwConfiguration().providers_location = '/nonexistent'
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        self.server.summaries = {
+            ('collectd', 'host1', 'cpu.user'): {'avg': 20.0, 'last': 25.0},
+            ('collectd', 'host1', 'cpu.idle'): {'avg': 80.0, 'last': 75.0}
+        }
+        self._thread = threading.Thread(target = self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _createProvider(self, **options):
+        options.update({'facette_srv_url': 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/', 'source_name': 'host1',
+                        'query_mode': 'series', 'origin_name': 'collectd'})
+        return Facette(options)
+
+    def test_raw_value(self):
+        self.assertEqual(self._createProvider(metric_name = 'cpu.user', plot_info = 'last').process(), 25.0)
+        path, request = self.server.requests[0]
+        self.assertEqual(path, '/api/v1/library/graphs/plots')
+        self.assertEqual(request['range'], '-300s')
+        self.assertEqual([group['series'][0]['metric'] for group in request['graph']['groups']], ['cpu.user'])
+
+    def test_ratio(self):
+        provider = self._createProvider(requested_data = 'ratio', metrics_names_list_numerator = ['cpu.user'],
+                                        metrics_names_list_denominator = ['cpu.user', 'cpu.idle'])
+        self.assertEqual(provider.process(), 0.2)
+        # All the metrics are requested at once
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_metric_not_found(self):
+        self.assertRaises(Exception, self._createProvider(metric_name = 'cpu.steal').process)
+
+    def test_origin_required(self):
+        self.assertRaises(Exception, Facette, {'facette_srv_url': 'http://127.0.0.1/', 'source_name': 'host1', 'metric_name': 'cpu.user',
+                                               'query_mode': 'series'})
+
+
+if __name__ == '__main__':
+    unittest.main()
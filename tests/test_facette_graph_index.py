@@ -0,0 +1,135 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from nw.core import FacetteGraphIndex as FacetteGraphIndexModule
+from nw.core.FacetteGraphIndex import FacetteGraphIndex
+
+
+'''
+Unit tests of the index of the graphs of a Facette server, using a fake Facette client.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _Object:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class _Graphs:
+    # Graphs of the fake Facette server: graph id -> (name, modified, list of (source, metric, serie name))
+    def __init__(self, graphs):
+        self.graphs = graphs
+        self.order = sorted(graphs)
+        self.fetched = []
+        self.list_delay = 0
+
+    def list(self, filter = None):
+        time.sleep(self.list_delay)
+        return [_Object(id = graph_id, name = self.graphs[graph_id][0], modified = self.graphs[graph_id][1]) for graph_id in self.order]
+
+    def get(self, graph_id):
+        self.fetched.append(graph_id)
+        series = [_Object(source = source, metric = metric, name = name) for source, metric, name in self.graphs[graph_id][2]]
+        return _Object(groups = [_Object(series = series)])
+
+
+class _FacetteClient:
+    def __init__(self, graphs):
+        self.library = _Object(graphs = _Graphs(graphs))
+
+
+class TestFacetteGraphIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.fc = _FacetteClient({
+            'g1': ('cpu', 1, [('host1', 'cpu.user', 'user'), ('host1', 'cpu.system', 'system')]),
+            'g2': ('load', 1, [('host1', 'load.shortterm', 'load1'), ('host2', 'load.shortterm', 'load1')]),
+            'g3': ('cpu host2', 1, [('host2', 'cpu.user', 'user')])
+        })
+        self.graphs = self.fc.library.graphs
+        self.directory = tempfile.mkdtemp()
+        self._min_refresh_interval = FacetteGraphIndexModule._min_refresh_interval
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        FacetteGraphIndexModule._min_refresh_interval = self._min_refresh_interval
+
+    def test_find(self):
+        index = FacetteGraphIndex(self.fc)
+        self.assertEqual(index.find('host1', ['cpu.user', 'cpu.system']), ('g1', {'cpu.user': 'user', 'cpu.system': 'system'}))
+        self.assertEqual(index.find('host2', ['load.shortterm']), ('g2', {'load.shortterm': 'load1'}))
+        self.assertEqual(index.find('host2', ['cpu.user'], 'glob:cpu *'), ('g3', {'cpu.user': 'user'}))
+        self.assertRaises(Exception, index.find, 'host1', ['cpu.user', 'load.shortterm'])
+        # The graphs have been fetched once
+        self.assertEqual(sorted(self.graphs.fetched), ['g1', 'g2', 'g3'])
+
+    def test_incremental_refresh(self):
+        index = FacetteGraphIndex(self.fc)
+        index.refresh()
+        self.graphs.graphs['g2'] = ('load', 2, [('host3', 'load.shortterm', 'load1')])
+        del self.graphs.graphs['g3']
+        self.graphs.order = ['g1', 'g2']
+        self.graphs.fetched = []
+        index.refresh()
+        self.assertEqual(self.graphs.fetched, ['g2'])
+        self.assertEqual(index.find('host3', ['load.shortterm']), ('g2', {'load.shortterm': 'load1'}))
+        self.assertRaises(Exception, index.find, 'host2', ['cpu.user'])
+
+    def test_refresh_on_metric_not_found(self):
+        FacetteGraphIndexModule._min_refresh_interval = 0.2
+        index = FacetteGraphIndex(self.fc)
+        index.refresh()
+        self.graphs.graphs['g4'] = ('disk', 1, [('host1', 'disk.used', 'used')])
+        self.graphs.order.append('g4')
+        # The index has just been refreshed, it is not refreshed again
+        self.assertRaises(Exception, index.find, 'host1', ['disk.used'])
+        time.sleep(0.2)
+        self.assertEqual(index.find('host1', ['disk.used']), ('g4', {'disk.used': 'used'}))
+
+    def test_find_during_refresh(self):
+        FacetteGraphIndexModule._min_refresh_interval = 0
+        index = FacetteGraphIndex(self.fc)
+        index.refresh()
+        self.graphs.list_delay = 1
+        refresh = threading.Thread(target = index.refresh)
+        refresh.start()
+        time.sleep(0.1)
+        # The metrics already indexed are found while the index is refreshed from the Facette server
+        begin = time.time()
+        self.assertEqual(index.find('host1', ['cpu.user']), ('g1', {'cpu.user': 'user'}))
+        self.assertTrue(time.time() - begin < 0.5)
+        refresh.join()
+
+    def test_index_file(self):
+        index_file = os.path.join(self.directory, 'graphs.json')
+        FacetteGraphIndex(self.fc, index_file).refresh()
+        self.graphs.fetched = []
+        index = FacetteGraphIndex(self.fc, index_file)
+        index.refresh()
+        # The graphs loaded from the index file, and not modified since, are not fetched again
+        self.assertEqual(self.graphs.fetched, [])
+        self.assertEqual(index.find('host1', ['cpu.system']), ('g1', {'cpu.system': 'system'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
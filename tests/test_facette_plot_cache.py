@@ -0,0 +1,117 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import threading
+import time
+
+from nw.core.FacettePlotCache import FacettePlotCache
+
+
+'''
+Unit tests of the cache of the plots fetched from the Facette servers.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _Plots:
+    # Fake plots API of the Facette client: fc.library.graphs.plots.get
+    def __init__(self, result = 'plot', delay = 0):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get(self, graph_id, plot_range):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class _Client:
+    def __init__(self, plots):
+        self.library = type('Library', (), {})()
+        self.library.graphs = type('Graphs', (), {})()
+        self.library.graphs.plots = plots
+
+
+class TestFacettePlotCache(unittest.TestCase):
+
+    def test_hit(self):
+        cache, plots = FacettePlotCache(), _Plots()
+        fc = _Client(plots)
+        self.assertEqual(cache.get('http://facette/', fc, 'graph1', '-1h', 3600), 'plot')
+        self.assertEqual(cache.get('http://facette/', fc, 'graph1', '-1h', 3600), 'plot')
+        self.assertEqual(plots.calls, 1)
+        self.assertEqual(cache.getStats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_different_keys(self):
+        cache, plots = FacettePlotCache(), _Plots()
+        fc = _Client(plots)
+        cache.get('http://facette/', fc, 'graph1', '-1h', 3600)
+        cache.get('http://facette/', fc, 'graph2', '-1h', 3600)
+        cache.get('http://facette/', fc, 'graph1', '-5m', 3600)
+        cache.get('http://other/', fc, 'graph1', '-1h', 3600)
+        self.assertEqual(plots.calls, 4)
+
+    def test_concurrent_requests_fetch_once(self):
+        cache, plots = FacettePlotCache(), _Plots(delay = 0.2)
+        fc = _Client(plots)
+        results = []
+        threads = [threading.Thread(target = lambda: results.append(cache.get('http://facette/', fc, 'graph1', '-1h', 3600))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['plot'] * 5)
+        self.assertEqual(plots.calls, 1)
+
+    def test_wait_timeout(self):
+        cache, plots = FacettePlotCache(), _Plots(delay = 1)
+        fc = _Client(plots)
+        fetch = threading.Thread(target = cache.get, args = ('http://facette/', fc, 'graph1', '-1h', 3600))
+        fetch.start()
+        time.sleep(0.1)
+        # The plot is being fetched by the other thread, do not wait for it longer than the timeout
+        begin = time.time()
+        self.assertRaises(Exception, cache.get, 'http://facette/', fc, 'graph1', '-1h', 3600, 0.2)
+        self.assertTrue(time.time() - begin < 0.5)
+        fetch.join()
+        self.assertEqual(cache.get('http://facette/', fc, 'graph1', '-1h', 3600, 0.2), 'plot')
+        self.assertEqual(plots.calls, 1)
+
+    def test_errors_are_not_cached(self):
+        cache, plots = FacettePlotCache(), _Plots(result = Exception('Facette server is down'))
+        fc = _Client(plots)
+        self.assertRaises(Exception, cache.get, 'http://facette/', fc, 'graph1', '-1h', 3600)
+        plots.result = 'plot'
+        self.assertEqual(cache.get('http://facette/', fc, 'graph1', '-1h', 3600), 'plot')
+        self.assertEqual(plots.calls, 2)
+
+    def test_expired_plots(self):
+        cache, plots = FacettePlotCache(), _Plots()
+        fc = _Client(plots)
+        cache.get('http://facette/', fc, 'graph1', '-1h', 0.1)
+        time.sleep(0.2)
+        cache.get('http://facette/', fc, 'graph1', '-1h', 0.1)
+        self.assertEqual(plots.calls, 2)
+        self.assertEqual(cache.getStats()['size'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.providers import HttpRequest as HttpRequestModule
+from nw.providers.HttpRequest import HttpRequest, _ContentReader
+
+
+'''
+Unit tests of the HttpRequest Provider, requesting a local HTTP server: connection pools shared by the Providers, timeouts and
+response data.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive connections
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path == '/slow':
+            time.sleep(1)
+        status = 404 if self.path == '/missing' else 200
+        body = '{"status": "OK"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # e.g. the client closed the connection on timeout
+
+
+class _HttpRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        getNwConfiguration().providers_location = '/nonexistent'
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.connections = set()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1])
+        self._thread = threading.Thread(target = self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.providers = []
+
+    def tearDown(self):
+        for provider in self.providers:
+            provider.release()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _createProvider(self, path = '/', **options):
+        options['url'] = self.url + path
+        provider = HttpRequest(options)
+        self.providers.append(provider)
+        return provider
+
+
+class TestConnectionPool(_HttpRequestTest):
+
+    def test_pool_shared(self):
+        provider1 = self._createProvider()
+        provider2 = self._createProvider()
+        self.assertTrue(provider1._pool is provider2._pool)
+        for i in range(3):
+            self.assertEqual(provider1.process(), 200)
+            self.assertEqual(provider2.process(), 200)
+        # All the requests were sent on the same connection
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_no_keep_alive(self):
+        provider = self._createProvider(keep_alive = False)
+        for i in range(3):
+            self.assertEqual(provider.process(), 200)
+        self.assertEqual(len(self.server.connections), 3)
+
+    def test_idle_connections_closed_when_put_back(self):
+        provider = self._createProvider(pool_idle_timeout = 0.2)
+        pool = provider._pool.adapter.poolmanager.connection_from_url(provider.url)
+        conn1, conn2 = pool._get_conn(), pool._get_conn()
+        conn1.connect()
+        conn2.connect()
+        pool._put_conn(conn1)
+        time.sleep(0.3)
+        # conn1 has been idle for longer than the idle timeout, it is closed when another connection is put back
+        pool._put_conn(conn2)
+        self.assertEqual(conn1.sock, None)
+        self.assertNotEqual(conn2.sock, None)
+
+    def test_pool_closed_when_released(self):
+        provider1 = self._createProvider()
+        provider2 = self._createProvider()
+        key = HttpRequestModule._getPoolKey(provider1.url)
+        self.assertEqual(provider1.process(), 200)
+        provider1.release()
+        self.assertTrue(HttpRequestModule._pools.has_key(key))
+        provider2.release()
+        self.assertFalse(HttpRequestModule._pools.has_key(key))
+        # A new Provider requesting the host gets a new pool
+        self.assertEqual(self._createProvider().process(), 200)
+        self.assertTrue(HttpRequestModule._pools.has_key(key))
+
+
+class TestRequest(_HttpRequestTest):
+
+    def test_error_status(self):
+        # An error status is a failed request, whatever the requested data
+        self.assertEqual(self._createProvider('/missing').process(), None)
+        self.assertEqual(self._createProvider('/missing', requested_data = 'content').process(), None)
+
+    def test_read_timeout(self):
+        provider = self._createProvider('/slow', read_timeout = 0.3)
+        begin = time.time()
+        self.assertEqual(provider.process(), None)
+        # The timed out request is not retried
+        self.assertTrue(time.time() - begin < 0.9)
+
+    def test_response_time(self):
+        response_time = self._createProvider('/slow', requested_data = 'response_time').process()
+        self.assertTrue(1000 <= response_time < 2000)
+        ttfb = self._createProvider('/slow', requested_data = 'response_time_ttfb').process()
+        self.assertTrue(1000 <= ttfb < 2000)
+
+    def test_connection_times(self):
+        for requested_data in ('response_time_dns', 'response_time_connect'):
+            self.assertTrue(0 <= self._createProvider(requested_data = requested_data).process() < 1000)
+        self.assertEqual(self._createProvider(requested_data = 'response_time_tls').process(), 0.0)
+
+    def test_invalid_timeout(self):
+        self.assertRaises(Exception, self._createProvider, read_timeout = 0)
+
+    def test_content(self):
+        self.assertEqual(self._createProvider(requested_data = 'content').process(), {'status': 'OK'})
+
+    def test_content_size(self):
+        # The response content is 16 bytes long
+        self.assertEqual(self._createProvider(requested_data = 'content_size', max_content_bytes = 16).process(), 16)
+        self.assertEqual(self._createProvider(requested_data = 'content_size', max_content_bytes = 15).process(), None)
+
+    def test_content_match(self):
+        self.assertEqual(self._createProvider(requested_data = 'content_match', content_substring = '"OK"').process(), True)
+        self.assertEqual(self._createProvider(requested_data = 'content_match', content_regex = 'K[OA]').process(), False)
+
+    @unittest.skipIf(HttpRequestModule.ijson is None, 'ijson is not installed')
+    def test_content_json(self):
+        self.assertEqual(self._createProvider(requested_data = 'content_json', json_path = 'status').process(), 'OK')
+
+    def test_content_json_without_ijson(self):
+        ijson, HttpRequestModule.ijson = HttpRequestModule.ijson, None
+        try:
+            self.assertRaises(Exception, self._createProvider, requested_data = 'content_json', json_path = 'status')
+        finally:
+            HttpRequestModule.ijson = ijson
+
+
+class _Response:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def iter_content(self, chunk_size):
+        return iter(self._chunks)
+
+
+class TestContentReader(unittest.TestCase):
+
+    def _read(self, chunks, max_bytes):
+        reader = _ContentReader(_Response(chunks), max_bytes)
+        data = ''
+        chunk = reader.read(4)
+        while chunk:
+            data += chunk
+            chunk = reader.read(4)
+        return data, reader.truncated
+
+    def test_content_of_max_bytes(self):
+        self.assertEqual(self._read(['abcd', 'efgh'], 8), ('abcdefgh', False))
+        self.assertEqual(self._read(['abcdefgh'], 8), ('abcdefgh', False))
+
+    def test_content_larger_than_max_bytes(self):
+        self.assertEqual(self._read(['abcd', 'efgh', 'i'], 8), ('abcdefgh', True))
+        self.assertEqual(self._read(['abcdefghi'], 8), ('abcdefgh', True))
+
+    def test_read_all(self):
+        reader = _ContentReader(_Response(['abc', 'def']), 6)
+        self.assertEqual((reader.read(), reader.read(), reader.truncated), ('abcdef', '', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
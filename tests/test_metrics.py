@@ -0,0 +1,118 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import tempfile
+import shutil
+import urllib2
+import json
+import os
+
+from nw.core.Metrics import Metrics, MetricsExporter, getMetrics
+
+
+'''
+Unit tests of the execution metrics, and of their export in the Prometheus text format and in JSON.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class TestMetrics(unittest.TestCase):
+
+    def _getLines(self, metrics, name):
+        return [line for line in metrics.toPrometheus().splitlines() if line.split('{')[0].split(' ')[0] == name]
+
+    def test_task_counters(self):
+        metrics = Metrics()
+        metrics.observeTaskRun('task1', 0.2, False)
+        metrics.observeTaskRun('task1', 0.3, True)
+        metrics.countMissedRuns('task1', 2)
+        text = metrics.toPrometheus()
+        self.assertTrue('# TYPE nightwatch_task_runs_total counter\nnightwatch_task_runs_total{task="task1"} 2.0\n' in text)
+        self.assertEqual(self._getLines(metrics, 'nightwatch_task_errors_total'), ['nightwatch_task_errors_total{task="task1"} 1.0'])
+        self.assertEqual(self._getLines(metrics, 'nightwatch_task_missed_runs_total'), ['nightwatch_task_missed_runs_total{task="task1"} 2.0'])
+
+    def test_histogram(self):
+        metrics = Metrics()
+        for duration in (0.003, 0.2, 0.2, 1000):
+            metrics.observeProvider('task1', 0, 'Ping', duration, True)
+        buckets = dict((line.split('le="')[1].split('"')[0], line.rsplit(' ', 1)[1])
+                       for line in self._getLines(metrics, 'nightwatch_provider_duration_seconds_bucket'))
+        # The buckets are cumulative
+        self.assertEqual((buckets['0.005'], buckets['0.1'], buckets['0.25'], buckets['300.0'], buckets['+Inf']), ('1', '1', '3', '3', '4'))
+        self.assertEqual(self._getLines(metrics, 'nightwatch_provider_duration_seconds_count'),
+                         ['nightwatch_provider_duration_seconds_count{index="0",provider="Ping",task="task1"} 4'])
+        self.assertEqual(self._getLines(metrics, 'nightwatch_provider_duration_seconds_sum'),
+                         ['nightwatch_provider_duration_seconds_sum{index="0",provider="Ping",task="task1"} ' + repr(0.003 + 0.2 + 0.2 + 1000)])
+
+    def test_label_escaping(self):
+        metrics = Metrics()
+        metrics.observeTaskRun('task "1"\\\n', 0.1, False)
+        self.assertEqual(self._getLines(metrics, 'nightwatch_task_runs_total'), ['nightwatch_task_runs_total{task="task \\"1\\"\\\\\\n"} 1.0'])
+
+    def test_collectors(self):
+        metrics = Metrics()
+        metrics.addCollector('action_dispatcher', lambda: {'queue_depth': 3, 'engine': 'background'})
+        metrics.addCollector('broken', lambda: 1 / 0)
+        # Only the numbers are exported, a collector which fails is ignored
+        self.assertEqual(self._getLines(metrics, 'nightwatch_action_dispatcher_queue_depth'), ['nightwatch_action_dispatcher_queue_depth 3.0'])
+        self.assertEqual([line for line in metrics.toPrometheus().splitlines() if 'engine' in line or 'broken' in line], [])
+
+    def test_removed_task(self):
+        metrics = Metrics()
+        metrics.observeTaskRun('task1', 0.1, False)
+        metrics.observeProvider('task1', 0, 'Ping', 0.1, True)
+        metrics.removeTask('task1')
+        self.assertEqual(self._getLines(metrics, 'nightwatch_task_runs_total'), [])
+        self.assertEqual(self._getLines(metrics, 'nightwatch_provider_calls_total'), [])
+
+
+class TestMetricsExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.json_file = os.path.join(self.directory, 'metrics.json')
+        self.exporter = MetricsExporter('127.0.0.1:0', self.json_file, 3600)
+        self.url = 'http://127.0.0.1:' + str(self.exporter._server.server_address[1])
+        getMetrics().observeTaskRun('exported_task', 0.1, False)
+
+    def tearDown(self):
+        self.exporter.stop()
+        getMetrics().removeTask('exported_task')
+        getMetrics().setHealthCheck(None)
+        shutil.rmtree(self.directory)
+
+    def test_prometheus_endpoint(self):
+        response = urllib2.urlopen(self.url + '/metrics', timeout = 5)
+        self.assertEqual(response.info()['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertTrue('nightwatch_task_runs_total{task="exported_task"} 1.0\n' in response.read())
+
+    def test_health_endpoint(self):
+        getMetrics().setHealthCheck(lambda: {'status': 'overloaded'})
+        try:
+            urllib2.urlopen(self.url + '/health', timeout = 5)
+            self.fail('The health endpoint should return 503')
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 503)
+            self.assertEqual(json.loads(e.read()), {'status': 'overloaded'})
+
+    def test_json_file_written_at_stop(self):
+        self.exporter.stop()
+        with open(self.json_file) as f:
+            self.assertEqual(json.load(f)['tasks']['exported_task']['runs'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.providers import Ping as PingModule
+from nw.providers.Ping import Ping, IcmpPingData
+
+
+'''
+Unit tests of the selection of the Ping Provider's engine, and of the ping statistics computed from the ICMP engine's replies.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _IcmpEngine:
+    pass
+
+
+class TestPingEngine(unittest.TestCase):
+
+    def setUp(self):
+        getNwConfiguration().providers_location = '/nonexistent'
+        self._getIcmpEngine = PingModule.getIcmpEngine
+        self.engine_requests = 0
+        self.engine = _IcmpEngine()
+        def getIcmpEngine():
+            self.engine_requests += 1
+            return self.engine
+        PingModule.getIcmpEngine = getIcmpEngine
+
+    def tearDown(self):
+        PingModule.getIcmpEngine = self._getIcmpEngine
+
+    def test_command_engine_by_default(self):
+        ping = Ping({'ping_addr': '127.0.0.1'})
+        self.assertEqual(ping.engine, 'command')
+        # The ICMP socket is not even opened
+        self.assertEqual(ping._getIcmpEngine(), None)
+        self.assertEqual(self.engine_requests, 0)
+
+    def test_icmp_engine_is_opt_in(self):
+        self.assertTrue(Ping({'ping_addr': '127.0.0.1', 'engine': 'icmp'})._getIcmpEngine() is self.engine)
+        self.assertTrue(Ping({'ping_addr': '127.0.0.1', 'engine': 'auto'})._getIcmpEngine() is self.engine)
+
+    def test_icmp_engine_not_available(self):
+        self.engine = None
+        self.assertRaises(Exception, Ping({'ping_addr': '127.0.0.1', 'engine': 'icmp'})._getIcmpEngine)
+        # auto falls back to the ping command
+        self.assertEqual(Ping({'ping_addr': '127.0.0.1', 'engine': 'auto'})._getIcmpEngine(), None)
+
+    def test_ipv6_uses_command(self):
+        self.assertEqual(Ping({'ping_addr': '::1', 'engine': 'icmp'})._getIcmpEngine(), None)
+
+    def test_invalid_engine(self):
+        self.assertRaises(Exception, Ping, {'ping_addr': '127.0.0.1', 'engine': 'raw'})
+
+    def test_icmp_ping_data(self):
+        data = IcmpPingData('127.0.0.1', 4, [1.0, 3.0])
+        self.assertEqual((data.pkt_transmitted, data.pkt_received, data.pkt_loss), (4, 2, 50.0))
+        self.assertEqual((data.ping_min, data.ping_avg, data.ping_max, data.ping_stddev), (1.0, 2.0, 3.0, 1.0))
+        self.assertTrue('4 packets transmitted, 2 received, 50% packet loss' in data.ping_response)
+        data = IcmpPingData('127.0.0.1', 2, [])
+        self.assertEqual((data.pkt_loss, data.ping_avg), (100.0, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import threading
+import time
+
+from nw.core.Icmp import IcmpEngine
+from nw.core.PingSweep import PingSweep
+
+
+'''
+Unit tests of the ping sweep service and of the ICMP engine pinging several targets at once (without any ICMP socket: the echo
+requests are not sent, and the replies are simulated).
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _FakeIcmpEngine(IcmpEngine):
+    # ICMP engine without socket: the addresses in replies reply after their delay, the others never reply
+    def __init__(self, replies):
+        self._replies = replies
+        self._sequence = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.sent = []
+
+    def sendEchoRequest(self, ip, pending):
+        with self._lock:
+            self._sequence += 1
+            pending.keys.append((ip, self._sequence))
+            pending.sent[self._sequence] = time.time()
+            self.sent.append(ip)
+        if ip in self._replies:
+            threading.Timer(self._replies[ip], pending.addReply, [self._replies[ip] * 1000]).start()
+
+
+class _FakeSweepEngine:
+    def __init__(self):
+        self.sweeps = []
+
+    def pingMany(self, targets):
+        self.sweeps.append(targets)
+        return [[1.0] * count for addr, count, timeout in targets]
+
+
+class TestPingMany(unittest.TestCase):
+
+    def test_shared_deadline(self):
+        engine = _FakeIcmpEngine({'127.0.0.1': 0.05})
+        begin = time.time()
+        results = engine.pingMany([('127.0.0.2', 1, 0.4), ('127.0.0.1', 1, 0.4), ('127.0.0.3', 1, 0.4), ('127.0.0.4', 1, 0.4)])
+        # The targets which do not reply are waited for together, not one timeout after the other
+        self.assertTrue(time.time() - begin < 0.8)
+        self.assertEqual(results, [[], [50.0], [], []])
+
+    def test_all_replies_received(self):
+        engine = _FakeIcmpEngine({'127.0.0.1': 0.05, '127.0.0.2': 0.1})
+        begin = time.time()
+        results = engine.pingMany([('127.0.0.1', 1, 5), ('127.0.0.2', 1, 5)])
+        # No need to wait for the timeouts once all the replies have been received
+        self.assertTrue(time.time() - begin < 1)
+        self.assertEqual(results, [[50.0], [100.0]])
+
+    def test_unknown_host(self):
+        engine = _FakeIcmpEngine({})
+        results = engine.pingMany([('unknown.host.invalid', 1, 0.1)])
+        self.assertTrue(isinstance(results[0], Exception))
+        self.assertEqual(engine.sent, [])
+
+
+class TestPingSweep(unittest.TestCase):
+
+    def test_register(self):
+        engine = _FakeSweepEngine()
+        sweep = PingSweep(engine)
+        key = sweep.register('127.0.0.1', 2, 1, 60)
+        self.assertEqual(sweep.register('127.0.0.1', 2, 1, 30), key)
+        self.assertEqual(sweep.getResult(key, 5), [1.0, 1.0])
+        # The target is pinged once for both registrations
+        self.assertEqual(engine.sweeps, [[('127.0.0.1', 2, 1)]])
+
+    def test_unregistered_target(self):
+        sweep = PingSweep(_FakeSweepEngine())
+        key = sweep.register('127.0.0.1', 1, 1, 60)
+        sweep.unregister(key, 60)
+        self.assertEqual(sweep.getResult(key, 0.1), None)
+        self.assertEqual(sweep.getResult(('127.0.0.5', 1, 1), 0.1), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import signal
+import time
+import os
+from concurrent.futures import TimeoutError
+
+from nw.core import ProvidersManager
+from nw.core.ProcessWorkers import ProcessWorkers, RemoteProvider
+
+
+'''
+Unit tests of the Providers run in worker processes.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _WorkerProvider:
+    # Provider returning the pid of the worker process running it, the id of the Provider and its value
+    def __init__(self, options):
+        self.options = options
+
+    def process(self):
+        time.sleep(self.options.get('delay', 0))
+        return os.getpid(), id(self), self.options.get('value')
+
+    def release(self):
+        pass
+
+
+class TestProcessWorkers(unittest.TestCase):
+
+    def setUp(self):
+        # Set before the workers are forked, so that they create the test Provider
+        self._getProviderClass = ProvidersManager.getProviderClass
+        ProvidersManager.getProviderClass = lambda name: _WorkerProvider
+        self.workers = ProcessWorkers(1, ['Worker'], 2)
+
+    def tearDown(self):
+        self.workers.stop()
+        ProvidersManager.getProviderClass = self._getProviderClass
+
+    def _createProvider(self, options, timeout = 5):
+        return RemoteProvider(self.workers, 'task1', 0, 'Worker', options, timeout)
+
+    def test_restart(self):
+        provider = self._createProvider({'value': 1})
+        pid, provider_id, value = provider.process()
+        self.assertEqual(value, 1)
+        self.assertNotEqual(pid, os.getpid())
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.time() + 5
+        while self.workers.getStats() != {'workers': 1, 'pending': 0, 'restarts': 1} and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.workers.getStats(), {'workers': 1, 'pending': 0, 'restarts': 1})
+        # The Provider is created again in the new worker
+        new_pid, provider_id, value = provider.process()
+        self.assertNotEqual(new_pid, pid)
+        self.assertEqual(value, 1)
+
+    def test_replaced_provider(self):
+        provider1 = self._createProvider({'value': 1})
+        # Provider of the task replacing the task of provider1 (changed options)
+        provider2 = self._createProvider({'value': 2})
+        self.assertEqual(provider1.process()[2], 1)
+        pid, provider_id, value = provider2.process()
+        self.assertEqual(value, 2)
+        # The release of the replaced Provider does not release the new one
+        provider1.release()
+        self.assertEqual(provider2.process(), (pid, provider_id, 2))
+
+    def test_timeout(self):
+        provider = self._createProvider({'delay': 2}, timeout = 0.3)
+        begin = time.time()
+        self.assertRaises(TimeoutError, provider.process)
+        self.assertTrue(time.time() - begin < 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import tempfile
+import shutil
+import os
+
+from nw.core.SampleHistory import SampleHistory
+
+
+'''
+Unit tests of the history of the values collected by a provider.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class TestSampleHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history_file = os.path.join(self.directory, 'provider.hist')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_invalid_depth(self):
+        self.assertRaises(ValueError, SampleHistory, 0)
+
+    def test_wrap_around(self):
+        history = SampleHistory(3)
+        self.assertEqual(history.getLast(), None)
+        for i in range(5):
+            history.append(i * 10, i)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.getSamples(), [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0)])
+        self.assertEqual(history.getSamples(2), [(3.0, 30.0), (4.0, 40.0)])
+        self.assertEqual(history.getLast(), (4.0, 40.0))
+
+    def test_values_which_are_not_numbers(self):
+        history = SampleHistory(3)
+        history.append(None, 1)
+        history.append('error', 2)
+        history.append(True, 3)
+        self.assertEqual(history.getSamples(), [(1.0, None), (2.0, None), (3.0, 1.0)])
+
+    def test_persistence(self):
+        history = SampleHistory(3, self.history_file)
+        for i in range(4):
+            history.append(i, i)
+        history.close()
+        # The history can still be read once closed
+        self.assertEqual(history.getSamples(), [(1.0, 1.0), (2.0, 2.0), (3.0, 3.0)])
+        history = SampleHistory(3, self.history_file)
+        self.assertEqual(history.getSamples(), [(1.0, 1.0), (2.0, 2.0), (3.0, 3.0)])
+        history.append(4, 4)
+        self.assertEqual(history.getLast(), (4.0, 4.0))
+        history.close()
+
+    def test_reopen(self):
+        history = SampleHistory(3, self.history_file)
+        history.append(1, 1)
+        history.close()
+        history.reopen()
+        history.append(2, 2)
+        history.close()
+        self.assertEqual(SampleHistory(3, self.history_file).getSamples(), [(1.0, 1.0), (2.0, 2.0)])
+
+    def test_remove(self):
+        history = SampleHistory(3, self.history_file)
+        history.append(1, 1)
+        history.remove()
+        self.assertFalse(os.path.exists(self.history_file))
+        # A history without file can be removed too
+        SampleHistory(3).remove()
+
+    def test_depth_changed(self):
+        history = SampleHistory(3, self.history_file)
+        history.append(1, 1)
+        history.close()
+        # The file written with another depth is reset
+        history = SampleHistory(5, self.history_file)
+        self.assertEqual(len(history), 0)
+        history.close()
+
+    def test_invalid_file(self):
+        history = SampleHistory(2, self.history_file)
+        history.close()
+        with open(self.history_file, 'r+b') as f:
+            f.write('XXXX')
+        history = SampleHistory(2, self.history_file)
+        self.assertEqual(len(history), 0)
+        history.close()
+
+    def test_one_file_descriptor(self):
+        fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+        if fds is None:
+            self.skipTest('/proc/self/fd is not available')
+        histories = [SampleHistory(2, os.path.join(self.directory, str(i) + '.hist')) for i in range(10)]
+        self.assertEqual(len(os.listdir('/proc/self/fd')) - fds, 10)
+        for history in histories:
+            history.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import time
+
+from nw.core.Scheduler import Scheduler, parsePolicy, getPolicyPeriod, stretchPolicy
+
+
+'''
+Unit tests of the policies (periods) of the tasks, and of the rescheduling of the jobs keeping their phase.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class TestParsePolicy(unittest.TestCase):
+
+    def test_interval_units(self):
+        self.assertEqual(parsePolicy('30s'), ('interval', 30))
+        self.assertEqual(parsePolicy('5m'), ('interval', 300))
+        self.assertEqual(parsePolicy('1h'), ('interval', 3600))
+        self.assertEqual(parsePolicy('2d'), ('interval', 172800))
+        self.assertEqual(parsePolicy(' 10s '), ('interval', 10))
+
+    def test_aligned(self):
+        self.assertEqual(parsePolicy('5m aligned'), ('aligned', 300))
+
+    def test_unknown_unit(self):
+        self.assertRaises(Exception, parsePolicy, '1w')
+        self.assertRaises(Exception, parsePolicy, '10x')
+        self.assertRaises(Exception, parsePolicy, 'every minute')
+
+    def test_cron(self):
+        kind, fields = parsePolicy('cron */5 8-18 * * mon-fri')
+        self.assertEqual(kind, 'cron')
+        self.assertEqual(fields, {'minute': '*/5', 'hour': '8-18', 'day': '*', 'month': '*', 'day_of_week': 'mon-fri'})
+
+    def test_cron_bounds(self):
+        parsePolicy('cron 0,59 0,23 1,31 1,12 0,6')
+        for policy in ['cron 60 * * * *', 'cron * 24 * * *', 'cron * * 0 * *', 'cron * * 32 * *', 'cron * * * 0 *', 'cron * * * 13 *',
+                       'cron * * * * 7', 'cron 5-70 * * * *']:
+            self.assertRaises(Exception, parsePolicy, policy)
+
+    def test_cron_zero_step(self):
+        self.assertRaises(Exception, parsePolicy, 'cron */0 * * * *')
+
+    def test_cron_invalid_name(self):
+        self.assertRaises(Exception, parsePolicy, 'cron * * * * foo')
+
+    def test_policy_period(self):
+        self.assertEqual(getPolicyPeriod('5m'), 300)
+        self.assertEqual(getPolicyPeriod('5m aligned'), 300)
+        self.assertEqual(getPolicyPeriod('cron 0 * * * *'), None)
+
+    def test_stretch_policy(self):
+        self.assertEqual(stretchPolicy('30s', 2), '60s')
+        self.assertEqual(stretchPolicy('5m aligned', 2), '600s aligned')
+        self.assertEqual(stretchPolicy('cron 0 * * * *', 2), 'cron 0 * * * *')
+
+
+class TestRescheduleJob(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _getNextRunTime(self, job_name):
+        return time.mktime(self.scheduler.scheduler.get_job(self.scheduler.jobs[job_name]).next_run_time.timetuple())
+
+    def test_keep_phase(self):
+        for i in range(4):
+            self.scheduler.addJob('10s', lambda: None, 'job' + str(i), first_run_delay = 2 * i + 1)
+        phases = [self._getNextRunTime('job' + str(i)) for i in range(4)]
+        for i in range(4):
+            self.scheduler.rescheduleJob('20s', 'job' + str(i), keep_phase = True)
+        # One new period after the latest planned run of each job (its next run minus the previous period)
+        for i in range(4):
+            self.assertAlmostEqual(self._getNextRunTime('job' + str(i)), phases[i] + 10, delta = 1)
+        for i in range(4):
+            self.scheduler.rescheduleJob('10s', 'job' + str(i), keep_phase = True)
+        for i in range(4):
+            self.assertAlmostEqual(self._getNextRunTime('job' + str(i)), phases[i], delta = 1)
+
+    def test_without_phase(self):
+        for i in range(4):
+            self.scheduler.addJob('10s', lambda: None, 'job' + str(i), first_run_delay = 2 * i + 1)
+        for i in range(4):
+            self.scheduler.rescheduleJob('20s', 'job' + str(i))
+        next_run_times = [self._getNextRunTime('job' + str(i)) for i in range(4)]
+        self.assertTrue(max(next_run_times) - min(next_run_times) <= 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from nw.core.Sharding import HashRing
+
+
+'''
+Unit tests of the consistent hashing of the tasks on the sharding instances.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+_tasks = ['task' + str(i) for i in range(1000)]
+
+
+class TestHashRing(unittest.TestCase):
+
+    def _getOwners(self, members):
+        ring = HashRing(members)
+        return dict((task, ring.getOwner(task)) for task in _tasks)
+
+    def test_empty_ring(self):
+        self.assertEqual(HashRing([]).getOwner('task1'), None)
+
+    def test_stable_owner(self):
+        # The owner only depends on the members, not on their order or on the instance computing it
+        self.assertEqual(self._getOwners(['nw1', 'nw2', 'nw3']), self._getOwners(['nw3', 'nw1', 'nw2', 'nw1']))
+
+    def test_balanced(self):
+        owners = self._getOwners(['nw1', 'nw2', 'nw3'])
+        for member in ['nw1', 'nw2', 'nw3']:
+            count = sum(1 for owner in owners.itervalues() if owner == member)
+            self.assertTrue(150 < count < 550, member + ' owns ' + str(count) + ' tasks')
+
+    def test_member_joins(self):
+        before = self._getOwners(['nw1', 'nw2', 'nw3'])
+        after = self._getOwners(['nw1', 'nw2', 'nw3', 'nw4'])
+        moved = [task for task in _tasks if before[task] != after[task]]
+        # Only the tasks taken over by the new instance move
+        self.assertTrue(moved)
+        self.assertTrue(all(after[task] == 'nw4' for task in moved))
+
+    def test_member_leaves(self):
+        before = self._getOwners(['nw1', 'nw2', 'nw3'])
+        after = self._getOwners(['nw1', 'nw3'])
+        # Only the tasks of the instance which left move
+        for task in _tasks:
+            if before[task] != 'nw2':
+                self.assertEqual(after[task], before[task])
+            else:
+                self.assertTrue(after[task] in ('nw1', 'nw3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import threading
+import time
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core import ProvidersManager
+from nw.core import Task as TaskModule
+from nw.core.Task import Task
+from nw.core.Metrics import getMetrics
+
+
+'''
+Unit tests of the collection of the providers values by the tasks, and of their conditions evaluated on a window of values.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _SleepingProvider:
+    # Provider returning its delay after sleeping for it, and counting the calls running at once
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+
+    def __init__(self, options):
+        self.delay = options['delay']
+
+    def process(self):
+        with _SleepingProvider.lock:
+            _SleepingProvider.running += 1
+            _SleepingProvider.peak = max(_SleepingProvider.peak, _SleepingProvider.running)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with _SleepingProvider.lock:
+                _SleepingProvider.running -= 1
+        return self.delay
+
+    def release(self):
+        pass
+
+
+class TestTaskProviders(unittest.TestCase):
+
+    def setUp(self):
+        config = getNwConfiguration()
+        config.scheduler, config.history, config.process_workers = {}, {'depth': 0}, {}
+        self._getProviderClass = ProvidersManager.getProviderClass
+        ProvidersManager.getProviderClass = lambda name: _SleepingProvider
+        _SleepingProvider.running = _SleepingProvider.peak = 0
+
+    def tearDown(self):
+        ProvidersManager.getProviderClass = self._getProviderClass
+        TaskModule.stopProvidersExecutor()
+
+    def _createTask(self, name, delays, max_parallel_providers = None, providers_timeout = None):
+        providers = [{'Sleep': {'condition': 'lower', 'threshold': 10, 'provider_options': {'delay': delay}}} for delay in delays]
+        return Task(name, '1m', '1m', '1m', None, providers, None, None, max_parallel_providers, providers_timeout)
+
+    def test_concurrency(self):
+        task = self._createTask('task1', [0.2] * 6, max_parallel_providers = 2)
+        begin = time.time()
+        results = task._collectProviderResults()
+        self.assertEqual(results, [(True, 0.2)] * 6)
+        self.assertEqual(_SleepingProvider.peak, 2)
+        self.assertTrue(0.5 < time.time() - begin < 1)
+
+    def test_timeout(self):
+        task = self._createTask('task2', [0.1, 2], providers_timeout = 0.5)
+        begin = time.time()
+        self.assertEqual(task._collectProviderResults(), [(True, 0.1), (False, None)])
+        self.assertTrue(time.time() - begin < 1)
+        self.assertEqual([p['abandoned'] for p in getMetrics().toDict()['providers'] if p['task'] == 'task2'], [0, 1])
+
+    def test_abandoned_call_is_not_resubmitted(self):
+        task = self._createTask('task3', [0.05, 1.5], max_parallel_providers = 2, providers_timeout = 0.3)
+        task._collectProviderResults()
+        # The second provider is still running: it is not called again, and keeps its slot of the task
+        self.assertEqual(task._collectProviderResults(), [(True, 0.05), (False, None)])
+        self.assertEqual(_SleepingProvider.peak, 2)
+        time.sleep(1.5)
+        self.assertEqual(task._collectProviderResults(), [(True, 0.05), (False, None)])
+
+    def test_abandoned_calls_count_in_the_task_slots(self):
+        task = self._createTask('task4', [1, 0.05, 0.05], max_parallel_providers = 1, providers_timeout = 0.3)
+        self.assertEqual(task._collectProviderResults(), [(False, None)] * 3)
+        # The first provider holds the only slot of the task until it returns, then the next run submits the other providers
+        time.sleep(1)
+        task.providers[0].delay = 0.05
+        self.assertEqual(task._collectProviderResults(), [(True, 0.05)] * 3)
+        self.assertEqual(_SleepingProvider.peak, 1)
+
+    def test_no_provider(self):
+        task = self._createTask('task5', [])
+        self.assertEqual(task._collectProviderResults(), [])
+
+
+class TestTaskWindows(unittest.TestCase):
+
+    def setUp(self):
+        config = getNwConfiguration()
+        config.scheduler, config.history, config.process_workers, config.task_state = {}, {'depth': 0}, {}, {}
+        self._getProviderClass = ProvidersManager.getProviderClass
+        ProvidersManager.getProviderClass = lambda name: _SleepingProvider
+
+    def tearDown(self):
+        ProvidersManager.getProviderClass = self._getProviderClass
+        TaskModule.stopProvidersExecutor()
+
+    def _createTask(self, name, condition, threshold, **window):
+        window.update({'condition': condition, 'threshold': threshold, 'provider_options': {'delay': 0}})
+        return Task(name, '1m', '1m', '1m', None, [{'Sleep': window}], None, None)
+
+    def test_failed_provider_added_to_window(self):
+        task = self._createTask('task6', 'lower', 10, aggregate = 'k_of_n', window = 3, k = 2)
+        task._processResults([(True, 1)])
+        task._processResults([(False, None)])
+        self.assertEqual(task.getState(), (False, 0))
+        # The second failure of the provider in the window fails the task
+        task._processResults([(False, None)])
+        self.assertEqual(len(task.provider_windows[0]), 3)
+        self.assertEqual(task.getState(), (True, 0))
+
+    def test_k_of_n_on_strings(self):
+        task = self._createTask('task7', 'equals', 'OK', aggregate = 'k_of_n', window = 3, k = 2)
+        for value in ['OK', 'KO']:
+            task._processResults([(True, value)])
+        self.assertEqual(task.getState(), (False, 0))
+        task._processResults([(True, 'KO')])
+        self.assertEqual(task.getState(), (True, 0))
+
+    def test_threshold_must_be_a_number(self):
+        self.assertRaises(ValueError, self._createTask, 'task8', 'lower', 'OK', aggregate = 'avg', window = 3)
+        self.assertRaises(ValueError, self._createTask, 'task8', 'lower', True, aggregate = 'percentile', window = 3, percentile = 90)
+
+
+if __name__ == '__main__':
+    unittest.main()
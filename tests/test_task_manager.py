@@ -0,0 +1,204 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+from nw.core.NwConfiguration import getNwConfiguration
+from nw.core import ProvidersManager
+from nw.core import Task as TaskModule
+from nw.core.SchedulerLoad import SchedulerLoad
+from nw.core.SampleHistory import SampleHistory
+from nw.core.TaskManager import TaskManager
+
+
+'''
+Unit tests of the scheduling of the tasks by the TaskManager, and of the reload of the tasks configuration.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class _Task:
+    def __init__(self, name, period):
+        self.name = name
+        self.period = period
+        self.jitter = None
+
+    def run(self):
+        pass
+
+
+class _Scheduler:
+    # Records the jobs added by the TaskManager
+    engine = 'background'
+
+    def __init__(self):
+        self.jobs = []
+
+    def addJob(self, policy, job_function, job_name, first_run_delay = None, jitter = None):
+        self.jobs.append((job_name, policy, first_run_delay))
+
+    def removeJob(self, job_name):
+        self.jobs = [job for job in self.jobs if job[0] != job_name]
+
+
+class _ValueProvider:
+    def __init__(self, options):
+        self.value = options['value']
+
+    def process(self):
+        return self.value
+
+    def release(self):
+        pass
+
+
+class TestTaskManagerStartup(unittest.TestCase):
+
+    def _schedule(self, tasks, startup_jitter):
+        manager = TaskManager()
+        manager.scheduler = _Scheduler()
+        for task in tasks:
+            manager.tasks[task.name] = task
+        begin = time.time()
+        manager._scheduleTasks(startup_jitter)
+        return manager.scheduler.jobs, time.time() - begin
+
+    def test_startup_jitter_spread(self):
+        tasks = [_Task('task' + str(i), '5m') for i in range(200)]
+        jobs, duration = self._schedule(tasks, 60)
+        self.assertEqual(len(jobs), 200)
+        delays = [delay for name, policy, delay in jobs]
+        self.assertTrue(all(0 <= delay < 60 for delay in delays))
+        # The first runs are spread over the whole window
+        self.assertTrue(min(delays) < 10 and max(delays) > 50)
+        self.assertTrue(len(set(int(delay) for delay in delays)) > 40)
+        # The delay of a task only depends on its name
+        self.assertEqual(jobs, self._schedule(tasks, 60)[0])
+
+    def test_without_startup_jitter(self):
+        tasks = [_Task('task' + str(i), '30s') for i in range(50)]
+        jobs, duration = self._schedule(tasks, None)
+        # The startup does not wait 2 seconds per task, the first runs are 2 seconds apart instead
+        self.assertTrue(duration < 1)
+        self.assertEqual(sorted(delay for name, policy, delay in jobs), [30 + 2 * i for i in range(50)])
+
+    def test_without_startup_jitter_cron(self):
+        jobs, duration = self._schedule([_Task('task1', 'cron 0 * * * *')], None)
+        self.assertEqual(jobs, [('task1', 'cron 0 * * * *', None)])
+
+
+class TestTaskManagerReload(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        config = getNwConfiguration()
+        config.tasks_location = os.path.join(self.directory, 'tasks')
+        config.providers_location = os.path.join(self.directory, 'providers')
+        config.actions_location = os.path.join(self.directory, 'actions')
+        for location in (config.tasks_location, config.providers_location, config.actions_location):
+            os.mkdir(location)
+        config.history = {'depth': 5, 'directory': os.path.join(self.directory, 'history')}
+        config.scheduler, config.task_state, config.sharding, config.process_workers, config.cache_file = {}, {}, {}, {}, None
+        self._getProviderClass = ProvidersManager.getProviderClass
+        ProvidersManager.getProviderClass = lambda name: _ValueProvider
+        self.manager = TaskManager()
+        self.manager.scheduler = _Scheduler()
+        self.manager.scheduler_load = SchedulerLoad(10)
+
+    def tearDown(self):
+        for task in self.manager.tasks.values():
+            task.stop()
+        ProvidersManager.getProviderClass = self._getProviderClass
+        TaskModule.stopProvidersExecutor()
+        shutil.rmtree(self.directory)
+
+    def _writeTasks(self, tasks):
+        # tasks: task name -> value returned by its provider
+        with open(os.path.join(getNwConfiguration().tasks_location, 'tasks.yml'), 'w') as f:
+            for task_name, value in sorted(tasks.iteritems()):
+                f.write(task_name + ':\n  period_success: 1m\n  period_retry: 1m\n  period_failed: 1m\n  providers:\n' + \
+                        '    - Value:\n        condition: lower\n        threshold: 10\n        provider_options:\n          value: ' + str(value) + '\n')
+
+    def test_add_change_remove(self):
+        self._writeTasks({'task1': 1, 'task2': 2, 'task3': 3})
+        self.manager.reload()
+        self.assertEqual(sorted(name for name, policy, delay in self.manager.scheduler.jobs), ['task1', 'task2', 'task3'])
+        task1, task2 = self.manager.tasks['task1'], self.manager.tasks['task2']
+        task2.restoreState(True, 0)
+        # task1 is unchanged, task2 is changed, task3 is removed and task4 is added
+        self._writeTasks({'task1': 1, 'task2': 20, 'task4': 4})
+        self.manager.reload()
+        self.assertEqual(sorted(self.manager.tasks), ['task1', 'task2', 'task4'])
+        self.assertEqual(sorted(name for name, policy, delay in self.manager.scheduler.jobs), ['task1', 'task2', 'task4'])
+        # The unchanged task is kept as it is, the changed task is replaced and keeps its state
+        self.assertTrue(self.manager.tasks['task1'] is task1)
+        self.assertFalse(self.manager.tasks['task2'] is task2)
+        self.assertEqual(self.manager.tasks['task2'].providers[0].value, 20)
+        self.assertEqual(self.manager.tasks['task2'].getState(), (True, 0))
+
+    def test_reload_if_changed(self):
+        self._writeTasks({'task1': 1})
+        self.manager.reload()
+        task1 = self.manager.tasks['task1']
+        self.manager.reloadIfChanged()
+        self.assertTrue(self.manager.tasks['task1'] is task1)
+        self._writeTasks({'task1': 1, 'task2': 2})
+        # The modification time of the file may not have changed, but its size has
+        self.manager.reloadIfChanged()
+        self.assertEqual(sorted(self.manager.tasks), ['task1', 'task2'])
+        self.assertTrue(self.manager.tasks['task1'] is task1)
+
+    def _getHistoryFiles(self):
+        return sorted(os.listdir(getNwConfiguration().history['directory']))
+
+    def test_history_of_reloaded_tasks(self):
+        self._writeTasks({'task1': 1, 'task2': 2})
+        self.manager.reload()
+        for task in self.manager.tasks.values():
+            task.run()
+        self.assertEqual(len(self._getHistoryFiles()), 2)
+        task2_file = self.manager.tasks['task2'].provider_histories[0].history_file
+        # task1 is changed (its history is kept), task2 is removed (its history file is deleted)
+        self._writeTasks({'task1': 3})
+        self.manager.reload()
+        self.assertEqual(self._getHistoryFiles(), [os.path.basename(self.manager.tasks['task1'].provider_histories[0].history_file)])
+        self.assertFalse(os.path.exists(task2_file))
+        self.manager.tasks['task1'].run()
+        self.assertEqual([value for timestamp, value in self.manager.tasks['task1'].provider_histories[0].getSamples()], [1.0, 3.0])
+
+    def test_history_kept_if_changed_task_is_invalid(self):
+        self._writeTasks({'task1': 1})
+        self.manager.reload()
+        task = self.manager.tasks['task1']
+        task.run()
+        # The new configuration of the task is not valid
+        self._writeTasks({'task1': 2})
+        with open(os.path.join(getNwConfiguration().tasks_location, 'tasks.yml'), 'a') as f:
+            f.write('        history_depth: -1\n')
+        self.manager.reload()
+        # The previous task is kept, and its history is still written to its file
+        self.assertTrue(self.manager.tasks['task1'] is task)
+        task.run()
+        task.stop()
+        self.manager.tasks = {}
+        self.assertEqual(len(SampleHistory(5, task.provider_histories[0].history_file).getSamples()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
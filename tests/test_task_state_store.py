@@ -0,0 +1,100 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+from nw.core.TaskStateStore import TaskStateStore
+
+
+'''
+Unit tests of the store of the tasks states.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class TestTaskStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.directory, 'state', 'task-state.db')
+        self.shared_directory = os.path.join(self.directory, 'shared')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _open(self, state_file = None, shared_directory = None):
+        # Long flush interval: the states are only written by flush and stop
+        return TaskStateStore(state_file or self.state_file, 3600, shared_directory)
+
+    def test_update_and_reload(self):
+        store = self._open()
+        self.assertEqual(store.get('task1'), None)
+        store.update('task1', True, 0)
+        store.update('task2', False, 2)
+        # The pending updates are read before they are written
+        self.assertEqual(store.get('task1'), (True, 0))
+        store.stop()
+        store = self._open()
+        self.assertEqual(store.get('task1'), (True, 0))
+        self.assertEqual(store.get('task2'), (False, 2))
+        store.stop()
+
+    def test_latest_update_wins(self):
+        store = self._open()
+        store.update('task1', True, 0)
+        store.flush()
+        store.update('task1', False, 3)
+        store.stop()
+        store = self._open()
+        self.assertEqual(store.get('task1'), (False, 3))
+        store.stop()
+
+    def test_retain(self):
+        store = self._open()
+        store.update('task1', True, 0)
+        store.update('task2', True, 0)
+        store.flush()
+        store.retain(['task2', 'task3'])
+        self.assertEqual(store.get('task1'), None)
+        self.assertEqual(store.get('task2'), (True, 0))
+        store.stop()
+        store = self._open()
+        self.assertEqual(store.get('task1'), None)
+        store.stop()
+
+    def test_shared_handoff(self):
+        store1 = self._open(os.path.join(self.directory, 'nw1.db'), self.shared_directory)
+        store2 = self._open(os.path.join(self.directory, 'nw2.db'), self.shared_directory)
+        store1.update('task1', True, 0)
+        store1.flush()
+        # The task moved to the second instance gets its state from the shared directory
+        self.assertEqual(store2.get('task1'), (True, 0))
+        time.sleep(0.01)
+        store2.update('task1', False, 3)
+        store2.flush()
+        # Back to the first instance: the state of the second instance is more recent than its own
+        self.assertEqual(store1.get('task1'), (False, 3))
+        store1.retain([])
+        self.assertEqual(os.listdir(self.shared_directory), [])
+        store1.stop()
+        store2.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
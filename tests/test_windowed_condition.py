@@ -0,0 +1,119 @@
+#!/usr/bin/env python2.7
+# Copyright (c) 2014 Alcatel-Lucent Enterprise
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+import operator
+from decimal import Decimal
+
+from nw.core.WindowedCondition import WindowedCondition
+
+
+'''
+Unit tests of the conditions evaluated on a window of the latest values of a provider.
+Run from the repository root with: PYTHONPATH=src python -m unittest discover -s tests -p 'test_*.py'
+'''
+
+class TestWindowedCondition(unittest.TestCase):
+
+    def _fill(self, window, values):
+        for timestamp, value in enumerate(values):
+            window.add(value, timestamp)
+        return window
+
+    def test_avg_size(self):
+        window = self._fill(WindowedCondition('avg', operator.lt, 10, size = 3), [30, 1, 2, 3])
+        self.assertEqual(len(window), 3)
+        self.assertEqual(window.getValue(), 2.0)
+        self.assertTrue(window.isConform())
+
+    def test_avg_duration(self):
+        window = WindowedCondition('avg', operator.lt, 10, duration = 10)
+        window.add(100, 0)
+        window.add(1, 5)
+        self.assertEqual(window.getValue(), 50.5)
+        window.add(3, 11)
+        self.assertEqual(window.getValue(), 2.0)
+
+    def test_percentile(self):
+        window = self._fill(WindowedCondition('percentile', operator.lt, 15, size = 10, percentile = 90), range(1, 21))
+        # Nearest rank: 9th of the values 11 to 20
+        self.assertEqual(window.getValue(), 19)
+        self.assertFalse(window.isConform())
+        window = self._fill(WindowedCondition('percentile', operator.lt, 90, size = 10, percentile = 50), [5, 1, 4, 2, 3])
+        self.assertEqual(window.getValue(), 3)
+
+    def test_rate(self):
+        window = self._fill(WindowedCondition('rate', operator.lt, 5, size = 3), [0, 10, 20, 30])
+        self.assertEqual(window.getValue(), 10.0)
+        self.assertFalse(window.isConform())
+
+    def test_k_of_n(self):
+        window = self._fill(WindowedCondition('k_of_n', operator.lt, 10, size = 5, k = 2), [1, 20, 1, 1, 1])
+        self.assertEqual(window.getValue(), 1)
+        self.assertTrue(window.isConform())
+        window.add(30, 5)
+        self.assertEqual(window.getValue(), 2)
+        self.assertFalse(window.isConform())
+
+    def test_empty_window_is_conform(self):
+        self.assertTrue(WindowedCondition('avg', operator.lt, 10, size = 3).isConform())
+
+    def test_failed_values_count_for_k_of_n(self):
+        window = self._fill(WindowedCondition('k_of_n', operator.lt, 10, size = 3, k = 2), [1, None, 'error'])
+        self.assertEqual(window.getValue(), 2)
+        self.assertFalse(window.isConform())
+        # The failed values leave the window like the others
+        self._fill(window, [1, 1, 1])
+        self.assertEqual(window.getValue(), 0)
+
+    def test_failed_latest_value_is_not_conform(self):
+        window = self._fill(WindowedCondition('avg', operator.lt, 10, size = 3), [1, None])
+        self.assertEqual(window.getValue(), 1.0)
+        self.assertFalse(window.isConform())
+        window.add(2, 2)
+        self.assertEqual(window.getValue(), 1.5)
+        self.assertTrue(window.isConform())
+
+    def test_failed_values_are_not_aggregated(self):
+        window = self._fill(WindowedCondition('rate', operator.lt, 10, size = 4), [None, 1, None, 3])
+        self.assertEqual(window.getValue(), 1.0)
+        window = self._fill(WindowedCondition('percentile', operator.lt, 10, size = 3, percentile = 50), [5, None, 1, 3, None])
+        # The window is [1, 3, None]
+        self.assertEqual(window.getValue(), 1)
+
+    def test_decimals_are_numbers(self):
+        window = self._fill(WindowedCondition('avg', operator.lt, 10, size = 3), [Decimal('1.5'), Decimal('2.5')])
+        self.assertEqual(window.getValue(), 2.0)
+        self.assertTrue(window.isConform())
+
+    def test_booleans_are_not_aggregated(self):
+        window = self._fill(WindowedCondition('avg', operator.ge, 0.5, size = 4), [True, 1, False])
+        self.assertEqual(window.getValue(), 1.0)
+        self.assertFalse(window.isConform())
+
+    def test_k_of_n_compares_raw_values(self):
+        window = self._fill(WindowedCondition('k_of_n', operator.eq, 'OK', size = 3, k = 2), ['OK', 'KO', 'OK'])
+        self.assertEqual(window.getValue(), 1)
+        self.assertTrue(window.isConform())
+        window.add('KO', 3)
+        self.assertEqual(window.getValue(), 2)
+        self.assertFalse(window.isConform())
+        window = self._fill(WindowedCondition('k_of_n', operator.eq, True, size = 3, k = 1), [True, True, True])
+        self.assertEqual(window.getValue(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()